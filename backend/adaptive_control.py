@@ -0,0 +1,157 @@
+# adaptive_control.py
+import threading
+import time
+from typing import Dict, Any, Optional
+
+
+class AdjustableSemaphore:
+    """Counting semaphore whose limit can be changed while permits are held.
+
+    Lowering the limit never revokes permits: it takes effect as holders release.
+    """
+
+    def __init__(self, limit: int):
+        self._cond = threading.Condition()
+        self._limit = max(1, limit)
+        self._in_use = 0
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def in_use(self) -> int:
+        return self._in_use
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._in_use < self._limit, timeout):
+                return False
+            self._in_use += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            if self._in_use > 0:
+                self._in_use -= 1
+            self._cond.notify()
+
+    def set_limit(self, limit: int):
+        with self._cond:
+            self._limit = max(1, limit)
+            self._cond.notify_all()
+
+
+class AIMDController:
+    """Additive-increase / multiplicative-decrease control of batch size and in-flight calls.
+
+    After `increase_every` consecutive successes the batch token budget grows by
+    `batch_step` and concurrency by one. A rate-limit or deadline error cuts both
+    by `decrease_factor`, at most once per `decrease_cooldown` seconds so that a
+    burst of in-flight failures counts as one congestion signal. A Retry-After
+    from the server pauses all new calls until it has elapsed.
+    """
+
+    def __init__(
+        self,
+        batch_tokens: int = 3000,
+        min_batch_tokens: int = 500,
+        max_batch_tokens: int = 20000,
+        batch_step: int = 500,
+        concurrency: int = 1,
+        min_concurrency: int = 1,
+        max_concurrency: int = 4,
+        increase_every: int = 4,
+        decrease_factor: float = 0.5,
+        decrease_cooldown: float = 5.0,
+    ):
+        self.min_batch_tokens = max(1, min_batch_tokens)
+        self.max_batch_tokens = max(self.min_batch_tokens, max_batch_tokens)
+        self.batch_step = max(1, batch_step)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.increase_every = max(1, increase_every)
+        self.decrease_factor = min(max(decrease_factor, 0.1), 0.95)
+        self.decrease_cooldown = decrease_cooldown
+
+        self._lock = threading.Lock()
+        self._batch_tokens = min(max(batch_tokens, self.min_batch_tokens), self.max_batch_tokens)
+        self.slots = AdjustableSemaphore(min(max(concurrency, self.min_concurrency), self.max_concurrency))
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._paused_until = 0.0
+        self.stats = {"successes": 0, "throttles": 0, "deadlines": 0, "increases": 0, "decreases": 0}
+        self.last_retry_after: Optional[float] = None
+
+    @property
+    def batch_tokens(self) -> int:
+        return self._batch_tokens
+
+    @property
+    def concurrency(self) -> int:
+        return self.slots.limit
+
+    def wait_if_paused(self):
+        """Block while a server-requested Retry-After pause is in effect."""
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def on_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            self._successes += 1
+            if self._successes < self.increase_every:
+                return
+            self._successes = 0
+            if time.monotonic() - self._last_decrease < self.decrease_cooldown:
+                return
+            grew = False
+            if self._batch_tokens < self.max_batch_tokens:
+                self._batch_tokens = min(self.max_batch_tokens, self._batch_tokens + self.batch_step)
+                grew = True
+            if self.slots.limit < self.max_concurrency:
+                self.slots.set_limit(self.slots.limit + 1)
+                grew = True
+            if grew:
+                self.stats["increases"] += 1
+
+    def _decrease(self, kind: str, retry_after: Optional[float]):
+        now = time.monotonic()
+        with self._lock:
+            self.stats[kind] += 1
+            self._successes = 0
+            if retry_after and retry_after > 0:
+                self.last_retry_after = retry_after
+                self._paused_until = max(self._paused_until, now + retry_after)
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self._batch_tokens = max(self.min_batch_tokens, int(self._batch_tokens * self.decrease_factor))
+            self.slots.set_limit(max(self.min_concurrency, int(self.slots.limit * self.decrease_factor)))
+            self.stats["decreases"] += 1
+        print(f"📉 AIMD backoff after {kind}: batch_tokens={self._batch_tokens}, concurrency={self.slots.limit}")
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Server said slow down (429 / rate limit / resource exhausted)."""
+        self._decrease("throttles", retry_after)
+
+    def on_deadline(self, retry_after: Optional[float] = None):
+        """A call timed out: usually the batch is too big for the deadline."""
+        self._decrease("deadlines", retry_after)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self.stats,
+                "batch_tokens": self._batch_tokens,
+                "concurrency": self.slots.limit,
+                "in_flight": self.slots.in_use,
+                "batch_tokens_range": [self.min_batch_tokens, self.max_batch_tokens],
+                "concurrency_range": [self.min_concurrency, self.max_concurrency],
+                "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                "last_retry_after": self.last_retry_after,
+            }
@@ -0,0 +1,183 @@
+# answer_cache.py
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() != "false"
+_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))       # cosine similarity for a hit
+_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 24 * 3600))
+_MAX_PER_DOCUMENT = int(os.getenv("SEMANTIC_CACHE_MAX_PER_DOCUMENT", 200))
+_MAX_DOCUMENTS = int(os.getenv("SEMANTIC_CACHE_MAX_DOCUMENTS", 1000))
+
+
+class _DocumentAnswers:
+    """One document's cached answers, most recently used last, plus their stacked question embeddings."""
+
+    __slots__ = ("entries", "_matrix")
+
+    def __init__(self):
+        self.entries: List[Dict[str, Any]] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix = np.vstack([e["embedding"] for e in self.entries])
+        return self._matrix
+
+    def changed(self):
+        self._matrix = None
+
+
+class SemanticAnswerCache:
+    """Per-document cache of Q&A answers, looked up by question-embedding similarity.
+
+    A question whose embedding is within `threshold` cosine similarity of a cached
+    question for the same document (and prompt variant) gets the cached answer back
+    without retrieval or a generation call. Each answer also records the document
+    `version` it was generated against (e.g. its content hash and indexing progress,
+    read from Firestore so other workers' re-processing is seen); an answer stored
+    under a different version is never returned. Entries expire after `ttl_seconds`; each
+    document keeps its `max_per_document` most recently used answers and the cache
+    keeps its `max_documents` most recently used documents.
+    """
+
+    def __init__(self, threshold: float = _THRESHOLD, ttl_seconds: float = _TTL_SECONDS,
+                 max_per_document: int = _MAX_PER_DOCUMENT, max_documents: int = _MAX_DOCUMENTS,
+                 enabled: bool = _ENABLED):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_per_document = max(1, max_per_document)
+        self.max_documents = max(1, max_documents)
+        self.enabled = enabled
+        self._docs: "OrderedDict[str, _DocumentAnswers]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "expirations": 0, "evictions": 0, "invalidations": 0,
+                      "stale": 0}
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        v = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        return v / (np.linalg.norm(v) + 1e-8)
+
+    def _expire_locked(self, doc: _DocumentAnswers, now: float):
+        live = [e for e in doc.entries if now - e["created_at"] < self.ttl_seconds]
+        if len(live) != len(doc.entries):
+            self.stats["expirations"] += len(doc.entries) - len(live)
+            doc.entries = live
+            doc.changed()
+
+    def _drop_stale_locked(self, doc: _DocumentAnswers, version: str):
+        live = [e for e in doc.entries if e["version"] == version]
+        if len(live) != len(doc.entries):
+            self.stats["stale"] += len(doc.entries) - len(live)
+            doc.entries = live
+            doc.changed()
+
+    def lookup(self, doc_id: str, query_emb, variant: str = "default",
+               version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Return the cached {question, answer, chunk_ids, similarity} closest to the query, or None.
+
+        Answers stored under another document version are misses; with a known
+        `version` they are dropped, since the document has changed since.
+        """
+        if not self.enabled:
+            return None
+        q = self._normalize(query_emb)
+        now = time.time()
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            if doc is not None:
+                self._expire_locked(doc, now)
+                if version is not None:
+                    self._drop_stale_locked(doc, version)
+            if not doc or not doc.entries:
+                self.stats["misses"] += 1
+                return None
+            matrix = doc.matrix()
+            if matrix.shape[1] != q.shape[0]:
+                self.stats["misses"] += 1
+                return None
+            sims = matrix @ q
+            for e, entry in enumerate(doc.entries):
+                if entry["variant"] != variant or entry["version"] != version:
+                    sims[e] = -1.0
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            entry = doc.entries.pop(best)
+            doc.entries.append(entry)  # most recently used last
+            doc.changed()
+            self._docs.move_to_end(doc_id)
+            self.stats["hits"] += 1
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "chunk_ids": list(entry["chunk_ids"]),
+                "similarity": round(float(sims[best]), 4),
+            }
+
+    def store(self, doc_id: str, query_emb, question: str, answer: str, chunk_ids: List[Any],
+              variant: str = "default", version: Optional[str] = None):
+        if not self.enabled or not answer:
+            return
+        entry = {
+            "embedding": self._normalize(query_emb),
+            "question": question,
+            "answer": answer,
+            "chunk_ids": list(chunk_ids),
+            "variant": variant,
+            "version": version,
+            "created_at": time.time(),
+        }
+        with self._lock:
+            doc = self._docs.get(doc_id)
+            if doc is None:
+                doc = self._docs[doc_id] = _DocumentAnswers()
+            self._docs.move_to_end(doc_id)
+            doc.entries.append(entry)
+            doc.changed()
+            self.stats["stores"] += 1
+            while len(doc.entries) > self.max_per_document:
+                doc.entries.pop(0)
+                self.stats["evictions"] += 1
+            while len(self._docs) > self.max_documents:
+                _, evicted = self._docs.popitem(last=False)
+                self.stats["evictions"] += len(evicted.entries)
+
+    def invalidate(self, doc_id: str):
+        """Drop every answer for a document (its chunks are being rewritten)."""
+        with self._lock:
+            if self._docs.pop(doc_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate_percent": round(self.stats["hits"] / lookups * 100, 2) if lookups else 0,
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "documents": len(self._docs),
+                "entries": sum(len(doc.entries) for doc in self._docs.values()),
+            }
+
+
+# Global answer cache instance (lazy initialization)
+answer_cache = None
+
+def get_answer_cache():
+    """Get or create the global semantic answer cache."""
+    global answer_cache
+    if answer_cache is None:
+        answer_cache = SemanticAnswerCache()
+    return answer_cache
@@ -0,0 +1,325 @@
+# cache_backends.py
+import os
+import abc
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from memory_cache import StripedMemoryCache
+from resp_client import RespClient, RespError
+
+_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()   # "memory" | "sqlite" | "redis"
+_NAMESPACE = os.getenv("CACHE_NAMESPACE", "lexplain:cache:v1")  # change to drop every shared entry at once
+_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(".cache", "results.sqlite3"))
+_SQLITE_MAX_ENTRIES = int(os.getenv("CACHE_SQLITE_MAX_ENTRIES", 100000))
+_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", 1024))  # 0 disables compression
+
+# One header byte says how the payload after it is encoded
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def serialize(value: Any, compress_min_bytes: int = _COMPRESS_MIN_BYTES) -> bytes:
+    """Pickle (protocol 5), zlib-compressed when that is worth it, behind a one-byte header."""
+    data = pickle.dumps(value, protocol=5)
+    if compress_min_bytes and len(data) >= compress_min_bytes:
+        packed = zlib.compress(data, 6)
+        if len(packed) < len(data):
+            return _ZLIB + packed
+    return _RAW + data
+
+
+def deserialize(blob: bytes) -> Any:
+    header, payload = blob[:1], blob[1:]
+    if header == _ZLIB:
+        payload = zlib.decompress(payload)
+    elif header != _RAW:
+        raise ValueError(f"Unknown cache payload header: {header!r}")
+    return pickle.loads(payload)
+
+
+class CacheBackend(abc.ABC):
+    """Where CachingSystem results are stored.
+
+    `get` returns None on a miss (or any backend error); `set` returns False if
+    the value was not stored. `shared` backends are visible to every process,
+    so CachingSystem keeps a short-lived copy of hot entries in memory in front.
+    """
+
+    kind = "base"
+    shared = False
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def clear(self):
+        ...
+
+    def purge_expired(self) -> int:
+        return 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.kind}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """This process's StripedMemoryCache; values are kept as objects, never serialized."""
+
+    kind = "memory"
+
+    def __init__(self, cache: StripedMemoryCache):
+        self.cache = cache
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.cache.get(key)
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        return self.cache.set(key, value, ttl_seconds=ttl_seconds)
+
+    def delete(self, key: str) -> bool:
+        return self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def purge_expired(self) -> int:
+        return self.cache.purge_expired()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.kind, **self.cache.get_stats()}
+
+
+class _SerializedBackend(CacheBackend):
+    """Shared bookkeeping for backends that store serialized values under a namespace prefix."""
+
+    shared = True
+
+    def __init__(self, namespace: str, compress_min_bytes: int):
+        self.namespace = namespace
+        self.compress_min_bytes = compress_min_bytes
+        self._stats_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0, "bytes_written": 0, "compressed": 0}
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _encode(self, value: Any) -> bytes:
+        blob = serialize(value, self.compress_min_bytes)
+        with self._stats_lock:
+            self.stats["sets"] += 1
+            self.stats["bytes_written"] += len(blob)
+            if blob[:1] == _ZLIB:
+                self.stats["compressed"] += 1
+        return blob
+
+    def _decode(self, blob: Optional[bytes]) -> Optional[Any]:
+        if blob is None:
+            self._count("misses")
+            return None
+        try:
+            value = deserialize(blob)
+        except Exception as e:
+            # Written by an incompatible build; treat as a miss and let the caller overwrite it
+            print(f"⚠️ Undecodable {self.kind} cache entry: {e}")
+            self._count("errors")
+            self._count("misses")
+            return None
+        self._count("hits")
+        return value
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "backend": self.kind,
+            "namespace": self.namespace,
+            **stats,
+            "hit_rate_percent": round(stats["hits"] / lookups * 100, 2) if lookups else 0,
+        }
+
+
+class SQLiteCacheBackend(_SerializedBackend):
+    """Results in a SQLite file, shared by every process on the host and kept across restarts.
+
+    Expired rows are skipped on read and deleted periodically; past
+    `max_entries`, the rows closest to expiry are dropped first.
+    """
+
+    kind = "sqlite"
+    _PURGE_EVERY = 500  # sets between expiry/size sweeps
+
+    def __init__(self, path: str = _SQLITE_PATH, namespace: str = _NAMESPACE,
+                 compress_min_bytes: int = _COMPRESS_MIN_BYTES, max_entries: int = _SQLITE_MAX_ENTRIES):
+        super().__init__(namespace, compress_min_bytes)
+        self.path = path
+        self.max_entries = max_entries
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_expires_at ON results(expires_at)")
+        self._lock = threading.Lock()
+        self._sets_since_purge = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM results WHERE key = ? AND expires_at > ?", (self._key(key), time.time())
+                ).fetchone()
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache read failed: {e}")
+            self._count("errors")
+            self._count("misses")
+            return None
+        return self._decode(row[0] if row else None)
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        blob = self._encode(value)
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (self._key(key), sqlite3.Binary(blob), time.time() + ttl_seconds),
+                )
+                self._sets_since_purge += 1
+                if self._sets_since_purge >= self._PURGE_EVERY:
+                    self._sets_since_purge = 0
+                    self._purge_locked()
+            return True
+        except sqlite3.Error as e:
+            print(f"⚠️ SQLite cache write failed: {e}")
+            self._count("errors")
+            return False
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("DELETE FROM results WHERE key = ?", (self._key(key),)).rowcount > 0
+
+    def clear(self):
+        """Drop this namespace's entries (other namespaces sharing the file are left alone)."""
+        prefix = f"{self.namespace}:"
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+    def _purge_locked(self) -> int:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            removed = self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),)).rowcount
+            count = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries + self.max_entries // 10
+                removed += self._conn.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY expires_at LIMIT ?)",
+                    (excess,),
+                ).rowcount
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return removed
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_locked()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        return {**super().get_stats(), "entries": entries, "path": self.path}
+
+
+class RedisCacheBackend(_SerializedBackend):
+    """Results on a Redis-protocol server, shared by every replica.
+
+    Uses only GET, SET with PX, DEL and SCAN, so any RESP server that implements
+    those works; the server expires entries. If it is unreachable, reads miss
+    and writes are dropped (CachingSystem's in-memory tier still serves this process).
+    """
+
+    kind = "redis"
+
+    def __init__(self, client: RespClient, namespace: str = _NAMESPACE,
+                 compress_min_bytes: int = _COMPRESS_MIN_BYTES):
+        super().__init__(namespace, compress_min_bytes)
+        self.client = client
+
+    def _failed(self, action: str, e: Exception):
+        print(f"⚠️ Redis cache {action} failed: {e}")
+        self._count("errors")
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            blob = self.client.execute("GET", self._key(key))
+        except (OSError, ConnectionError, RespError) as e:
+            self._failed("read", e)
+            self._count("misses")
+            return None
+        return self._decode(blob)
+
+    def set(self, key: str, value: Any, ttl_seconds: float) -> bool:
+        blob = self._encode(value)
+        try:
+            self.client.execute("SET", self._key(key), blob, "PX", max(1, int(ttl_seconds * 1000)))
+            return True
+        except (OSError, ConnectionError, RespError) as e:
+            self._failed("write", e)
+            return False
+
+    def delete(self, key: str) -> bool:
+        try:
+            return self.client.execute("DEL", self._key(key)) > 0
+        except (OSError, ConnectionError, RespError) as e:
+            self._failed("delete", e)
+            return False
+
+    def clear(self):
+        """Drop this namespace's keys, a SCAN page at a time."""
+        cursor = "0"
+        try:
+            while True:
+                cursor, keys = self.client.execute("SCAN", cursor, "MATCH", f"{self.namespace}:*", "COUNT", 500)
+                cursor = cursor.decode("utf-8") if isinstance(cursor, bytes) else str(cursor)
+                if keys:
+                    self.client.execute("DEL", *keys)
+                if cursor == "0":
+                    break
+        except (OSError, ConnectionError, RespError) as e:
+            self._failed("clear", e)
+
+
+def create_cache_backend(memory_cache: StripedMemoryCache, kind: str = _BACKEND) -> CacheBackend:
+    """Build the configured backend, falling back to the in-memory one if it can't start."""
+    try:
+        if kind == "sqlite":
+            return SQLiteCacheBackend(_SQLITE_PATH)
+        if kind == "redis":
+            client = RespClient(_REDIS_URL)
+            client.ping()
+            return RedisCacheBackend(client)
+    except Exception as e:
+        print(f"Cache backend '{kind}' unavailable ({e}); falling back to in-memory")
+    return MemoryCacheBackend(memory_cache)
@@ -4,10 +4,19 @@ import json
 import logging
 import hashlib
 import time
+import threading
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta
-from google import genai
 from google.genai import types
+from llm_gateway import get_llm_gateway
+from memory_cache import StripedMemoryCache
+from cache_backends import create_cache_backend
+
+_MEMORY_MAX_MB = float(os.getenv("CACHE_MEMORY_MAX_MB", 256))
+_MEMORY_POLICY = os.getenv("CACHE_MEMORY_POLICY", "lru").lower()   # "lru" | "lfu"
+_MEMORY_STRIPES = int(os.getenv("CACHE_MEMORY_STRIPES", 16))
+# With a shared backend, entries read from it stay in process memory at most this long
+_NEAR_TTL_SECONDS = float(os.getenv("CACHE_NEAR_TTL_SECONDS", 300))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -18,16 +27,19 @@ class CachingSystem:
         self._api_key = os.getenv("GEMINI_API_KEY")
         if not self._api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
-        self.client = genai.Client(api_key=self._api_key)
+        self.llm = get_llm_gateway()
         
-        # In-memory cache for development (in production, use Redis or similar)
-        self.memory_cache = {}
+        # Bounded, lock-striped in-memory cache (hit/miss/eviction counters live in it)
+        self.memory_cache = StripedMemoryCache(
+            max_bytes=int(_MEMORY_MAX_MB * 1024 * 1024), stripes=_MEMORY_STRIPES, policy=_MEMORY_POLICY
+        )
+        # Memory, SQLite or Redis-protocol store; a shared one is fronted by memory_cache
+        self.backend = create_cache_backend(self.memory_cache)
         self.gemini_caches = {}  # Store Gemini cache IDs
         
-        # Cache statistics
+        # Gemini cache statistics (memory cache statistics come from memory_cache.get_stats())
+        self._stats_lock = threading.Lock()
         self.cache_stats = {
-            "hits": 0,
-            "misses": 0,
             "created": 0,
             "expired": 0
         }
@@ -57,8 +69,7 @@ class CachingSystem:
             # Create the cache
             ttl_seconds = ttl_hours * 3600
             
-            cache_response = self.client.caches.create({
-                "model": "gemini-2.0-flash-exp",
+            cache_response = self.llm.create_cache("gemini-2.0-flash-exp", {
                 "contents": cache_contents,
                 "system_instruction": "You are analyzing legal document chunks. Use this cached content for analysis.",
                 "ttl": f"{ttl_seconds}s"
@@ -75,7 +86,7 @@ class CachingSystem:
                 "chunk_count": len(chunks)
             }
             
-            self.cache_stats["created"] += 1
+            self._count("created")
             
             logger.info(f"🗃️ Created document cache: {cache_name}")
             logger.info(f"   Document ID: {document_id}")
@@ -104,8 +115,7 @@ class CachingSystem:
             # Create cache for analysis
             ttl_seconds = ttl_hours * 3600
             
-            cache_response = self.client.caches.create({
-                "model": "gemini-2.0-flash-exp",
+            cache_response = self.llm.create_cache("gemini-2.0-flash-exp", {
                 "contents": [{"role": "user", "parts": [{"text": content}]}],
                 "system_instruction": f"You are performing {analysis_type} analysis. Use this cached content.",
                 "ttl": f"{ttl_seconds}s"
@@ -120,7 +130,7 @@ class CachingSystem:
                 "expires_at": time.time() + ttl_seconds
             }
             
-            self.cache_stats["created"] += 1
+            self._count("created")
             
             logger.info(f"🧠 Created analysis cache: {cache_name} for {analysis_type}")
             
@@ -130,56 +140,64 @@ class CachingSystem:
             logger.error(f"❌ Error creating analysis cache: {e}")
             return None
     
+    def _count(self, name: str, n: int = 1):
+        with self._stats_lock:
+            self.cache_stats[name] += n
+    
     def get_cached_result(self, cache_key: str) -> Optional[Any]:
-        """Get result from memory cache."""
-        if cache_key in self.memory_cache:
-            cache_entry = self.memory_cache[cache_key]
-            if cache_entry["expires_at"] > time.time():
-                self.cache_stats["hits"] += 1
-                logger.info(f"✅ Cache hit for key: {cache_key}")
-                return cache_entry["data"]
-            else:
-                # Cache expired
-                del self.memory_cache[cache_key]
-                self.cache_stats["expired"] += 1
-                logger.info(f"⏰ Cache expired for key: {cache_key}")
+        """Get result from memory cache, then from the shared backend if there is one."""
+        data = self.memory_cache.get(cache_key)
+        if data is None and self.backend.shared:
+            data = self.backend.get(cache_key)
+            if data is not None:
+                self.memory_cache.set(cache_key, data, ttl_seconds=_NEAR_TTL_SECONDS)
+        if data is not None:
+            logger.info(f"✅ Cache hit for key: {cache_key}")
+            return data
         
-        self.cache_stats["misses"] += 1
         logger.info(f"❌ Cache miss for key: {cache_key}")
         return None
     
     def store_cached_result(self, cache_key: str, data: Any, ttl_hours: int = 2):
-        """Store result in memory cache."""
-        expires_at = time.time() + (ttl_hours * 3600)
-        self.memory_cache[cache_key] = {
-            "data": data,
-            "created_at": time.time(),
-            "expires_at": expires_at
-        }
-        logger.info(f"💾 Stored result in cache: {cache_key} (TTL: {ttl_hours}h)")
+        """Store result in the backend (and, for a shared backend, briefly in memory too)."""
+        ttl_seconds = ttl_hours * 3600
+        if self.backend.shared:
+            self.memory_cache.set(cache_key, data, ttl_seconds=min(ttl_seconds, _NEAR_TTL_SECONDS))
+        if self.backend.set(cache_key, data, ttl_seconds):
+            logger.info(f"💾 Stored result in {self.backend.kind} cache: {cache_key} (TTL: {ttl_hours}h)")
+        else:
+            logger.warning(f"⚠️ Result not stored in {self.backend.kind} cache: {cache_key}")
     
-    def generate_cache_key(self, *args) -> str:
-        """Generate a cache key from arguments."""
+    def generate_cache_key(self, *args, prompt_version: Optional[str] = None, model: Optional[str] = None) -> str:
+        """Generate a cache key from arguments, prefixed by prompt version and model when given.
+
+        Entries written under an older prompt or another model then simply stop
+        matching, in every process sharing the backend.
+        """
         combined = "_".join(str(arg) for arg in args)
-        return hashlib.md5(combined.encode()).hexdigest()
+        digest = hashlib.md5(combined.encode()).hexdigest()
+        if prompt_version is None and model is None:
+            return digest
+        return f"p{prompt_version or '-'}:{model or '-'}:{digest}"
+    
+    def clear_results(self):
+        """Drop every cached result: this process's memory tier and the backend's namespace."""
+        self.memory_cache.clear()
+        if self.backend.shared:
+            self.backend.clear()
     
     def cleanup_expired_caches(self):
         """Clean up expired caches."""
         current_time = time.time()
-        expired_keys = []
-        
-        # Clean memory cache
-        for key, entry in self.memory_cache.items():
-            if entry["expires_at"] <= current_time:
-                expired_keys.append(key)
         
-        for key in expired_keys:
-            del self.memory_cache[key]
-            self.cache_stats["expired"] += 1
+        # Clean memory cache (and the on-disk store; Redis expires its own keys)
+        expired_count = self.memory_cache.purge_expired()
+        if self.backend.shared:
+            expired_count += self.backend.purge_expired()
         
         # Clean Gemini caches
         expired_gemini = []
-        for key, cache_info in self.gemini_caches.items():
+        for key, cache_info in list(self.gemini_caches.items()):
             if cache_info["expires_at"] <= current_time:
                 expired_gemini.append(key)
         
@@ -187,29 +205,37 @@ class CachingSystem:
             try:
                 # Delete from Gemini
                 cache_name = self.gemini_caches[key]["cache_name"]
-                self.client.caches.delete(name=cache_name)
+                self.llm.delete_cache(cache_name)
                 del self.gemini_caches[key]
                 logger.info(f"🗑️ Deleted expired Gemini cache: {cache_name}")
             except Exception as e:
                 logger.error(f"Error deleting Gemini cache: {e}")
         
-        if expired_keys or expired_gemini:
-            logger.info(f"🧹 Cleaned up {len(expired_keys)} memory caches and {len(expired_gemini)} Gemini caches")
+        if expired_count or expired_gemini:
+            logger.info(f"🧹 Cleaned up {expired_count} memory caches and {len(expired_gemini)} Gemini caches")
     
     def get_cache_stats(self) -> Dict[str, Any]:
         """Get cache performance statistics."""
-        total_requests = self.cache_stats["hits"] + self.cache_stats["misses"]
-        hit_rate = (self.cache_stats["hits"] / total_requests * 100) if total_requests > 0 else 0
+        memory = self.memory_cache.get_stats()
+        backend = self.backend.get_stats() if self.backend.shared else {"backend": self.backend.kind}
+        with self._stats_lock:
+            gemini = dict(self.cache_stats)
+        # A shared backend is only consulted on a memory miss, so its misses are the overall misses
+        hits = memory["hits"] + backend.get("hits", 0)
+        misses = backend["misses"] if self.backend.shared else memory["misses"]
+        total_requests = hits + misses
         
         return {
-            "cache_hits": self.cache_stats["hits"],
-            "cache_misses": self.cache_stats["misses"],
-            "cache_hit_rate_percent": round(hit_rate, 2),
-            "caches_created": self.cache_stats["created"],
-            "caches_expired": self.cache_stats["expired"],
-            "active_memory_caches": len(self.memory_cache),
+            "cache_hits": hits,
+            "cache_misses": misses,
+            "cache_hit_rate_percent": round(hits / total_requests * 100, 2) if total_requests else 0,
+            "caches_created": gemini["created"],
+            "caches_expired": gemini["expired"] + memory["expirations"],
+            "active_memory_caches": memory["entries"],
             "active_gemini_caches": len(self.gemini_caches),
-            "total_requests": total_requests
+            "total_requests": total_requests,
+            "memory_cache": memory,
+            "backend": backend
         }
     
     def log_cache_stats(self):
@@ -235,27 +261,20 @@ class CachingSystem:
             "cache_misses": stats["cache_misses"],
             "hit_rate": stats["cache_hit_rate_percent"],
             "gemini_caches_created": stats["caches_created"],
-            "active_caches": [cache_name for cache_name, info in self.gemini_caches.items() 
+            "active_caches": [cache_name for cache_name, info in list(self.gemini_caches.items())
                              if info.get("expires_at", 0) > time.time()],
-            "memory_cache_entries": len(self.memory_cache)
+            "memory_cache_entries": stats["active_memory_caches"],
+            "memory_cache": stats["memory_cache"],
+            "backend": stats["backend"]
         }
     
     def cleanup_expired_cache(self) -> int:
         """Clean up expired cache entries and return count of cleaned entries."""
-        cleaned_count = 0
-        current_time = time.time()
-        
-        # Clean memory cache
-        expired_keys = []
-        for key, data in self.memory_cache.items():
-            if data.get("expires_at", 0) <= current_time:
-                expired_keys.append(key)
-        
-        for key in expired_keys:
-            del self.memory_cache[key]
-            cleaned_count += 1
+        cleaned_count = self.memory_cache.purge_expired()
+        if self.backend.shared:
+            cleaned_count += self.backend.purge_expired()
         
-        logger.info(f"🧹 Cleaned {cleaned_count} expired memory cache entries")
+        logger.info(f"🧹 Cleaned {cleaned_count} expired cache entries")
         return cleaned_count
     
     def cleanup_gemini_caches(self) -> int:
@@ -264,16 +283,16 @@ class CachingSystem:
         current_time = time.time()
         
         expired_caches = []
-        for cache_key, cache_info in self.gemini_caches.items():
+        for cache_key, cache_info in list(self.gemini_caches.items()):
             if cache_info.get("expires_at", 0) <= current_time:
                 expired_caches.append(cache_key)
         
         for cache_key in expired_caches:
             # Note: Gemini caches are automatically cleaned up by Google
             # We just remove our tracking of them
-            del self.gemini_caches[cache_key]
+            self.gemini_caches.pop(cache_key, None)
             cleaned_count += 1
-            self.cache_stats["expired"] += 1
+            self._count("expired")
         
         logger.info(f"🧹 Marked {cleaned_count} expired Gemini caches for cleanup")
         return cleaned_count
@@ -0,0 +1,94 @@
+# clause_alignment.py
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+try:
+    # Optimal one-to-one assignment when SciPy is installed; greedy matching otherwise
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+from retrieval import VectorIndex
+
+MATCH_THRESHOLD = float(os.getenv("CLAUSE_MATCH_THRESHOLD", 0.8))          # below this, chunks are unmatched
+IDENTICAL_THRESHOLD = float(os.getenv("CLAUSE_IDENTICAL_THRESHOLD", 0.97))  # at/above this, "same clause"
+
+_NUMBER_RE = re.compile(r"\d[\d,.:/-]*")
+
+
+def _greedy_assignment(sim: np.ndarray) -> List[Tuple[int, int]]:
+    """Take pairs in order of decreasing similarity, each row and column at most once."""
+    order = np.argsort(-sim, axis=None, kind="stable")
+    rows, cols = np.unravel_index(order, sim.shape)
+    used_rows, used_cols = set(), set()
+    pairs = []
+    limit = min(sim.shape)
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        if i in used_rows or j in used_cols:
+            continue
+        used_rows.add(i)
+        used_cols.add(j)
+        pairs.append((i, j))
+        if len(pairs) == limit:
+            break
+    return pairs
+
+
+def assign(sim: np.ndarray) -> List[Tuple[int, int]]:
+    """One-to-one pairing of rows to columns maximizing total similarity (greedy without SciPy)."""
+    if sim.size == 0:
+        return []
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(sim, maximize=True)
+        return list(zip(rows.tolist(), cols.tolist()))
+    return _greedy_assignment(sim)
+
+
+def _same_figures(a: str, b: str) -> bool:
+    # Embeddings barely move when "$500" becomes "$5,000"; amounts and dates must match exactly
+    return _NUMBER_RE.findall(a) == _NUMBER_RE.findall(b)
+
+
+def align(
+    first: VectorIndex,
+    second: VectorIndex,
+    match_threshold: float = MATCH_THRESHOLD,
+    identical_threshold: float = IDENTICAL_THRESHOLD,
+) -> Dict[str, Any]:
+    """
+    Align two documents' chunks using their stored (pre-normalized) embeddings.
+
+    Returns:
+      identical:  [(i, j, sim)] matched and effectively the same (skip these)
+      divergent:  [(i, j, sim)] matched but worded differently, least similar first
+      only_first / only_second: chunk indices with no counterpart
+    """
+    if not len(first) or not len(second):
+        return {"identical": [], "divergent": [], "only_first": list(range(len(first))),
+                "only_second": list(range(len(second)))}
+
+    sim = first.matrix @ second.matrix.T
+    identical, divergent = [], []
+    matched_first, matched_second = set(), set()
+    for i, j in assign(sim):
+        score = float(sim[i, j])
+        if score < match_threshold:
+            continue
+        matched_first.add(i)
+        matched_second.add(j)
+        same_text = " ".join(first.texts[i].split()) == " ".join(second.texts[j].split())
+        if same_text or (score >= identical_threshold and _same_figures(first.texts[i], second.texts[j])):
+            identical.append((i, j, score))
+        else:
+            divergent.append((i, j, score))
+    divergent.sort(key=lambda pair: pair[2])
+
+    return {
+        "identical": identical,
+        "divergent": divergent,
+        "only_first": [i for i in range(len(first)) if i not in matched_first],
+        "only_second": [j for j in range(len(second)) if j not in matched_second],
+    }
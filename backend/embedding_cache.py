@@ -0,0 +1,147 @@
+# embedding_cache.py
+import os
+import sqlite3
+import hashlib
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Any
+
+_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite3"))
+_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 200000))
+_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+_TOUCH_FLUSH_SIZE = int(os.getenv("EMBEDDING_CACHE_TOUCH_FLUSH_SIZE", 1000))
+
+
+class EmbeddingCache:
+    """Durable embedding cache keyed by (model, dimension, task type, SHA-256 of text).
+
+    Vectors are stored as float32 blobs in SQLite. When the table grows past
+    `max_entries`, the least recently used 10% are evicted. The row count is kept
+    in memory, and hits update `last_access` in batches (every `touch_flush_size`
+    hits, and before any eviction), so reads don't write.
+    """
+
+    def __init__(self, path: str = _CACHE_PATH, max_entries: int = _CACHE_MAX_ENTRIES,
+                 touch_flush_size: int = _TOUCH_FLUSH_SIZE):
+        self.path = path
+        self.max_entries = max_entries
+        self.touch_flush_size = max(1, touch_flush_size)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self._touched: Dict[str, float] = {}  # key -> last access not yet written
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(model: str, dim: int, task_type: str, text: str) -> str:
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model}|{dim}|{task_type}|{text_hash}"
+
+    def get_many(self, keys: List[str]) -> Dict[str, list]:
+        """Return {key: vector} for every key present in the cache."""
+        unique = list(dict.fromkeys(keys))
+        found: Dict[str, list] = {}
+        with self._lock:
+            for start in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+                part = unique[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", part
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._touched.update((k, now) for k in found)
+                if len(self._touched) >= self.touch_flush_size:
+                    self._flush_touched()
+                    self._conn.commit()
+            self.stats["hits"] += sum(1 for k in keys if k in found)
+            self.stats["misses"] += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, items: Dict[str, list]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(k, len(v), array("f", v).tobytes(), now) for k, v in items.items()]
+        with self._lock:
+            # A key's vector never changes (the key hashes model and text), so existing rows
+            # only need their access time refreshed; rowcount is then exactly the new rows
+            inserted = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, dim, vector, last_access) VALUES (?, ?, ?, ?)", rows
+            ).rowcount
+            if inserted < len(rows):
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, k) for k in items]
+                )
+            for k in items:
+                self._touched.pop(k, None)
+            self._count += inserted
+            self.stats["writes"] += len(rows)
+            self._evict_if_needed()
+            self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?", [(t, k) for k, t in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _evict_if_needed(self):
+        if self._count <= self.max_entries:
+            return
+        # Other processes may share the file: recount before deciding how much to evict
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if self._count <= self.max_entries:
+            return
+        self._flush_touched()  # evict by up-to-date access times
+        to_remove = self._count - int(self.max_entries * 0.9)
+        removed = self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            " SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (to_remove,),
+        ).rowcount
+        self._count -= removed
+        self.stats["evictions"] += removed
+        print(f"🧹 Embedding cache evicted {removed} least recently used vectors")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._count
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate_percent": round(self.stats["hits"] / total * 100, 2) if total else 0,
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "path": self.path,
+            }
+
+
+# Global embedding cache instance (lazy initialization)
+embedding_cache = None
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Get or create the global embedding cache; None when disabled or unavailable."""
+    global embedding_cache, _CACHE_ENABLED
+    if embedding_cache is None and _CACHE_ENABLED:
+        try:
+            embedding_cache = EmbeddingCache()
+        except Exception as e:
+            print(f"⚠️ Embedding cache unavailable, embedding without it: {e}")
+            _CACHE_ENABLED = False
+            return None
+    return embedding_cache
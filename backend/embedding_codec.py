@@ -0,0 +1,51 @@
+# embedding_codec.py
+import numpy as np
+from typing import Dict, Any
+
+SUPPORTED_DTYPES = ("int8", "float16")
+
+
+def pack_embeddings(matrix, dtype: str = "int8") -> Dict[str, Any]:
+    """Pack an (n, dim) embedding matrix into compact bytes.
+
+    int8 stores one float32 scale per vector (max-abs / 127); float16 stores the
+    values directly and needs no scales.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    m = np.asarray(matrix, dtype=np.float32)
+    if m.ndim == 1:
+        m = m.reshape(1, -1)
+    count, dim = m.shape
+    if dtype == "float16":
+        return {
+            "dtype": dtype,
+            "dim": dim,
+            "count": count,
+            "vectors": m.astype("<f2").tobytes(),
+            "scales": b"",
+        }
+    scales = np.abs(m).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(m / scales[:, None]), -127, 127).astype(np.int8)
+    return {
+        "dtype": dtype,
+        "dim": dim,
+        "count": count,
+        "vectors": q.tobytes(),
+        "scales": scales.astype("<f4").tobytes(),
+    }
+
+
+def unpack_embeddings(record: Dict[str, Any]) -> np.ndarray:
+    """Decode a packed record back into a float32 (count, dim) matrix."""
+    dtype = record.get("dtype", "int8")
+    dim = int(record["dim"])
+    count = int(record["count"])
+    if dtype == "float16":
+        return np.frombuffer(record["vectors"], dtype="<f2", count=count * dim).reshape(count, dim).astype(np.float32)
+    if dtype != "int8":
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    q = np.frombuffer(record["vectors"], dtype=np.int8, count=count * dim).reshape(count, dim)
+    scales = np.frombuffer(record["scales"], dtype="<f4", count=count)
+    return q.astype(np.float32) * scales[:, None]
@@ -1,14 +1,24 @@
 # firestore_adapter.py
 
 import os
+import numpy as np
 from google.cloud import firestore
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from embedding_codec import pack_embeddings, unpack_embeddings
 
 # Consistent collection names
 COLLECTION_DOCUMENTS = os.getenv("FIRESTORE_DOCUMENTS_COLLECTION", "documents")
 COLLECTION_CHUNKS = os.getenv("FIRESTORE_EMBEDDINGS_COLLECTION", "chunks")
 COLLECTION_SUMMARIES = os.getenv("FIRESTORE_SUMMARIES_COLLECTION", "summaries")
 COLLECTION_QA = os.getenv("FIRESTORE_QA_COLLECTION", "qa_sessions")
+COLLECTION_VECTORS = os.getenv("FIRESTORE_VECTORS_COLLECTION", "chunk_vectors")
+COLLECTION_ANALYSES = os.getenv("FIRESTORE_ANALYSES_COLLECTION", "analyses")
+
+# Embeddings are stored as packed shards (one Firestore doc per shard) instead of
+# per-chunk float arrays. 512 int8 vectors of 768 dims is ~400KB, well under the 1MiB doc limit.
+EMBEDDING_STORAGE_DTYPE = os.getenv("EMBEDDING_STORAGE_DTYPE", "int8")
+EMBEDDING_SHARD_SIZE = int(os.getenv("EMBEDDING_SHARD_SIZE", 512))
+_MAX_BATCH_WRITES = 450  # Firestore allows 500 writes per batch
 
 # ❌ Remove this line - we'll pass db as parameter instead
 # db = firestore.Client()
@@ -20,16 +30,144 @@ def add_document_metadata(db: firestore.Client, doc: Dict[str, Any]) -> str:
 def update_document_status(db: firestore.Client, doc_id: str, status: str):
     db.collection(COLLECTION_DOCUMENTS).document(doc_id).update({"status": status})
 
+def update_document_fields(db: firestore.Client, doc_id: str, fields: Dict[str, Any]):
+    db.collection(COLLECTION_DOCUMENTS).document(doc_id).update(fields)
+
+class ChunkWriter:
+    """Stores a stream of chunks, appending their vectors to open shard docs in COLLECTION_VECTORS.
+
+    Keep one writer per ingestion run: however small each `write` is, a document ends
+    up with about one shard per EMBEDDING_SHARD_SIZE chunks, so loading its vectors stays
+    a few reads. Each batch commits the chunk docs together with the rewritten shard
+    holding their vectors, so a failure part-way never leaves chunks without embeddings.
+    """
+
+    def __init__(self, db: firestore.Client):
+        self.db = db
+        self._open: Dict[str, tuple] = {}  # documentId -> (shard ref, chunk IDs, embeddings)
+
+    def write(self, chunks: list):
+        by_doc: Dict[str, list] = {}
+        for chunk in chunks:
+            by_doc.setdefault(chunk.get("documentId"), []).append(chunk)
+        for doc_id, doc_chunks in by_doc.items():
+            # Room for the chunk docs plus the (at most two) shards a batch can then touch
+            step = max(1, min(_MAX_BATCH_WRITES - 2, EMBEDDING_SHARD_SIZE))
+            for start in range(0, len(doc_chunks), step):
+                self._commit(doc_id, doc_chunks[start:start + step])
+
+    def _commit(self, doc_id: str, chunks: list):
+        batch = self.db.batch()
+        ref, ids, embs = self._open.get(doc_id) or (None, [], [])
+        ids, embs = list(ids), list(embs)  # the open shard only advances once the batch commits
+        touched = {}
+        for chunk in chunks:
+            chunk_ref = self.db.collection(COLLECTION_CHUNKS).document()
+            data = dict(chunk)
+            embedding = data.pop("embedding", None)
+            batch.set(chunk_ref, data)
+            if embedding is None:
+                continue
+            if ref is None or len(ids) >= EMBEDDING_SHARD_SIZE:
+                ref, ids, embs = self.db.collection(COLLECTION_VECTORS).document(), [], []
+            ids.append(chunk_ref.id)
+            embs.append(embedding)
+            touched[ref.id] = (ref, ids, embs)
+        for shard_ref, shard_ids, shard_embs in touched.values():
+            shard = pack_embeddings(shard_embs, EMBEDDING_STORAGE_DTYPE)
+            shard["documentId"] = doc_id
+            shard["chunkIds"] = shard_ids
+            batch.set(shard_ref, shard)
+        batch.commit()
+        if ref is not None:
+            self._open[doc_id] = (ref, ids, embs)
+
 def add_chunks(db: firestore.Client, chunks: list):
-    batch = db.batch()
-    for chunk in chunks:
-        ref = db.collection(COLLECTION_CHUNKS).document()
-        batch.set(ref, chunk)
-    batch.commit()
+    """Store chunk texts, with their embeddings packed into shard docs in COLLECTION_VECTORS."""
+    ChunkWriter(db).write(chunks)
 
 def add_summary(db: firestore.Client, summary: Dict[str, Any]):
     db.collection(COLLECTION_SUMMARIES).add(summary)
 
+def _delete_where_document(db: firestore.Client, collection: str, doc_id: str) -> int:
+    refs = [doc.reference for doc in db.collection(collection).where("documentId", "==", doc_id).select([]).stream()]
+    for start in range(0, len(refs), _MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref in refs[start:start + _MAX_BATCH_WRITES]:
+            batch.delete(ref)
+        batch.commit()
+    return len(refs)
+
+def delete_chunks_by_doc_id(db: firestore.Client, doc_id: str) -> int:
+    """Delete a document's chunks and their packed embedding shards. Returns chunks deleted."""
+    deleted = _delete_where_document(db, COLLECTION_CHUNKS, doc_id)
+    _delete_where_document(db, COLLECTION_VECTORS, doc_id)
+    return deleted
+
+def replace_summary(db: firestore.Client, summary: Dict[str, Any]):
+    """Store a document summary, removing any earlier summaries for the same document."""
+    _delete_where_document(db, COLLECTION_SUMMARIES, summary["documentId"])
+    add_summary(db, summary)
+
+def get_documents_by_ids(db: firestore.Client, doc_ids: list) -> Dict[str, Dict[str, Any]]:
+    """Fetch several documents in one batched read. Missing documents are left out of the result."""
+    refs = [db.collection(COLLECTION_DOCUMENTS).document(doc_id) for doc_id in dict.fromkeys(doc_ids)]
+    if not refs:
+        return {}
+    return {snapshot.id: snapshot.to_dict() or {} for snapshot in db.get_all(refs) if snapshot.exists}
+
+def get_document_content_hash(db: firestore.Client, doc_id: str) -> Optional[str]:
+    """The contentHash ingestion recorded on the document, or None (not processed yet / older documents)."""
+    try:
+        snapshot = db.collection(COLLECTION_DOCUMENTS).document(doc_id).get(field_paths=["contentHash"])
+        if snapshot.exists:
+            return (snapshot.to_dict() or {}).get("contentHash")
+    except Exception as e:
+        print(f"Error fetching content hash for document {doc_id}: {e}")
+    return None
+
+def get_processing_state(db: firestore.Client, doc_id: str) -> Optional[Dict[str, Any]]:
+    """status, contentHash and processingCheckpoint of a document (one masked read), or None if unavailable."""
+    try:
+        snapshot = db.collection(COLLECTION_DOCUMENTS).document(doc_id).get(
+            field_paths=["status", "contentHash", "processingCheckpoint"]
+        )
+        if snapshot.exists:
+            return snapshot.to_dict() or {}
+    except Exception as e:
+        print(f"Error fetching processing state for document {doc_id}: {e}")
+    return None
+
+def _analysis_ref(db: firestore.Client, doc_id: str, kind: str):
+    # One current artifact per document and analysis kind; a newer version overwrites it
+    return db.collection(COLLECTION_ANALYSES).document(f"{doc_id}_{kind}")
+
+def get_analysis(db: firestore.Client, doc_id: str, kind: str) -> Optional[Dict[str, Any]]:
+    """Stored analysis artifact (with its contentHash/promptVersion/model) or None."""
+    try:
+        snapshot = _analysis_ref(db, doc_id, kind).get()
+        if snapshot.exists:
+            return snapshot.to_dict()
+    except Exception as e:
+        print(f"Error fetching {kind} analysis for document {doc_id}: {e}")
+    return None
+
+def put_analysis(db: firestore.Client, doc_id: str, kind: str, artifact: Dict[str, Any]):
+    _analysis_ref(db, doc_id, kind).set({**artifact, "documentId": doc_id, "kind": kind})
+
+def get_chunk_progress(db: firestore.Client, doc_id: str):
+    """
+    Return [(chunkIndex, contentHash), ...] for every stored chunk of a document,
+    without downloading chunk text or embeddings.
+    """
+    progress = []
+    docs = db.collection(COLLECTION_CHUNKS).where("documentId", "==", doc_id)\
+             .select(["chunkIndex", "contentHash"]).stream()
+    for doc in docs:
+        data = doc.to_dict() or {}
+        progress.append((data.get("chunkIndex"), data.get("contentHash")))
+    return progress
+
 def _serialize_firestore_session(data, doc_id):
     """Helper function to serialize Firestore session data"""
     # Convert Firestore timestamp to ISO string if present
@@ -140,22 +278,53 @@ def get_summary_by_doc_id(db: firestore.Client, doc_id: str):
     
     return None
 
+def get_chunk_vectors_by_doc_id(db: firestore.Client, doc_id: str):
+    """
+    Read a document's packed embedding shards.
+    Returns (chunk_ids, matrix) where matrix is float32 with one row per chunk ID.
+    """
+    chunk_ids = []
+    blocks = []
+    try:
+        docs = db.collection(COLLECTION_VECTORS).where("documentId", "==", doc_id).stream()
+        for doc in docs:
+            data = doc.to_dict()
+            if data and data.get("count"):
+                chunk_ids.extend(data.get("chunkIds", []))
+                blocks.append(unpack_embeddings(data))
+    except Exception as e:
+        print(f"Error fetching embedding shards for document {doc_id}: {e}")
+        return [], np.zeros((0, 0), dtype=np.float32)
+
+    if not blocks:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    return chunk_ids, np.vstack(blocks)
+
 def get_chunks_by_doc_id(db: firestore.Client, doc_id: str):
     """
     Retrieve all chunks for a given document ID.
     Each chunk contains both the original text and the embedding.
+    Embeddings come from packed shards, or from the legacy per-chunk "embedding" field.
     """
     chunks = []
     try:
-        docs = db.collection(COLLECTION_CHUNKS).where("documentId", "==", doc_id).stream()
+        shard_ids, matrix = get_chunk_vectors_by_doc_id(db, doc_id)
+        row_by_id = {cid: i for i, cid in enumerate(shard_ids)}
+
+        query = db.collection(COLLECTION_CHUNKS).where("documentId", "==", doc_id)
+        if row_by_id:
+            # Skip downloading any legacy float arrays when shards are available
+            query = query.select(["text", "metadata"])
+        docs = query.stream()
 
         for doc in docs:
             data = doc.to_dict()
             if data:
+                row = row_by_id.get(doc.id)
                 chunks.append({
                     "chunkId": doc.id,
                     "text": data.get("text"),           # human-readable chunk text
-                    "embedding": data.get("embedding"), # vector for similarity search
+                    "embedding": matrix[row] if row is not None else data.get("embedding"), # vector for similarity search
                     "metadata": data.get("metadata", {}) # optional, e.g., page number
                 })
     except Exception as e:
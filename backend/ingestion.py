@@ -0,0 +1,400 @@
+# ingestion.py
+import os
+import hashlib
+import queue
+import threading
+import time
+from typing import Callable, Dict, Any, List, Optional
+
+from firestore_adapter import (
+    COLLECTION_DOCUMENTS, ChunkWriter, delete_chunks_by_doc_id, get_chunk_progress,
+    get_summary_by_doc_id, update_document_fields
+)
+from pipeline import (
+    CHUNKER_VERSION, SummaryCancelled, embed_texts, iter_chunks, generate_summary, get_embed_controller, _estimate_tokens_for_text
+)
+from priority_scheduler import BULK, priority
+
+# 0 = size each batch from the adaptive controller's current token budget
+_EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 0))
+# Enough workers to reach the controller's concurrency ceiling; the controller gates actual calls
+_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", get_embed_controller().max_concurrency))
+_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+
+_DONE = object()  # queue sentinel
+
+
+class IngestionError(Exception):
+    """A stage failed; `message` is the user-facing status text for the document."""
+
+    def __init__(self, stage: str, message: str, cause: Optional[Exception] = None):
+        super().__init__(f"{stage}: {message}" + (f" ({cause})" if cause else ""))
+        self.stage = stage
+        self.message = message
+        self.cause = cause
+
+
+class StageTimings:
+    """Thread-safe wall-clock and busy-time accounting per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, float]] = {}
+
+    def start(self, stage: str):
+        with self._lock:
+            self._stages.setdefault(stage, {"started": time.time(), "busy_seconds": 0.0, "items": 0})
+
+    def add(self, stage: str, busy_seconds: float, items: int = 1):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"started": time.time(), "busy_seconds": 0.0, "items": 0})
+            entry["busy_seconds"] += busy_seconds
+            entry["items"] += items
+
+    def finish(self, stage: str):
+        with self._lock:
+            if stage in self._stages:
+                self._stages[stage]["finished"] = time.time()
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out = {}
+            for stage, e in self._stages.items():
+                out[stage] = {
+                    "wall_seconds": round(e.get("finished", time.time()) - e["started"], 3),
+                    "busy_seconds": round(e["busy_seconds"], 3),
+                    "items": e["items"],
+                }
+            return out
+
+
+class IngestionPipeline:
+    """Extract → chunk → embed → store, with summarization running alongside embedding.
+
+    Stages are connected by queues: chunks are batched for embedding as soon as they
+    are cut, and persisted as soon as their embeddings arrive. There are no fixed sleeps: pacing is entirely up
+    to the embedding rate limiter.
+
+    Runs are resumable: every stored chunk carries its chunkIndex and the hash of
+    the content it came from, and a checkpoint is written to the document after
+    each store. A rerun over the same content only embeds and stores the chunks
+    that are missing, and skips summarization if a summary for that content exists.
+    """
+
+    def __init__(
+        self,
+        db,
+        document_id: str,
+        on_progress: Optional[Callable[[str], None]] = None,
+        on_chunks_stored: Optional[Callable[[int], None]] = None,
+        batch_size: int = _EMBED_BATCH_SIZE,
+        embed_workers: int = _EMBED_WORKERS,
+        queue_size: int = _QUEUE_SIZE,
+    ):
+        self.db = db
+        self.document_id = document_id
+        self.on_progress = on_progress or (lambda message: None)
+        self.on_chunks_stored = on_chunks_stored or (lambda count: None)
+        self.batch_size = max(0, batch_size)
+        self.embed_workers = max(1, embed_workers)
+        self.queue_size = max(1, queue_size)
+        self.timings = StageTimings()
+
+        self._failed = threading.Event()
+        self._cancel_summary = threading.Event()
+        self._error: Optional[IngestionError] = None
+        self._error_lock = threading.Lock()
+        self._stored = 0
+        self._writer = ChunkWriter(db)  # one writer per run keeps vectors in a few shards
+        self._content_hash: Optional[str] = None
+        self._checkpoint: Dict[str, Any] = {}
+        self._total_chunks = 0
+        self._chunks: List[Dict[str, Any]] = []
+        self._chunked = threading.Event()
+        self._summary: Optional[Dict[str, Any]] = None
+        self._summary_error: Optional[Exception] = None
+
+    # --- queue helpers that give up once another stage has failed ---
+    def _put(self, q: queue.Queue, item) -> bool:
+        while not self._failed.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q: queue.Queue):
+        while not self._failed.is_set():
+            try:
+                return q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, error: IngestionError):
+        with self._error_lock:
+            if self._error is None:
+                self._error = error
+        self._failed.set()
+
+    # --- stages ---
+    def _extract(self) -> str:
+        self.timings.start("extract")
+        t0 = time.time()
+        snapshot = self.db.collection(COLLECTION_DOCUMENTS).document(self.document_id).get()
+        self.timings.add("extract", time.time() - t0)
+        self.timings.finish("extract")
+        if not snapshot.exists:
+            raise IngestionError("extract", "Document not found")
+        data = snapshot.to_dict() or {}
+        self._checkpoint = data.get("processingCheckpoint") or {}
+        content = data.get("documentContent", "")
+        if not content:
+            raise IngestionError("extract", "No document content found")
+        return content
+
+    def _chunk_worker(self, content: str, chunk_q: queue.Queue):
+        """Cut chunks into `chunk_q` as they are produced; all of them end up in self._chunks."""
+        self.timings.start("chunk")
+        t0 = time.time()
+        try:
+            # create pages (content is stored as single-page extracted text)
+            for i, c in enumerate(iter_chunks([{"page": 1, "text": content}])):
+                c["documentId"] = self.document_id
+                c["chunkIndex"] = i
+                c["contentHash"] = self._content_hash
+                self._chunks.append(c)
+                self._total_chunks = len(self._chunks)
+                chunk_q.put(c)  # unbounded: the chunks are all held in self._chunks anyway
+        except Exception as e:
+            self._fail(IngestionError("chunk", "Failed to process document text", e))
+        self.timings.add("chunk", time.time() - t0, len(self._chunks))
+        self.timings.finish("chunk")
+        if not self._chunks:
+            self._fail(IngestionError("chunk", "Failed to process document text"))
+        self._chunked.set()
+        chunk_q.put(_DONE)
+
+    def _restore_checkpoint(self) -> set:
+        """Return indices of chunks already stored for this content, discarding chunks from other content."""
+        self.timings.start("checkpoint")
+        t0 = time.time()
+        progress = get_chunk_progress(self.db, self.document_id)
+        stored: set = set()
+        other_chunker = bool(progress) and self._checkpoint.get("chunker") != CHUNKER_VERSION
+        if other_chunker or any(h != self._content_hash or idx is None for idx, h in progress):
+            # Content or chunk boundaries changed (or chunks predate checkpoints): start this document over
+            deleted = delete_chunks_by_doc_id(self.db, self.document_id)
+            print(f"[ingest] Discarded {deleted} chunks from a previous version of {self.document_id}")
+        else:
+            # Chunking is deterministic for a given content hash and chunker, so these are the
+            # indices the chunk stage is about to produce
+            stored = {idx for idx, _ in progress if idx >= 0}
+        self.timings.add("checkpoint", time.time() - t0, len(progress))
+        self.timings.finish("checkpoint")
+        return stored
+
+    def _summary_is_current(self) -> bool:
+        existing = get_summary_by_doc_id(self.db, self.document_id)
+        return bool(existing) and existing.get("contentHash") == self._content_hash
+
+    def _write_checkpoint(self):
+        try:
+            update_document_fields(self.db, self.document_id, {
+                "contentHash": self._content_hash,
+                "processingCheckpoint": {
+                    "contentHash": self._content_hash,
+                    "totalChunks": self._total_chunks,
+                    "storedChunks": self._stored,
+                    "chunker": CHUNKER_VERSION,
+                    "updatedAt": time.time(),
+                },
+            })
+        except Exception as e:
+            print(f"[ingest] Could not write checkpoint for {self.document_id}: {e}")
+
+    def _pending(self, chunk_q: queue.Queue, stored_indices: set):
+        """Chunks from the chunk stage, as they are cut, that aren't stored yet."""
+        while True:
+            chunk = self._get(chunk_q)
+            if chunk is _DONE:
+                return
+            if chunk["chunkIndex"] not in stored_indices:
+                yield chunk
+
+    def _batches(self, chunks):
+        """Yield embedding batches; adaptive sizing reads the controller as each batch is cut."""
+        batch: List[Dict[str, Any]] = []
+        tokens = 0
+        for chunk in chunks:
+            t = _estimate_tokens_for_text(chunk["text"])
+            if self.batch_size:
+                full = len(batch) >= self.batch_size
+            else:
+                full = tokens + t > get_embed_controller().batch_tokens
+            if batch and full:
+                yield batch
+                batch, tokens = [], 0
+            batch.append(chunk)
+            tokens += t
+        if batch:
+            yield batch
+
+    def _embed_worker(self, embed_q: queue.Queue, store_q: queue.Queue):
+        # Ingest yields embedding slots to interactive queries (see priority_scheduler)
+        with priority(BULK):
+            self._embed_loop(embed_q, store_q)
+
+    def _embed_loop(self, embed_q: queue.Queue, store_q: queue.Queue):
+        while True:
+            item = self._get(embed_q)
+            if item is _DONE:
+                return
+            batch_num, batch = item
+            t0 = time.time()
+            try:
+                embeddings = embed_texts([c["text"] for c in batch])
+                if len(embeddings) != len(batch):
+                    raise RuntimeError(f"expected {len(batch)} embeddings, got {len(embeddings)}")
+            except Exception as e:
+                print(f"[ingest] ❌ Embedding error for batch {batch_num}: {e}")
+                self._fail(IngestionError("embed", "Failed to generate embeddings", e))
+                return
+            for chunk, emb in zip(batch, embeddings):
+                chunk["embedding"] = emb
+            self.timings.add("embed", time.time() - t0, len(batch))
+            print(f"[ingest] ✅ Embedding batch {batch_num} ({len(batch)} chunks) done")
+            if not self._put(store_q, batch):
+                return
+
+    def _store_worker(self, store_q: queue.Queue):
+        done = False
+        while not done:
+            item = self._get(store_q)
+            if item is _DONE:
+                return
+            pending = list(item)
+            # Coalesce whatever else is already waiting into the same write
+            while True:
+                try:
+                    nxt = store_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _DONE:
+                    done = True
+                    break
+                pending.extend(nxt)
+            t0 = time.time()
+            try:
+                self._writer.write(pending)
+            except Exception as e:
+                print(f"[ingest] ❌ Storing chunks failed: {e}")
+                self._fail(IngestionError("store", "Failed to store document chunks", e))
+                return
+            self._stored += len(pending)
+            self.timings.add("store", time.time() - t0, len(pending))
+            self._write_checkpoint()
+            self.on_chunks_stored(self._stored)
+            self.on_progress(f"Stored {self._stored}/{self._total_chunks} chunks with embeddings...")
+
+    def _summarize(self):
+        # Summaries only need chunk text, so they wait for chunking but not for embeddings
+        self._chunked.wait()
+        if self._failed.is_set():
+            return
+        self.timings.start("summarize")
+        t0 = time.time()
+        try:
+            with priority(BULK):
+                self._summary = generate_summary([{"text": c["text"]} for c in self._chunks], cancel=self._cancel_summary)
+        except SummaryCancelled:
+            print(f"[ingest] Summary for {self.document_id} cancelled after a stage failure")
+            self._summary_error = RuntimeError("summary cancelled")
+        except Exception as e:
+            print(f"[ingest] Summary generation failed: {e}")
+            self._summary_error = e
+        self.timings.add("summarize", time.time() - t0)
+        self.timings.finish("summarize")
+
+    def run(self) -> Dict[str, Any]:
+        """Run all stages; raises IngestionError if extract/chunk/embed/store fails."""
+        started = time.time()
+        content = self._extract()
+        self._content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+        stored_indices = self._restore_checkpoint()
+        self._stored = len(stored_indices)
+        if stored_indices:
+            print(f"[ingest] Resuming {self.document_id} from checkpoint: {len(stored_indices)} chunks already stored")
+            self.on_progress(f"Resuming: {len(stored_indices)} chunks already stored, embedding the rest...")
+        else:
+            self.on_progress("Chunking document text and generating embeddings...")
+
+        summary_skipped = self._summary_is_current()
+        summary_thread = None
+        if summary_skipped:
+            print(f"[ingest] Summary for this content already stored; skipping summarization")
+        else:
+            summary_thread = threading.Thread(target=self._summarize, daemon=True)
+            summary_thread.start()
+
+        chunk_q: queue.Queue = queue.Queue()
+        embed_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        store_q: queue.Queue = queue.Queue(maxsize=self.queue_size)
+
+        self.timings.start("embed")
+        self.timings.start("store")
+        chunk_thread = threading.Thread(target=self._chunk_worker, args=(content, chunk_q), daemon=True)
+        workers = [
+            threading.Thread(target=self._embed_worker, args=(embed_q, store_q), daemon=True)
+            for _ in range(self.embed_workers)
+        ]
+        store_thread = threading.Thread(target=self._store_worker, args=(store_q,), daemon=True)
+        chunk_thread.start()
+        for w in workers:
+            w.start()
+        store_thread.start()
+
+        remaining = 0
+        for batch_num, batch in enumerate(self._batches(self._pending(chunk_q, stored_indices)), start=1):
+            remaining += len(batch)
+            if not self._put(embed_q, (batch_num, batch)):
+                break
+        chunk_thread.join()
+        for _ in workers:
+            self._put(embed_q, _DONE)
+        for w in workers:
+            w.join()
+        self.timings.finish("embed")
+        self._put(store_q, _DONE)
+        store_thread.join()
+        self.timings.finish("store")
+        chunks = self._chunks
+        if chunks:
+            print(f"[ingest] {len(chunks)} chunks created for {self.document_id} (preview: {chunks[0]['text'][:120]})")
+
+        if self._error is not None:
+            # The retry recomputes the summary anyway: stop it before its next generation call
+            # and wait only for calls already in flight, so no quota is spent after we return
+            self._cancel_summary.set()
+            if summary_thread is not None:
+                summary_thread.join()
+            raise self._error
+        if summary_thread is not None:
+            summary_thread.join()
+        if not remaining:
+            self._write_checkpoint()
+
+        timings = self.timings.as_dict()
+        timings["total"] = {"wall_seconds": round(time.time() - started, 3)}
+        return {
+            "chunk_count": len(chunks),
+            "stored_count": self._stored,
+            "resumed_from": len(stored_indices),
+            "content_hash": self._content_hash,
+            "summary_skipped": summary_skipped,
+            "summary": self._summary,
+            "summary_error": str(self._summary_error) if self._summary_error else None,
+            "timings": timings,
+        }
@@ -0,0 +1,327 @@
+# job_queue.py
+import os
+import json
+import uuid
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Any, Optional
+
+_JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", os.path.join(".cache", "jobs.sqlite3"))
+_JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+_JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+_JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))
+_JOB_RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", 30))
+_JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+_JOB_RETENTION_HOURS = float(os.getenv("JOB_RETENTION_HOURS", 168))  # finished jobs older than this are deleted
+_JOB_PURGE_INTERVAL = 3600  # seconds between retention sweeps per worker pool
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueue:
+    """Persistent job queue on SQLite.
+
+    A claimed job is leased for `visibility_timeout` seconds; if the worker
+    dies without completing or heart-beating, the job becomes claimable again.
+    Each claim gets a fresh lease token, and heartbeat/complete/fail only apply
+    while the caller still holds it, so a worker whose lease expired can't
+    overwrite a job another worker has re-claimed.
+    Failed attempts are retried with exponential backoff up to `max_attempts`.
+    """
+
+    def __init__(self, path: str = _JOB_QUEUE_PATH, visibility_timeout: float = _JOB_VISIBILITY_TIMEOUT,
+                 retry_backoff: float = _JOB_RETRY_BACKOFF):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.retry_backoff = retry_backoff
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # isolation_level=None: we issue BEGIN IMMEDIATE ourselves so claims are atomic across processes
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT NOT NULL, dedupe_key TEXT,"
+            " status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL,"
+            " available_at REAL NOT NULL, lease_expires_at REAL, last_error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "lease_token" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN lease_token TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, available_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs(dedupe_key)")
+        self._lock = threading.Lock()
+
+    def enqueue(self, kind: str, payload: Dict[str, Any], dedupe_key: Optional[str] = None,
+                max_attempts: int = _JOB_MAX_ATTEMPTS) -> str:
+        """Add a job; if `dedupe_key` already has a queued or running job, return that job's ID."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if dedupe_key:
+                    row = self._conn.execute(
+                        "SELECT id FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1",
+                        (dedupe_key, QUEUED, RUNNING),
+                    ).fetchone()
+                    if row:
+                        self._conn.execute("COMMIT")
+                        return row["id"]
+                job_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, payload, dedupe_key, status, attempts, max_attempts,"
+                    " available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)",
+                    (job_id, kind, json.dumps(payload), dedupe_key, QUEUED, max_attempts, now, now, now),
+                )
+                self._conn.execute("COMMIT")
+                return job_id
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def claim(self, on_abandoned: Optional[Callable[[Dict[str, Any]], None]] = None) -> Optional[Dict[str, Any]]:
+        """Lease the next available job (queued and due, or running with an expired lease).
+
+        A job whose lease expired on its last attempt is marked failed instead, and passed
+        to `on_abandoned` (no worker is left to report the failure).
+        """
+        now = time.time()
+        lease_token = None
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT * FROM jobs WHERE (status = ? AND available_at <= ?)"
+                    " OR (status = ? AND lease_expires_at <= ?) ORDER BY available_at LIMIT 1",
+                    (QUEUED, now, RUNNING, now),
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                if row["status"] == RUNNING and row["attempts"] >= row["max_attempts"]:
+                    # Lease expired on the last allowed attempt: the worker died mid-job
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, last_error = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, "lease expired on final attempt", now, row["id"]),
+                    )
+                    self._conn.execute("COMMIT")
+                else:
+                    lease_token = uuid.uuid4().hex
+                    self._conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_expires_at = ?, lease_token = ?,"
+                        " updated_at = ? WHERE id = ?",
+                        (RUNNING, now + self.visibility_timeout, lease_token, now, row["id"]),
+                    )
+                    self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if lease_token is None:
+            if on_abandoned is not None:
+                abandoned = dict(row)
+                abandoned.update(status=FAILED, last_error="lease expired on final attempt",
+                                 payload=json.loads(abandoned["payload"]))
+                try:
+                    on_abandoned(abandoned)
+                except Exception as e:
+                    print(f"[jobs] Abandoned-job callback failed for {row['id']}: {e}")
+            return None
+        job = dict(row)
+        job["attempts"] += 1
+        job["lease_token"] = lease_token
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def heartbeat(self, job_id: str, lease_token: str) -> bool:
+        """Extend a running job's lease; False if the lease was lost to another worker."""
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                (now + self.visibility_timeout, now, job_id, RUNNING, lease_token),
+            ).rowcount == 1
+
+    def complete(self, job_id: str, lease_token: str) -> bool:
+        """Mark the job succeeded; False (and nothing written) if the lease was lost."""
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, lease_expires_at = NULL, lease_token = NULL, last_error = NULL,"
+                " updated_at = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                (SUCCEEDED, time.time(), job_id, RUNNING, lease_token),
+            ).rowcount == 1
+
+    def fail(self, job_id: str, error: str, attempts: int, max_attempts: int, lease_token: str) -> bool:
+        """Record a failed attempt: requeue with backoff, or mark failed after the last attempt.
+
+        Returns False (and writes nothing) if the lease was lost.
+        """
+        now = time.time()
+        with self._lock:
+            if attempts >= max_attempts:
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, lease_expires_at = NULL, lease_token = NULL, last_error = ?,"
+                    " updated_at = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                    (FAILED, error, now, job_id, RUNNING, lease_token),
+                )
+            else:
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                cursor = self._conn.execute(
+                    "UPDATE jobs SET status = ?, available_at = ?, lease_expires_at = NULL, lease_token = NULL,"
+                    " last_error = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                    (QUEUED, now + delay, error, now, job_id, RUNNING, lease_token),
+                )
+            return cursor.rowcount == 1
+
+    def purge_finished(self, older_than_seconds: float = _JOB_RETENTION_HOURS * 3600) -> int:
+        """Delete succeeded/failed jobs last updated more than `older_than_seconds` ago."""
+        with self._lock:
+            return self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (SUCCEEDED, FAILED, time.time() - older_than_seconds),
+            ).rowcount
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def wait(self, job_id: str, timeout: float, poll_interval: float = _JOB_POLL_INTERVAL) -> Optional[Dict[str, Any]]:
+        """Poll until the job has succeeded or finally failed, or `timeout` seconds pass; returns its last state."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in (SUCCEEDED, FAILED) or time.monotonic() >= deadline:
+                return job
+            time.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+            oldest = self._conn.execute(
+                "SELECT MIN(created_at) FROM jobs WHERE status = ?", (QUEUED,)
+            ).fetchone()[0]
+        counts = {QUEUED: 0, RUNNING: 0, SUCCEEDED: 0, FAILED: 0}
+        counts.update({r["status"]: r["n"] for r in rows})
+        return {
+            **counts,
+            "oldest_queued_age_seconds": round(time.time() - oldest, 1) if oldest else 0,
+        }
+
+
+class WorkerPool:
+    """Fixed-size pool of threads draining a JobQueue.
+
+    `abandon_handlers` (by job kind) get the payload of a job that was given up on
+    because its worker died on the last attempt, so they can record the failure.
+    """
+
+    def __init__(self, job_queue: JobQueue, handlers: Dict[str, Callable[[Dict[str, Any]], None]],
+                 size: int = _JOB_WORKERS, poll_interval: float = _JOB_POLL_INTERVAL,
+                 abandon_handlers: Optional[Dict[str, Callable[[Dict[str, Any]], None]]] = None):
+        self.queue = job_queue
+        self.handlers = handlers
+        self.abandon_handlers = abandon_handlers or {}
+        self.size = max(1, size)
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.size):
+            t = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"🧵 Job worker pool started with {self.size} workers")
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        next_purge = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_purge:
+                next_purge = time.monotonic() + _JOB_PURGE_INTERVAL
+                try:
+                    purged = self.queue.purge_finished()
+                    if purged:
+                        print(f"[jobs] 🧹 Purged {purged} finished jobs")
+                except Exception as e:
+                    print(f"Job retention sweep failed: {e}")
+            try:
+                job = self.queue.claim(on_abandoned=self._abandoned)
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                job = None
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            self._execute(job)
+
+    def _abandoned(self, job: Dict[str, Any]):
+        print(f"[jobs] ❌ {job['kind']} {job['id']} failed: {job['last_error']}")
+        handler = self.abandon_handlers.get(job["kind"])
+        if handler is not None:
+            handler(job["payload"])
+
+    def _execute(self, job: Dict[str, Any]):
+        handler = self.handlers.get(job["kind"])
+        if handler is None:
+            self.queue.fail(job["id"], f"no handler for job kind {job['kind']}", job["max_attempts"],
+                            job["max_attempts"], job["lease_token"])
+            return
+
+        # Keep the lease alive while the handler runs
+        done = threading.Event()
+        def beat():
+            while not done.wait(self.queue.visibility_timeout / 3):
+                try:
+                    if not self.queue.heartbeat(job["id"], job["lease_token"]):
+                        print(f"[jobs] ⚠️ Lost the lease on {job['id']}; another worker has re-claimed it")
+                        return
+                except Exception as e:
+                    print(f"Job heartbeat failed for {job['id']}: {e}")
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+
+        print(f"[jobs] ▶️ {job['kind']} {job['id']} (attempt {job['attempts']}/{job['max_attempts']})")
+        try:
+            handler(job["payload"])
+            if self.queue.complete(job["id"], job["lease_token"]):
+                print(f"[jobs] ✅ {job['kind']} {job['id']} succeeded")
+            else:
+                print(f"[jobs] ⚠️ {job['kind']} {job['id']} finished after its lease was lost; status left to the new owner")
+        except Exception as e:
+            traceback.print_exc()
+            self.queue.fail(job["id"], str(e), job["attempts"], job["max_attempts"], job["lease_token"])
+            print(f"[jobs] ❌ {job['kind']} {job['id']} attempt {job['attempts']} failed: {e}")
+        finally:
+            done.set()
+
+
+# Global job queue instance (lazy initialization)
+job_queue = None
+
+def get_job_queue() -> JobQueue:
+    """Get or create the global job queue."""
+    global job_queue
+    if job_queue is None:
+        job_queue = JobQueue()
+    return job_queue
@@ -0,0 +1,192 @@
+# jurisdiction_detector.py
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+# Below this score the caller should ask the LLM instead
+LLM_THRESHOLD = float(os.getenv("JURISDICTION_LLM_THRESHOLD", 0.4))
+_HIGH_CONFIDENCE = 0.7
+
+_US_STATES = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware",
+    "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky",
+    "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota", "Mississippi",
+    "Missouri", "Montana", "Nebraska", "Nevada", "New Hampshire", "New Jersey", "New Mexico",
+    "New York", "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon", "Pennsylvania",
+    "Rhode Island", "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont",
+    "Virginia", "Washington", "West Virginia", "Wisconsin", "Wyoming", "District of Columbia",
+]
+_CANADA_PROVINCES = [
+    "Ontario", "Quebec", "British Columbia", "Alberta", "Manitoba", "Saskatchewan", "Nova Scotia",
+    "New Brunswick", "Newfoundland and Labrador", "Prince Edward Island",
+]
+_AUSTRALIA_STATES = ["New South Wales", "Victoria", "Queensland", "Western Australia", "South Australia", "Tasmania"]
+_EU_COUNTRIES = [
+    "Germany", "France", "Netherlands", "Ireland", "Spain", "Italy", "Belgium", "Luxembourg", "Austria",
+    "Sweden", "Denmark", "Finland", "Poland", "Portugal",
+]
+
+# Place name -> jurisdiction label (same labels the LLM detector returns, e.g. "US-California", "UK", "EU-Germany")
+_PLACES: Dict[str, str] = {name: f"US-{name}" for name in _US_STATES}
+_PLACES.update({name: f"Canada-{name}" for name in _CANADA_PROVINCES})
+_PLACES.update({name: f"Australia-{name}" for name in _AUSTRALIA_STATES})
+_PLACES.update({name: f"EU-{name}" for name in _EU_COUNTRIES})
+_PLACES.update({
+    "England and Wales": "UK", "England": "UK", "Scotland": "UK-Scotland", "United Kingdom": "UK",
+    "United States of America": "US", "United States": "US", "Canada": "Canada", "Australia": "Australia",
+    "India": "India", "Singapore": "Singapore", "Hong Kong": "Hong Kong", "New Zealand": "New Zealand",
+    "Switzerland": "Switzerland", "Japan": "Japan", "United Arab Emirates": "UAE", "Dubai": "UAE",
+})
+# Case-insensitive match -> canonical place name ("LAWS OF THE STATE OF CALIFORNIA" is common)
+_CANONICAL_PLACES: Dict[str, str] = {name.lower(): name for name in _PLACES}
+# Longest names first so "New York" wins over "York" and "West Virginia" over "Virginia"
+_PLACE_RE = re.compile(
+    r"\b(" + "|".join(re.escape(p) for p in sorted(_PLACES, key=len, reverse=True)) + r")\b",
+    re.IGNORECASE,
+)
+
+_GOVERNING_LAW_RE = re.compile(
+    r"(?:governed\s+by|construed\s+(?:and\s+enforced\s+)?in\s+accordance\s+with|subject\s+to)"
+    r"(?:\s+and\s+construed\s+in\s+accordance\s+with)?,?\s+the\s+(?:internal\s+|substantive\s+)?laws?\s+of\s+"
+    r"(?:the\s+)?(?:(?:State|Commonwealth|Province)\s+of\s+)?([^.;\n]{2,80})",
+    re.IGNORECASE,
+)
+_VENUE_RE = re.compile(
+    r"(?:courts?|tribunals?|venue|arbitration)\s+(?:of|in|located\s+in|seated\s+in|sitting\s+in)\s+"
+    r"(?:the\s+)?(?:(?:State|Commonwealth|Province|County|City)\s+of\s+)?([^.;\n]{2,80})",
+    re.IGNORECASE,
+)
+
+# Currency indicators -> country prefix they support
+_CURRENCY_RES: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"US\$|\bUSD\b|\bU\.S\. dollars?\b"), "US"),
+    (re.compile(r"£|\bGBP\b|\bpounds sterling\b", re.IGNORECASE), "UK"),
+    (re.compile(r"€|\bEUR\b|\beuros?\b", re.IGNORECASE), "EU"),
+    (re.compile(r"₹|\bINR\b|\bRs\.|\brupees?\b", re.IGNORECASE), "India"),
+    (re.compile(r"C\$|\bCAD\b"), "Canada"),
+    (re.compile(r"A\$|\bAUD\b"), "Australia"),
+    (re.compile(r"S\$|\bSGD\b"), "Singapore"),
+]
+
+_DOCUMENT_TYPE_CUES: Dict[str, List[str]] = {
+    "employment_contract": ["employment agreement", "employee", "employer", "salary", "at-will", "probation"],
+    "lease_agreement": ["lease", "landlord", "tenant", "lessor", "lessee", "premises", "security deposit"],
+    "nda": ["non-disclosure", "confidential information", "disclosing party", "receiving party"],
+    "service_agreement": ["services agreement", "service provider", "statement of work", "service levels"],
+    "terms_of_service": ["terms of service", "terms of use", "by using", "user account"],
+    "privacy_policy": ["privacy policy", "personal data", "personal information", "cookies", "data controller"],
+    "loan_agreement": ["loan agreement", "borrower", "lender", "principal amount", "interest rate", "repayment"],
+    "purchase_agreement": ["purchase agreement", "purchase price", "buyer", "seller", "closing date"],
+    "license_agreement": ["license agreement", "licensor", "licensee", "license grant", "royalt"],
+    "partnership_agreement": ["partnership agreement", "partners", "capital contribution", "profit sharing"],
+}
+_DOCUMENT_TYPE_RES = {
+    doc_type: re.compile(r"\b(?:" + "|".join(re.escape(c) for c in cues) + r")", re.IGNORECASE)
+    for doc_type, cues in _DOCUMENT_TYPE_CUES.items()
+}
+
+
+def _canonical_place(match: str) -> str:
+    return _CANONICAL_PLACES[" ".join(match.split()).lower()]
+
+
+def _first_place(fragment: str) -> Optional[str]:
+    m = _PLACE_RE.search(fragment)
+    return _canonical_place(m.group(1)) if m else None
+
+
+def _country(label: str) -> str:
+    return label.split("-", 1)[0]
+
+
+def _detect_document_type(text: str) -> Tuple[str, float]:
+    head = text[:1500]
+    scores = {}
+    for doc_type, pattern in _DOCUMENT_TYPE_RES.items():
+        # Cues in the opening (title, recitals) count more than ones in the body
+        hits = len(pattern.findall(text)) + 2 * len(pattern.findall(head))
+        if hits:
+            scores[doc_type] = hits
+    if not scores:
+        return "unknown", 0.0
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    best, best_hits = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return best, min(1.0, 0.3 + 0.1 * (best_hits - runner_up))
+
+
+def detect_jurisdiction(text: str) -> Dict[str, Any]:
+    """
+    Rule-and-lexicon jurisdiction/document-type detection. Returns the same shape as the
+    LLM detector plus a numeric "score" (0-1) and "source": "rules".
+
+    A governing-law clause naming a known place is the strong signal; venue clauses,
+    place mentions and currency only add to (or, if they disagree, subtract from) it.
+    """
+    text = text or ""
+    votes: Counter = Counter()
+    indicators: List[str] = []
+    governing_law = "not specified"
+
+    for m in _GOVERNING_LAW_RE.finditer(text):
+        place = _first_place(m.group(1))
+        if place:
+            votes[_PLACES[place]] += 0.6
+            if governing_law == "not specified":
+                governing_law = f"Laws of {place}"
+            indicators.append(m.group(0).strip()[:120])
+
+    for m in _VENUE_RE.finditer(text):
+        place = _first_place(m.group(1))
+        if place:
+            votes[_PLACES[place]] += 0.25
+            indicators.append(m.group(0).strip()[:120])
+
+    mentions = Counter(_PLACES[_canonical_place(p)] for p in _PLACE_RE.findall(text))
+    for label, count in mentions.items():
+        votes[label] += min(0.2, 0.05 * count)
+
+    if not votes:
+        jurisdiction, score = "Unknown", 0.0
+    else:
+        # A bare country vote ("US") supports its more specific label ("US-Delaware")
+        for label in list(votes):
+            if "-" in label and _country(label) in votes:
+                votes[label] += votes[_country(label)]
+        ranked = votes.most_common()
+        jurisdiction, score = ranked[0]
+        if len(ranked) > 1 and _country(ranked[1][0]) != _country(jurisdiction):
+            score -= 0.5 * ranked[1][1]  # competing countries: less sure
+
+    currencies = {country for pattern, country in _CURRENCY_RES if pattern.search(text)}
+    if jurisdiction != "Unknown" and currencies:
+        if _country(jurisdiction) in currencies or (jurisdiction.startswith("EU") and "EU" in currencies):
+            score += 0.1
+        else:
+            score -= 0.1
+        indicators.extend(sorted(f"currency:{c}" for c in currencies))
+    elif jurisdiction == "Unknown" and len(currencies) == 1:
+        # Currency alone only narrows it to a country, and never confidently
+        jurisdiction, score = next(iter(currencies)), 0.2
+        indicators.append(f"currency:{jurisdiction}")
+
+    score = round(max(0.0, min(1.0, score)), 3)
+    document_type, type_score = _detect_document_type(text)
+    if score >= _HIGH_CONFIDENCE and document_type != "unknown":
+        confidence = "high"
+    elif score >= LLM_THRESHOLD:
+        confidence = "medium"
+    else:
+        confidence = "low"
+
+    return {
+        "jurisdiction": jurisdiction,
+        "confidence": confidence,
+        "score": score,
+        "document_type": document_type,
+        "document_type_score": round(type_score, 3),
+        "governing_law": governing_law,
+        "indicators": indicators[:10],
+        "source": "rules",
+    }
@@ -0,0 +1,156 @@
+# llm_gateway.py
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from google import genai
+from google.genai import types
+
+from adaptive_control import AdjustableSemaphore
+from priority_scheduler import PriorityScheduler
+
+_API_KEY = os.getenv("GEMINI_API_KEY")
+_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", 120))
+_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", 20))
+_GENERATION_CONCURRENCY = int(os.getenv("GEMINI_GENERATION_CONCURRENCY", 4))
+_MIN_BULK_SHARE = float(os.getenv("SCHEDULER_MIN_BULK_SHARE", 0.2))
+
+
+class _LatencyStats:
+    """Per-operation call/error counts and latency percentiles over the last 500 calls."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, op: str, seconds: float, ok: bool):
+        with self._lock:
+            entry = self._ops.setdefault(op, {"calls": 0, "errors": 0, "total_seconds": 0.0,
+                                              "latencies": deque(maxlen=500)})
+            entry["calls"] += 1
+            if not ok:
+                entry["errors"] += 1
+            entry["total_seconds"] += seconds
+            entry["latencies"].append(seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for op, entry in self._ops.items():
+                latencies = sorted(entry["latencies"])
+                def pct(p):
+                    return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 4) if latencies else 0.0
+                out[op] = {
+                    "calls": entry["calls"],
+                    "errors": entry["errors"],
+                    "avg_seconds": round(entry["total_seconds"] / entry["calls"], 4) if entry["calls"] else 0.0,
+                    "p50_seconds": pct(0.5),
+                    "p95_seconds": pct(0.95),
+                    "max_seconds": latencies[-1] if latencies else 0.0,
+                }
+            return out
+
+
+class LLMGateway:
+    """The one google-genai client for the whole backend.
+
+    A single long-lived client keeps its HTTP connections alive between calls,
+    so requests no longer pay client construction and TLS setup. Every call
+    goes through here and is timed per operation; generate/stream calls also
+    take a generation slot from the priority scheduler.
+    """
+
+    def __init__(self, api_key: Optional[str] = _API_KEY, timeout_seconds: float = _TIMEOUT_SECONDS,
+                 max_connections: int = _MAX_CONNECTIONS, generation_concurrency: int = _GENERATION_CONCURRENCY):
+        if not api_key:
+            raise RuntimeError("Google AI Studio API key not set in GEMINI_API_KEY")
+        self.timeout_seconds = timeout_seconds
+        self.client = genai.Client(api_key=api_key, http_options=self._http_options(timeout_seconds, max_connections))
+        self.scheduler = PriorityScheduler(
+            "generation", AdjustableSemaphore(generation_concurrency), min_bulk_share=_MIN_BULK_SHARE
+        )
+        self.metrics = _LatencyStats()
+
+    @staticmethod
+    def _http_options(timeout_seconds: float, max_connections: int):
+        timeout_ms = int(timeout_seconds * 1000)
+        try:
+            # Size the keep-alive pool explicitly where the SDK lets us pass httpx arguments
+            import httpx
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            return types.HttpOptions(timeout=timeout_ms, client_args={"limits": limits})
+        except Exception:
+            return types.HttpOptions(timeout=timeout_ms)
+
+    @contextmanager
+    def _timed(self, op: str):
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.metrics.record(op, time.perf_counter() - started, ok)
+
+    def generation_slot(self, timeout: Optional[float] = 300):
+        """Hold a generation slot (by the caller's priority class) for work spanning several calls."""
+        return self.scheduler.slot(timeout=timeout)
+
+    def generate(self, model: str, contents: Any, config: Optional[Any] = None, **kwargs) -> Any:
+        with self.generation_slot(), self._timed("generate"):
+            return self.client.models.generate_content(model=model, contents=contents, config=config, **kwargs)
+
+    def stream(self, model: str, contents: Any, config: Optional[Any] = None, **kwargs) -> Iterator[Any]:
+        """Yield response chunks; the generation slot is held until the stream is exhausted or closed."""
+        with self.generation_slot():
+            started = time.perf_counter()
+            first = True
+            with self._timed("stream"):
+                for chunk in self.client.models.generate_content_stream(
+                    model=model, contents=contents, config=config, **kwargs
+                ):
+                    if first:
+                        self.metrics.record("stream_first_chunk", time.perf_counter() - started, True)
+                        first = False
+                    yield chunk
+
+    def embed(self, model: str, contents: Any, config: Optional[Any] = None) -> Any:
+        # Embedding concurrency and pacing are handled by pipeline's limiter and AIMD controller
+        with self._timed("embed"):
+            return self.client.models.embed_content(model=model, contents=contents, config=config)
+
+    def count_tokens(self, model: str, contents: Any) -> Any:
+        with self._timed("count_tokens"):
+            return self.client.models.count_tokens(model=model, contents=contents)
+
+    def create_cache(self, model: str, config: Any) -> Any:
+        with self._timed("cache_create"):
+            return self.client.caches.create(model=model, config=config)
+
+    def delete_cache(self, name: str) -> Any:
+        with self._timed("cache_delete"):
+            return self.client.caches.delete(name=name)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "timeout_seconds": self.timeout_seconds,
+            "operations": self.metrics.as_dict(),
+            "generation_scheduler": self.scheduler.get_stats(),
+        }
+
+
+# Global gateway instance (lazy initialization)
+llm_gateway = None
+_gateway_lock = threading.Lock()
+
+def get_llm_gateway() -> LLMGateway:
+    """Get or create the global LLM gateway."""
+    global llm_gateway
+    if llm_gateway is None:
+        with _gateway_lock:
+            if llm_gateway is None:
+                llm_gateway = LLMGateway()
+    return llm_gateway
@@ -11,12 +11,14 @@ from dotenv import load_dotenv
 # Add these imports at the top of main.py
 import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import time
 import numpy as np
 import fitz  # PyMuPDF
 import io
 import re
+import hashlib
 
 # Import caching and token counting systems
 from token_counter import get_token_counter
@@ -180,9 +182,19 @@ from firestore_adapter import (
     add_document_metadata, update_document_status, add_chunks, add_summary, 
     get_summary_by_doc_id, get_chunks_by_doc_id, add_qa_session, 
     get_qa_sessions_by_user, get_qa_session_by_id, update_qa_session_messages, 
-    update_qa_session_field, delete_qa_session
+    update_qa_session_field, delete_qa_session, update_document_fields, replace_summary,
+    get_document_content_hash, get_analysis, put_analysis, get_documents_by_ids, get_processing_state
 )
-from pipeline import chunk_text, debug_simple_embedding_test, embed_text, embed_texts, generate_summary
+from pipeline import embed_text, get_pipeline_stats
+from llm_gateway import get_llm_gateway
+from ingestion import IngestionPipeline, IngestionError
+from job_queue import WorkerPool, get_job_queue, QUEUED, RUNNING
+from retrieval import VectorIndex, get_index_cache
+from answer_cache import get_answer_cache
+from embedding_cache import get_embedding_cache
+from single_flight import SingleFlight
+from jurisdiction_detector import detect_jurisdiction
+from clause_alignment import align as align_clauses
 
 @app.delete("/api/chat/session/{session_id}")
 def delete_chat_session(session_id: str, user=Depends(verify_firebase_token)):
@@ -443,13 +455,12 @@ async def upload_document_content(
     doc_id = add_document_metadata(db, doc)  # Pass db
     print(f"Document stored with ID: {doc_id}")
 
-    # --- Start processing in background so embeddings are created immediately ---
+    # --- Queue processing; the worker pool drains jobs at the rate quota allows ---
     try:
-        t = threading.Thread(target=_process_document_sync, args=(doc_id, user["uid"]), daemon=True)
-        t.start()
-        print(f"Background processing thread started for {doc_id}")
+        _enqueue_processing(doc_id, user["uid"])
     except Exception as e:
-        print(f"Failed to start background thread for processing: {e}")
+        print(f"Failed to queue processing job, processing in a background thread instead: {e}")
+        threading.Thread(target=_process_document_sync, args=(doc_id, user["uid"]), daemon=True).start()
 
     return {"document_id": doc_id, "status": "uploaded", "extraction_method": extraction_method}
 
@@ -458,7 +469,8 @@ async def upload_document_content(
 
 def _process_document_sync(document_id: str, owner_uid: str):
     """Synchronous processing function that chunks, embeds, stores chunks and summary.
-       Can be called directly (synchronously) or from a background thread.
+       Can be called directly (synchronously) or from a background job worker.
+       Returns the final document status.
     """
     def send_status_update(status: str, message: str = ""):
         """Send status update via WebSocket (syncwrapper)"""
@@ -493,114 +505,48 @@ def _process_document_sync(document_id: str, owner_uid: str):
     try:
         # Send initial processing status
         send_status_update("processing", "Starting document processing...")
-        
-        # Add this before the embedding code in _process_document_sync
-        debug_simple_embedding_test()
         print(f"[processor] Starting processing for {document_id} (owner {owner_uid})")
         update_document_status(db, document_id, "processing")  # Pass db
-        
-        # Send status update
-        send_status_update("processing", "Extracting document content...")
-        
-        doc_ref = db.collection(os.getenv("FIRESTORE_DOCUMENTS_COLLECTION", "documents")).document(document_id)
-        snapshot = doc_ref.get()
-        if not snapshot.exists:
-            print(f"[processor] Document {document_id} not found")
-            update_document_status(db, document_id, "failed")  # Pass db
-            send_status_update("failed", "Document not found")
-            return
-
-        doc = snapshot.to_dict() or {}
-        content = doc.get("documentContent", "")
-        if not content:
-            print(f"[processor] No content for {document_id}")
-            update_document_status(db, document_id, "failed")  # Pass db
-            send_status_update("failed", "No document content found")
-            return
-
-        # create pages (you are storing as single-page extracted content)
-        pages = [{"page": 1, "text": content}]
-        chunks = chunk_text(pages)
-        if not chunks:
-            print(f"[processor] No chunks generated for {document_id}")
-            update_document_status(db, document_id, "failed")  # Pass db
-            send_status_update("failed", "Failed to process document text")
-            return
-
-        print(f"[processor] {len(chunks)} chunks created for {document_id} (preview: {chunks[0]['text'][:120]})")
-        send_status_update("processing", f"Created {len(chunks)} text chunks, generating embeddings...")
-
-        # embed in batches with delays
-        batch_size = int(os.getenv("EMBED_BATCH_SIZE", 2))  # Reduced default batch size
+        # Chunks are about to be rewritten; drop any cached vectors and answers for this document
+        get_index_cache().invalidate(document_id)
+        get_answer_cache().invalidate(document_id)
+
+        # Extract → chunk → embed → store run as overlapping stages; summary generation
+        # runs concurrently with embedding since it only needs chunk text.
+        ingestion = IngestionPipeline(
+            db,
+            document_id,
+            on_progress=lambda message: send_status_update("processing", message),
+            on_chunks_stored=lambda count: get_index_cache().invalidate(document_id),
+        )
         try:
-            texts = [c["text"] for c in chunks]
-            total_batches = (len(texts) + batch_size - 1) // batch_size
-            print(f"[processor] Processing {len(texts)} texts in {total_batches} batches")
-            
-            for i in range(0, len(texts), batch_size):
-                batch_num = (i // batch_size) + 1
-                batch_texts = texts[i:i+batch_size]
-                
-                print(f"[processor] Processing embedding batch {batch_num}/{total_batches} ({len(batch_texts)} items)")
-                send_status_update("processing", f"Processing embeddings batch {batch_num}/{total_batches}...")
-                
-                try:
-                    # Add a small delay before each batch
-                    if i > 0:  # Don't delay before the first batch
-                        sleep_time = 3.0  # 3 seconds between batches
-                        print(f"[processor] Waiting {sleep_time}s before next embedding batch...")
-                        time.sleep(sleep_time)
-                    
-                    embeddings = embed_texts(batch_texts)
-                    
-                    # Assign embeddings to chunks
-                    for j, emb in enumerate(embeddings):
-                        idx = i + j
-                        if idx < len(chunks):  # Safety check
-                            chunks[idx]["embedding"] = emb
-                            chunks[idx]["documentId"] = document_id
-                    
-                    print(f"[processor] ✅ Batch {batch_num}/{total_batches} completed successfully")
-                    
-                except Exception as batch_e:
-                    print(f"[processor] ❌ Embedding error for batch {batch_num}: {batch_e}")
-                    # Add longer delay before retrying or continuing
-                    time.sleep(5.0)
-                    raise batch_e
-            
-            print(f"[processor] ✅ All embeddings generated for {len(chunks)} chunks.")
-            send_status_update("processing", "Embeddings complete, storing data...")
-            
-        except Exception as e:
-            print(f"[processor] Embedding error for {document_id}: {e}")
-            traceback.print_exc()
+            result = ingestion.run()
+        except IngestionError as e:
+            print(f"[processor] {e} for {document_id}")
+            if e.cause is not None:
+                traceback.print_exception(type(e.cause), e.cause, e.cause.__traceback__)
             update_document_status(db, document_id, "failed")  # Pass db
-            send_status_update("failed", "Failed to generate embeddings")
-            return
-
-        # Small delay before storing chunks
-        print("[processor] Waiting 2s before storing chunks...")
-        time.sleep(2.0)
+            send_status_update("failed", e.message)
+            return "failed"
 
-        # persist chunks and summary
+        get_index_cache().invalidate(document_id)
+        get_answer_cache().invalidate(document_id)  # answers given mid-processing saw a partial index
+        print(f"[processor] ✅ {result['stored_count']} chunks stored. Stage timings: {result['timings']}")
         try:
-            add_chunks(db, chunks)  # Pass db
-            print(f"[processor] ✅ Chunks stored successfully")
-            send_status_update("processing", "Generating document summary...")
+            update_document_fields(db, document_id, {"processingTimings": result["timings"]})
         except Exception as e:
-            print(f"[processor] add_chunks failed for {document_id}: {e}")
-            traceback.print_exc()
-            update_document_status(db, document_id, "failed")  # Pass db
-            send_status_update("failed", "Failed to store document chunks")
-            return
+            print(f"[processor] Could not record stage timings for {document_id}: {e}")
 
-        # Small delay before generating summary
-        print("[processor] Waiting 2s before generating summary...")
-        time.sleep(2.0)
+        if result["summary_skipped"]:
+            update_document_status(db, document_id, "processed")  # Pass db
+            print(f"[processor] ✅ Document {document_id} processed (summary already up to date).")
+            send_status_update("processed", "Document processing complete!")
+            return "processed"
 
         try:
-            print(f"[processor] Generating summary for {len(chunks)} chunks...")
-            summary_data = generate_summary(chunks)
+            summary_data = result["summary"]
+            if summary_data is None:
+                raise RuntimeError(result["summary_error"] or "summary generation failed")
             
             # Create combined summary text
             combined_summary = _create_combined_summary(summary_data)
@@ -609,10 +555,11 @@ def _process_document_sync(document_id: str, owner_uid: str):
                 "documentId": document_id, 
                 "bullets": summary_data.get("bullets", []),
                 "risks": summary_data.get("risks", []),
-                "summary": combined_summary  # Add the combined summary
+                "summary": combined_summary,  # Add the combined summary
+                "contentHash": result["content_hash"],
             }
             print("Generated summary after processing:", summary_doc)
-            add_summary(db, summary_doc)  # Pass db
+            replace_summary(db, summary_doc)  # Pass db
             print(f"[processor] ✅ Summary stored successfully")
             
         except Exception as e:
@@ -621,11 +568,12 @@ def _process_document_sync(document_id: str, owner_uid: str):
             # still mark processed if chunking/embeds worked; but mark partial
             update_document_status(db, document_id, "processed_with_summary_error")  # Pass db
             send_status_update("processed", "Document processed (summary generation had issues)")
-            return
+            return "processed_with_summary_error"
 
         update_document_status(db, document_id, "processed")  # Pass db
         print(f"[processor] ✅ Document {document_id} processed successfully.")
         send_status_update("processed", "Document processing complete!")
+        return "processed"
         
     except Exception as e:
         print(f"[processor] Unexpected error while processing {document_id}: {e}")
@@ -635,12 +583,63 @@ def _process_document_sync(document_id: str, owner_uid: str):
             send_status_update("failed", f"Processing failed: {str(e)}")
         except Exception:
             pass
+        return "failed"
+
+
+# --- Background processing jobs ---
+PROCESS_DOCUMENT_JOB = "process_document"
+_PROCESS_WAIT_TIMEOUT = float(os.getenv("PROCESS_WAIT_TIMEOUT", 600))  # callers that need chunks now
+
+def _enqueue_processing(document_id: str, owner_uid: str) -> str:
+    """Queue (re-)processing; a document already queued or running gets that job's ID back."""
+    job_id = get_job_queue().enqueue(
+        PROCESS_DOCUMENT_JOB,
+        {"document_id": document_id, "owner_uid": owner_uid},
+        dedupe_key=f"{PROCESS_DOCUMENT_JOB}:{document_id}",
+    )
+    update_document_fields(db, document_id, {"processingJobId": job_id})
+    print(f"Processing job {job_id} queued for {document_id}")
+    return job_id
+
+def _process_document_and_wait(document_id: str, user):
+    """Process through the job queue (never alongside another job for the same document) and wait for it."""
+    job_id = _enqueue_processing(document_id, user["uid"])
+    job = get_job_queue().wait(job_id, _PROCESS_WAIT_TIMEOUT)
+    if job is not None and job["status"] in (QUEUED, RUNNING):
+        raise HTTPException(status_code=503, detail="Document is still being processed; try again shortly")
+
+def _run_process_document_job(payload: Dict[str, Any]):
+    """Job handler: raise on failure so the queue retries with backoff."""
+    status = _process_document_sync(payload["document_id"], payload["owner_uid"])
+    if status == "failed":
+        raise RuntimeError(f"Processing failed for document {payload['document_id']}")
+
+def _abandon_process_document_job(payload: Dict[str, Any]):
+    """The worker died on the last attempt, so nothing else will move the document out of "processing"."""
+    update_document_status(db, payload["document_id"], "failed")
+
+_worker_pool = None
+
+@app.on_event("startup")
+def start_job_workers():
+    global _worker_pool
+    _worker_pool = WorkerPool(
+        get_job_queue(),
+        {PROCESS_DOCUMENT_JOB: _run_process_document_job},
+        abandon_handlers={PROCESS_DOCUMENT_JOB: _abandon_process_document_job},
+    )
+    _worker_pool.start()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    if _worker_pool is not None:
+        _worker_pool.stop()
 
 @app.post("/api/process/{document_id}")
 def process_document(document_id: str, user=Depends(verify_firebase_token)):
-    # Synchronous request to (re-)process the document using same helper:
-    _process_document_sync(document_id, user["uid"])
-    return {"status": "processing_started"}
+    """(Re-)process the document through the job queue; poll /api/documents/{id}/status for progress."""
+    job_id = _enqueue_processing(document_id, user["uid"])
+    return {"status": "processing_started", "job_id": job_id}
 
 @app.get("/api/documents/{document_id}/summary")
 def get_summary(document_id: str, user=Depends(verify_firebase_token)):
@@ -657,62 +656,81 @@ def get_summary(document_id: str, user=Depends(verify_firebase_token)):
     return {**summary_data, "document_id": document_id}
 
 # --- Similarity Search Helpers ---
-import numpy as np
 
-def cosine_similarity(a, b):
-    a = np.array(a)
-    b = np.array(b)
-    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8)
-
-def mmr(query_emb, chunk_embs, K=8, lambda_=0.7):
-    selected = []
-    candidate_idxs = list(range(len(chunk_embs)))
-    sim_to_query = [cosine_similarity(query_emb, emb) for emb in chunk_embs]
-    while len(selected) < K and candidate_idxs:
-        if not selected:
-            idx = max(candidate_idxs, key=lambda i: sim_to_query[i])
-            selected.append(idx)
-            candidate_idxs.remove(idx)
-        else:
-            scores = []
-            for i in candidate_idxs:
-                diversity = max([cosine_similarity(chunk_embs[i], chunk_embs[j]) for j in selected]) if selected else 0
-                score = lambda_ * sim_to_query[i] - (1 - lambda_) * diversity
-                scores.append((score, i))
-            idx = max(scores)[1]
-            selected.append(idx)
-            candidate_idxs.remove(idx)
-    return selected
+def _document_index_version(document_id: str) -> Optional[str]:
+    """Changes whenever ingestion stores chunks or finishes, in whichever worker ran it."""
+    state = get_processing_state(db, document_id)
+    if state is None:
+        return None
+    checkpoint = state.get("processingCheckpoint") or {}
+    return f"{state.get('status')}:{state.get('contentHash')}:{checkpoint.get('storedChunks')}:{checkpoint.get('updatedAt')}"
+
+def get_document_index(document_id: str) -> VectorIndex:
+    """Return the document's vector index, loading chunks from Firestore only on a cache miss."""
+    return get_index_cache().get_or_load(
+        document_id,
+        lambda: VectorIndex.from_chunks(get_chunks_by_doc_id(db, document_id)),
+        version_fn=lambda: _document_index_version(document_id),
+    )
+
+# Identical analyses requested concurrently (two tabs, frontend retries) share one LLM call
+_LEGAL_ANALYSIS_FLIGHTS = SingleFlight("legal_analysis")
+_DOCUMENT_ANALYSIS_FLIGHTS = SingleFlight("document_analysis")
+_COMPARISON_FLIGHTS = SingleFlight("comparison_analysis")
+_COMPARE_CONCURRENCY = int(os.getenv("COMPARE_CONCURRENCY", 4))  # documents/pairs analyzed at once per comparison
+_DOCUMENT_ANALYSIS_MODEL = "gemini-2.0-flash-exp"
+_DOCUMENT_ANALYSIS_PROMPT_VERSION = "1"  # cached analyses are keyed by this and the model
+_COMPARISON_MODEL = "gemini-2.0-flash-exp"
+_COMPARISON_PROMPT_VERSION = "2"  # bump when the comparison prompt changes so cached pairs are recomputed
+_COMPARISON_PAIR_TTL_HOURS = int(os.getenv("COMPARISON_PAIR_TTL_HOURS", 24))
+_ALIGN_MAX_SECTIONS = int(os.getenv("COMPARE_ALIGN_MAX_SECTIONS", 12))  # per kind (divergent / only-in-one)
+_ALIGN_MAX_CHARS = int(os.getenv("COMPARE_ALIGN_MAX_CHARS", 1500))      # per clause text in the prompt
+
+# Stored legal analyses are reused only while all three match; bump the version whenever the
+# analysis or jurisdiction prompt changes so older artifacts are regenerated on next request
+_LEGAL_ANALYSIS_KIND = "legal"
+_LEGAL_ANALYSIS_MODEL = "gemini-2.0-flash-exp"
+_LEGAL_ANALYSIS_PROMPT_VERSION = "2"
+
+def _document_content_hash(document_id: str) -> Optional[str]:
+    """Ingestion's hash of the document text; older documents fall back to hashing their chunks."""
+    content_hash = get_document_content_hash(db, document_id)
+    if content_hash:
+        return content_hash
+    index = get_document_index(document_id)
+    if not len(index):
+        return None
+    return hashlib.sha256("\n".join(index.texts).encode("utf-8")).hexdigest()
 
 @app.post("/api/documents/{document_id}/query")
 def query_document(document_id: str, data: dict = Body(...), user=Depends(verify_firebase_token)):
     question = data.get("question")
-    chunks = get_chunks_by_doc_id(db, document_id)  # Pass db
-    chunk_texts = [c["text"] for c in chunks]
-    chunk_embs = [c["embedding"] for c in chunks]
+    # Read before the index, so cached answers are keyed by a version no newer than what they saw
+    version = _document_index_version(document_id)
+    index = get_document_index(document_id)
     # 1. Embed the query
     query_emb = embed_text(question)
-    # 2. Top-K pool
-    sim_scores = [cosine_similarity(query_emb, emb) for emb in chunk_embs]
-    pool_size = min(50, len(chunks))
-    top_pool_idxs = sorted(range(len(sim_scores)), key=lambda i: sim_scores[i], reverse=True)[:pool_size]
-    pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-    pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-    # 3. MMR selection
-    K = min(8, len(pool_embs))
-    selected_idxs = mmr(query_emb, pool_embs, K=K, lambda_=0.7)
-    selected_texts = [pool_texts[i] for i in selected_idxs]
+    # Semantically repeated question: answer from cache, no retrieval or generation
+    cached = get_answer_cache().lookup(document_id, query_emb, variant="plain", version=version)
+    if cached:
+        texts_by_id = dict(zip(index.chunk_ids, index.texts))
+        sources = [
+            {"document_id": document_id, "snippet": (texts_by_id.get(chunk_id) or "")[:60]}
+            for chunk_id in cached["chunk_ids"]
+        ]
+        return {"answer": cached["answer"], "sources": sources, "cached": True}
+    # 2. Top-K pool + 3. MMR selection
+    selected = index.search(query_emb, pool_size=50, K=8, lambda_=0.7)
+    selected_texts = [index.texts[i] for i in selected]
     # 4. Gemini answer
-    from google import genai
     from google.genai import types
     
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
     
     context = "\n".join(selected_texts)
     prompt = f"Context: {context}\nQuestion: {question}\nAnswer in plain English in ≤ 120 words. If uncertain, respond 'I don't know — please consult a lawyer' and show the top 2 source snippets used."
     
-    response = client.models.generate_content(
+    response = llm.generate(
         model="gemini-2.5-flash",
         contents=prompt,
         config=types.GenerateContentConfig(
@@ -720,6 +738,9 @@ def query_document(document_id: str, data: dict = Body(...), user=Depends(verify
         )
     )
     answer = response.text if hasattr(response, 'text') else "No answer."
+    if getattr(response, "text", None):
+        get_answer_cache().store(document_id, query_emb, question, answer,
+                                 [index.chunk_ids[i] for i in selected], variant="plain", version=version)
     sources = [
         {"document_id": document_id, "snippet": t[:60]} for t in selected_texts
     ]
@@ -727,37 +748,27 @@ def query_document(document_id: str, data: dict = Body(...), user=Depends(verify
 
 @app.post("/api/documents/{document_id}/summarize")
 def summarize_document(document_id: str, user=Depends(verify_firebase_token)):
-    chunks = get_chunks_by_doc_id(db, document_id)  # Pass db
-    if not chunks or len(chunks) == 0:
+    index = get_document_index(document_id)
+    if not len(index):
         print("No chunks found, processing document first...")
-        process_document(document_id, user)
-    chunks = get_chunks_by_doc_id(db, document_id)  # Pass db
-    if not chunks:
+        _process_document_and_wait(document_id, user)
+        index = get_document_index(document_id)
+    if not len(index):
         raise HTTPException(status_code=500, detail="Failed to generate chunks")
 
-    chunk_texts = [c["text"] for c in chunks]
-    chunk_embs = [c["embedding"] for c in chunks]
     # Use MMR to select diverse, representative chunks for summary
     summary_prompt = "Summarize the following document in plain English, focusing on key points and risks."
     summary_emb = embed_text(summary_prompt)
-    pool_size = min(50, len(chunks))
-    top_pool_idxs = sorted(range(len(chunk_embs)), key=lambda i: cosine_similarity(summary_emb, chunk_embs[i]), reverse=True)[:pool_size]
-    pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-    pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-    K = min(10, len(pool_embs))
-    selected_idxs = mmr(summary_emb, pool_embs, K=K, lambda_=0.5)
-    selected_texts = [pool_texts[i] for i in selected_idxs]
+    selected_texts = index.select_texts(summary_emb, pool_size=50, K=10, lambda_=0.5)
     # Gemini summary
-    from google import genai
     from google.genai import types
     
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
     
     context = "\n".join(selected_texts)
     prompt = f"Context: {context}\n{summary_prompt}"
     
-    response = client.models.generate_content(
+    response = llm.generate(
         model="gemini-2.5-flash",
         contents=prompt,
         config=types.GenerateContentConfig(
@@ -765,35 +776,84 @@ def summarize_document(document_id: str, user=Depends(verify_firebase_token)):
         )
     )
     summary = response.text if hasattr(response, 'text') else "No summary."
-    print(f"Fetched {len(chunks)} chunks")
-    print(f"Example chunk text: {chunks[0]['text'][:200] if chunks else 'None'}")
+    print(f"Fetched {len(index)} chunks")
+    print(f"Example chunk text: {index.texts[0][:200] if len(index) else 'None'}")
 
     return {"summary": summary}
 
 @app.post("/api/documents/{document_id}/legal-analysis")
-def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token)):
-    """Generate comprehensive legal analysis for a document with Google Search integration."""
-    chunks = get_chunks_by_doc_id(db, document_id)
-    if not chunks or len(chunks) == 0:
+def generate_legal_analysis(document_id: str, refresh: bool = False, user=Depends(verify_firebase_token)):
+    """
+    Generate comprehensive legal analysis for a document with Google Search integration.
+    The result is stored per document and reused until the document content, prompt version
+    or model changes; pass ?refresh=true to regenerate it anyway.
+    """
+    key = SingleFlight.make_key("legal_analysis", document_id, refresh)
+    return _LEGAL_ANALYSIS_FLIGHTS.do(key, _get_or_generate_legal_analysis, document_id, user, refresh)
+
+_READY_STATUSES = ("processed", "processed_with_summary_error")
+
+def _ready_content_hash(document_id: str) -> Optional[str]:
+    """Content hash of a fully indexed document; None while ingestion is still running (or unknown)."""
+    state = get_processing_state(db, document_id)
+    if not state or state.get("status") not in _READY_STATUSES:
+        return None
+    return state.get("contentHash") or _document_content_hash(document_id)
+
+def _get_or_generate_legal_analysis(document_id: str, user, refresh: bool):
+    content_hash = _ready_content_hash(document_id)
+    if content_hash and not refresh:
+        stored = get_analysis(db, document_id, _LEGAL_ANALYSIS_KIND)
+        if (stored and stored.get("contentHash") == content_hash
+                and stored.get("promptVersion") == _LEGAL_ANALYSIS_PROMPT_VERSION
+                and stored.get("model") == _LEGAL_ANALYSIS_MODEL):
+            try:
+                print(f"Using stored legal analysis for document {document_id}")
+                return json.loads(stored["resultJson"])
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Stored legal analysis for {document_id} unreadable, regenerating: {e}")
+
+    analysis_data, indexed_hash = _generate_legal_analysis(document_id, user)
+    # Fallback structures (LLM error / unparseable output) are returned but never stored, and
+    # neither is an analysis of a partial index or of content re-processed while it ran
+    if indexed_hash:
+        try:
+            if _ready_content_hash(document_id) == indexed_hash:
+                put_analysis(db, document_id, _LEGAL_ANALYSIS_KIND, {
+                    "contentHash": indexed_hash,
+                    "promptVersion": _LEGAL_ANALYSIS_PROMPT_VERSION,
+                    "model": _LEGAL_ANALYSIS_MODEL,
+                    "createdAt": time.time(),
+                    "resultJson": json.dumps(analysis_data),
+                })
+            else:
+                print(f"Not storing legal analysis for {document_id}: document changed while analysing")
+        except Exception as e:
+            print(f"Could not store legal analysis for {document_id}: {e}")
+    return analysis_data
+
+def _generate_legal_analysis(document_id: str, user) -> Tuple[Dict[str, Any], Optional[str]]:
+    """Run the analysis; returns (analysis, indexed_hash).
+
+    indexed_hash is the content hash of the fully processed document the analysis
+    was built from, or None for fallback structures and mid-ingest (partial) indexes.
+    """
+    # Read the status before the chunks: chunks are committed before "processed" is set
+    indexed_hash = _ready_content_hash(document_id)
+    index = get_document_index(document_id)
+    if not len(index):
         print("No chunks found, processing document first...")
-        process_document(document_id, user)
-    chunks = get_chunks_by_doc_id(db, document_id)
-    if not chunks:
+        _process_document_and_wait(document_id, user)
+        indexed_hash = _ready_content_hash(document_id)
+        index = get_document_index(document_id)
+    if not len(index):
         raise HTTPException(status_code=500, detail="Failed to generate chunks")
 
-    chunk_texts = [c["text"] for c in chunks]
-    chunk_embs = [c["embedding"] for c in chunks]
-    
     # Use MMR to select comprehensive content for analysis
     analysis_prompt = "Analyze this legal document for clauses, risks, and legal implications."
     analysis_emb = embed_text(analysis_prompt)
-    pool_size = min(60, len(chunks))  # Larger pool for comprehensive analysis
-    top_pool_idxs = sorted(range(len(chunk_embs)), key=lambda i: cosine_similarity(analysis_emb, chunk_embs[i]), reverse=True)[:pool_size]
-    pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-    pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-    K = min(15, len(pool_embs))  # More chunks for detailed analysis
-    selected_idxs = mmr(analysis_emb, pool_embs, K=K, lambda_=0.6)
-    selected_texts = [pool_texts[i] for i in selected_idxs]
+    # Larger pool and more chunks for comprehensive, detailed analysis
+    selected_texts = index.select_texts(analysis_emb, pool_size=60, K=15, lambda_=0.6)
     
     context = "\n".join(selected_texts)
     
@@ -801,12 +861,10 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
     jurisdiction_info = detect_jurisdiction_and_context(context)
     
     # Enhanced Gemini analysis with Google Search integration
-    from google import genai
     from google.genai import types
     
     # Configure the client
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
     
     # # Define the grounding tool
     # grounding_tool = types.Tool(
@@ -884,8 +942,8 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
     
     try:
         # Make the request using the new Google Generative AI SDK with Google Search
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
+        response = llm.generate(
+            model=_LEGAL_ANALYSIS_MODEL,
             contents=legal_analysis_prompt,
             #config=config
         )
@@ -914,6 +972,7 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
         import json
         try:
             analysis_data = json.loads(analysis_text)
+            complete = True
             
             # Add search insights if we have them
             if search_insights and 'searchInsights' in analysis_data:
@@ -923,6 +982,7 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
                 
         except json.JSONDecodeError:
             # Fallback structure if JSON parsing fails
+            complete = False
             analysis_data = {
                 "summary": "Analysis generated with search integration but format parsing failed.",
                 "jurisdiction": {
@@ -954,7 +1014,7 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
             }
         
         print(f"Generated enhanced legal analysis with search for document {document_id}")
-        return analysis_data
+        return analysis_data, indexed_hash if complete else None
         
     except Exception as e:
         print(f"Error generating enhanced legal analysis: {e}")
@@ -987,15 +1047,20 @@ def generate_legal_analysis(document_id: str, user=Depends(verify_firebase_token
                 "Are there specific regulatory requirements to consider?"
             ],
             "searchInsights": ["Search integration temporarily unavailable"]
-        }
+        }, None
 
 def detect_jurisdiction_and_context(document_text):
-    """Detect jurisdiction and document context from document text."""
-    from google import genai
+    """
+    Detect jurisdiction and document context from document text.
+    The local rule/lexicon detector answers most documents; Gemini is only asked when it is unsure.
+    """
+    local_info = detect_jurisdiction(document_text)
+    if local_info["confidence"] != "low":
+        return local_info
+
     from google.genai import types
     
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
     
     detection_prompt = f"""
     Analyze this legal document text and detect:
@@ -1019,7 +1084,7 @@ def detect_jurisdiction_and_context(document_text):
     """
     
     try:
-        response = client.models.generate_content(
+        response = llm.generate(
             model="gemini-2.0-flash-exp",
             contents=detection_prompt
         )
@@ -1036,13 +1101,8 @@ def detect_jurisdiction_and_context(document_text):
         return json.loads(result_text)
     except Exception as e:
         print(f"Error detecting jurisdiction: {e}")
-        return {
-            "jurisdiction": "Unknown",
-            "confidence": "low",
-            "document_type": "unknown",
-            "governing_law": "not specified",
-            "indicators": []
-        }
+        # Best local guess (jurisdiction "Unknown" if there was no signal at all)
+        return local_info
 
 @app.post("/api/documents/{document_id}/export-pdf")
 def export_analysis_pdf(document_id: str, analysis_data: dict = Body(...), user=Depends(verify_firebase_token)):
@@ -1191,25 +1251,20 @@ def compare_documents(data: dict = Body(...), user=Depends(verify_firebase_token
         raise HTTPException(status_code=400, detail="At least 2 documents required for comparison")
     
     try:
-        # Check all documents are ready first
+        # Check all documents are ready first (one batched read for all of them)
+        document_ids = list(dict.fromkeys(document_ids))
+        documents = get_documents_by_ids(db, document_ids)
         document_statuses = []
+        failures = []
         for doc_id in document_ids:
-            try:
-                doc_ref = db.collection(os.getenv("FIRESTORE_DOCUMENTS_COLLECTION", "documents")).document(doc_id)
-                doc_snapshot = doc_ref.get()
-                
-                if not doc_snapshot.exists:
-                    print(f"Document {doc_id} not found in Firestore")
-                    continue
-                    
-                doc_data = doc_snapshot.to_dict()
-                status = doc_data.get('status', 'unknown')
-                document_statuses.append((doc_id, status, doc_data))
-                print(f"Document {doc_id} status: {status}")
-                
-            except Exception as e:
-                print(f"Error checking document {doc_id}: {e}")
+            if doc_id not in documents:
+                print(f"Document {doc_id} not found in Firestore")
+                failures.append({"id": doc_id, "error": "Document not found"})
                 continue
+            doc_data = documents[doc_id]
+            status = doc_data.get('status', 'unknown')
+            document_statuses.append((doc_id, status, doc_data))
+            print(f"Document {doc_id} status: {status}")
         
         # If any documents are still processing, return a processing status
         processing_docs = [doc_id for doc_id, status, _ in document_statuses if status not in ['processed', 'processed_with_summary_error']]
@@ -1221,38 +1276,37 @@ def compare_documents(data: dict = Body(...), user=Depends(verify_firebase_token
                 "total_count": len(document_ids)
             }
         
-        # Get analyses for all ready documents
+        # Analyze all ready documents concurrently; each LLM call still waits for a generation slot
+        def analyze(position, doc_id, doc_data):
+            index = get_document_index(doc_id)
+            print(f"Found {len(index)} chunks for document {doc_id}")
+            if not len(index):
+                raise ValueError("No chunks found for document")
+            analysis = generate_document_analysis(doc_id, index)
+            print(f"Successfully analyzed document {doc_id}")
+            return {
+                "id": doc_id,
+                "name": doc_data.get('filename', f'Document {position + 1}'),
+                "contentHash": doc_data.get("contentHash")
+                    or hashlib.sha256("\n".join(index.texts).encode("utf-8")).hexdigest(),
+                "analysis": analysis
+            }
+        
         document_analyses = []
-        for doc_id, status, doc_data in document_statuses:
-            try:
-                # Check if document is processed
-                if doc_data.get('status') not in ['processed', 'processed_with_summary_error']:
-                    print(f"Document {doc_id} not fully processed, skipping")
-                    continue
-                
-                chunks = get_chunks_by_doc_id(db, doc_id)
-                print(f"Found {len(chunks)} chunks for document {doc_id}")
-                
-                if not chunks:
-                    print(f"No chunks found for document {doc_id}")
-                    continue
-                
-                # Generate fresh analysis for comparison
-                analysis = generate_document_analysis(doc_id, chunks)
-                document_name = doc_data.get('filename', f'Document {len(document_analyses) + 1}')
-                
-                document_analyses.append({
-                    "id": doc_id,
-                    "name": document_name,
-                    "analysis": analysis
-                })
-                print(f"Successfully analyzed document {doc_id}")
-                
-            except Exception as e:
-                print(f"Error analyzing document {doc_id}: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+        if document_statuses:
+            workers = min(_COMPARE_CONCURRENCY, len(document_statuses))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compare") as pool:
+                futures = [
+                    (doc_id, pool.submit(analyze, position, doc_id, doc_data))
+                    for position, (doc_id, status, doc_data) in enumerate(document_statuses)
+                ]
+                for doc_id, future in futures:  # submission order keeps the documents in request order
+                    try:
+                        document_analyses.append(future.result())
+                    except Exception as e:
+                        print(f"Error analyzing document {doc_id}: {e}")
+                        traceback.print_exc()
+                        failures.append({"id": doc_id, "error": str(e)})
         
         print(f"Successfully analyzed {len(document_analyses)} out of {len(document_ids)} documents")
         
@@ -1264,54 +1318,57 @@ def compare_documents(data: dict = Body(...), user=Depends(verify_firebase_token
             error_msg = f"Need at least 2 processed documents for comparison. Ready: {len(ready_docs)}, Still processing: {len(processing_docs)}"
             if processing_docs:
                 error_msg += f". Please wait for documents to finish processing: {', '.join(processing_docs)}"
+            if failures:
+                error_msg += ". Failed: " + "; ".join(f"{f['id']} ({f['error']})" for f in failures)
             
             raise HTTPException(status_code=400, detail=error_msg)
         
-        # Generate comparison using Gemini
-        comparison_result = generate_comparison_analysis(document_analyses)
+        # One detailed comparison by default (the dashboard renders its overallComparison);
+        # "mode": "pairwise" opts into a ranking built from cached pairwise comparisons
+        if data.get("mode") == "pairwise":
+            comparison_result = generate_pairwise_comparison(document_analyses)
+        else:
+            comparison_result = generate_comparison_analysis(document_analyses)
         
         return {
             "id": f"comparison_{int(time.time())}",
             "documents": document_analyses,
-            "comparison": comparison_result
+            "comparison": comparison_result,
+            "failures": failures
         }
         
     except Exception as e:
         print(f"Error in document comparison: {e}")
-        import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Failed to compare documents: {str(e)}")
 
-def generate_document_analysis(doc_id, chunks):
+def generate_document_analysis(doc_id, index: VectorIndex):
     """Generate legal analysis for a single document with caching and token counting."""
-    
+    key = SingleFlight.make_key("document_analysis", doc_id, len(index))
+    return _DOCUMENT_ANALYSIS_FLIGHTS.do(key, _generate_document_analysis, doc_id, index)
+
+def _generate_document_analysis(doc_id, index: VectorIndex):
     # Get instances
     cache_system = get_cache_system()
     token_counter = get_token_counter()
     
     # 1. Check if analysis is already cached
-    cache_key = cache_system.generate_cache_key("analysis", doc_id, len(chunks))
+    cache_key = cache_system.generate_cache_key(
+        "analysis", doc_id, len(index),
+        prompt_version=_DOCUMENT_ANALYSIS_PROMPT_VERSION, model=_DOCUMENT_ANALYSIS_MODEL
+    )
     cached_result = cache_system.get_cached_result(cache_key)
     if cached_result:
         print(f"✅ Using cached analysis for document {doc_id}")
         return cached_result
     
-    chunk_texts = [c["text"] for c in chunks]
-    chunk_embs = [c["embedding"] for c in chunks]
-    
     # 2. Create document cache for future use
-    document_cache_name = cache_system.create_document_cache(doc_id, chunk_texts[:20], ttl_hours=2)
+    document_cache_name = cache_system.create_document_cache(doc_id, index.texts[:20], ttl_hours=2)
     
     # Use MMR to select comprehensive content for analysis
     analysis_prompt = "Analyze this legal document for clauses, risks, and legal implications."
     analysis_emb = embed_text(analysis_prompt)
-    pool_size = min(40, len(chunks))
-    top_pool_idxs = sorted(range(len(chunk_embs)), key=lambda i: cosine_similarity(analysis_emb, chunk_embs[i]), reverse=True)[:pool_size]
-    pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-    pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-    K = min(10, len(pool_embs))
-    selected_idxs = mmr(analysis_emb, pool_embs, K=K, lambda_=0.6)
-    selected_texts = [pool_texts[i] for i in selected_idxs]
+    selected_texts = index.select_texts(analysis_emb, pool_size=40, K=10, lambda_=0.6)
     
     context = "\n".join(selected_texts)
     
@@ -1346,26 +1403,24 @@ def generate_document_analysis(doc_id, chunks):
     print(f"📊 Analysis request - Estimated tokens: {token_info['input_tokens']}, Cost: ${token_info['estimated_cost_usd']:.4f}")
     
     # Generate structured analysis
-    from google import genai
     from google.genai import types
     
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
     
     try:
         # 4. Use cached model if available
         generate_config = types.GenerateContentConfig(temperature=0.2)
         if document_cache_name:
             print(f"🗃️ Using document cache: {document_cache_name}")
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
+            response = llm.generate(
+                model=_DOCUMENT_ANALYSIS_MODEL,
                 contents=[{"role": "user", "parts": [{"text": analysis_prompt_full}]}],
                 config=generate_config,
                 cached_content=document_cache_name
             )
         else:
-            response = client.models.generate_content(
-                model="gemini-2.0-flash-exp",
+            response = llm.generate(
+                model=_DOCUMENT_ANALYSIS_MODEL,
                 contents=analysis_prompt_full,
                 config=generate_config
             )
@@ -1416,26 +1471,40 @@ def generate_document_analysis(doc_id, chunks):
 
 def generate_comparison_analysis(document_analyses):
     """Generate detailed comparison between documents with caching and token counting."""
-    
+    key = SingleFlight.make_key("comparison_analysis", document_analyses)
+    return _COMPARISON_FLIGHTS.do(key, _generate_comparison_analysis, document_analyses)
+
+def _generate_comparison_analysis(document_analyses, raise_errors: bool = False, use_cache: bool = True):
+    """`use_cache=False` is for callers that cache the result under their own key (pairwise mode)."""
     # Get instances
     cache_system = get_cache_system()
     token_counter = get_token_counter()
     
-    # 1. Generate cache key based on document IDs and analysis content
+    # 1. Generate cache key based on document IDs and content hashes (a reprocessed document misses)
     doc_ids = [doc.get('id', 'unknown') for doc in document_analyses]
-    cache_key = cache_system.generate_cache_key("comparison", *doc_ids, len(document_analyses))
+    cache_key = cache_system.generate_cache_key(
+        "comparison", *doc_ids, *(doc.get('contentHash') for doc in document_analyses), len(document_analyses),
+        prompt_version=_COMPARISON_PROMPT_VERSION, model=_COMPARISON_MODEL
+    )
     
     # 2. Check for cached comparison
-    cached_result = cache_system.get_cached_result(cache_key)
+    cached_result = cache_system.get_cached_result(cache_key) if use_cache else None
     if cached_result:
         print(f"✅ Using cached comparison for documents: {doc_ids}")
         return cached_result
     
-    from google import genai
     from google.genai import types
     
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
+    llm = get_llm_gateway()
+    
+    # Two documents with stored embeddings: pre-align their chunks so the prompt carries only
+    # the differing clauses instead of both full clause listings
+    alignment_text = None
+    if len(document_analyses) == 2:
+        try:
+            alignment_text = _aligned_differences(document_analyses[0]['id'], document_analyses[1]['id'])
+        except Exception as e:
+            print(f"⚠️ Clause alignment unavailable, sending full clause listings: {e}")
     
     # Prepare detailed documents for comparison
     docs_detail = []
@@ -1448,7 +1517,7 @@ def generate_comparison_analysis(document_analyses):
             
             # Extract detailed clause information with safety checks
             clause_details = []
-            for category in analysis.get('clauseCategories', []):
+            for category in ([] if alignment_text else analysis.get('clauseCategories', [])):
                 if not isinstance(category, dict):
                     continue
                 category_text = f"Category: {category.get('category', 'Unknown')}\n"
@@ -1485,7 +1554,7 @@ def generate_comparison_analysis(document_analyses):
             {key_terms_text}
             
             Detailed Clause Analysis:
-            {chr(10).join(clause_details) if clause_details else 'No clause analysis available'}
+            {chr(10).join(clause_details) if clause_details else ('See aligned clause differences below' if alignment_text else 'No clause analysis available')}
             """)
             
         except Exception as e:
@@ -1500,24 +1569,12 @@ def generate_comparison_analysis(document_analyses):
             Note: This document could not be fully processed for comparison
             """)
             continue
-        
-        docs_detail.append(f"""
-        Document {i+1} ({doc['name']}):
-        Summary: {analysis.get('summary', '')}
-        Risk Score: {analysis.get('riskScore', 50)}/100
-        Overall Risk: {analysis.get('overallRisk', 'medium')}
-        Jurisdiction: {analysis.get('jurisdiction', 'unknown')}
-        
-        {key_terms_text}
-        
-        Detailed Clause Analysis:
-        {chr(10).join(clause_details)}
-        """)
     
     comparison_prompt = f"""
     Compare these legal documents in detail and identify specific differences, risks, and recommendations:
     
     {chr(10).join(docs_detail)}
+    {alignment_text or ''}
     
     Provide a comprehensive comparison in JSON format. Focus on practical differences that matter for legal risk and business outcomes:
     
@@ -1566,8 +1623,8 @@ def generate_comparison_analysis(document_analyses):
     print(f"📊 Comparison request - Estimated tokens: {token_info['input_tokens']}, Cost: ${token_info['estimated_cost_usd']:.4f}")
     
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
+        response = llm.generate(
+            model=_COMPARISON_MODEL,
             contents=comparison_prompt,
             config=types.GenerateContentConfig(
                 temperature=0.2
@@ -1598,8 +1655,9 @@ def generate_comparison_analysis(document_analyses):
         result = json.loads(comparison_text)
         
         # 5. Cache the comparison result
-        cache_system.store_cached_result(cache_key, result, ttl_hours=1)
-        print(f"💾 Cached comparison result for documents: {doc_ids}")
+        if use_cache:
+            cache_system.store_cached_result(cache_key, result, ttl_hours=1)
+            print(f"💾 Cached comparison result for documents: {doc_ids}")
         
         return result
         
@@ -1607,6 +1665,8 @@ def generate_comparison_analysis(document_analyses):
         print(f"❌ Error generating comparison: {e}")
         # Track failed request
         token_counter.track_api_usage(token_info.get('input_tokens', 0), 0, 0)
+        if raise_errors:
+            raise
         
         return {
             "clauseDifferences": [],
@@ -1620,6 +1680,136 @@ def generate_comparison_analysis(document_analyses):
             "recommendations": ["Manual review recommended due to analysis error"]
         }
 
+def _aligned_differences(first_id: str, second_id: str) -> Optional[str]:
+    """
+    Prompt section listing only the clauses that differ between two documents, found by
+    aligning their chunk embeddings. None if either document has no embedded chunks.
+    """
+    first, second = get_document_index(first_id), get_document_index(second_id)
+    if not len(first) or not len(second):
+        return None
+    alignment = align_clauses(first, second)
+
+    def clip(text):
+        return text if len(text) <= _ALIGN_MAX_CHARS else text[:_ALIGN_MAX_CHARS] + "…"
+
+    sections = []
+    for i, j, score in alignment["divergent"][:_ALIGN_MAX_SECTIONS]:
+        sections.append(f"Matching clause, worded differently (similarity {score:.2f}):\n"
+                        f"Document 1: {clip(first.texts[i])}\nDocument 2: {clip(second.texts[j])}")
+    for i in alignment["only_first"][:_ALIGN_MAX_SECTIONS]:
+        sections.append(f"Only in Document 1:\n{clip(first.texts[i])}")
+    for j in alignment["only_second"][:_ALIGN_MAX_SECTIONS]:
+        sections.append(f"Only in Document 2:\n{clip(second.texts[j])}")
+    print(f"🧩 Clause alignment {first_id}/{second_id}: {len(alignment['identical'])} identical, "
+          f"{len(alignment['divergent'])} divergent, {len(alignment['only_first'])}+{len(alignment['only_second'])} unmatched")
+
+    header = (f"Clause alignment: {len(alignment['identical'])} sections are identical in both documents and omitted. "
+              "Base clause-level differences on these sections only:")
+    return header + "\n\n" + ("\n\n".join(sections) if sections else "(no differing sections)")
+
+def _comparison_score(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 50.0
+
+def _compare_pair(first, second):
+    """
+    Compare two analyzed documents, cached by the unordered pair of their content hashes.
+    Returns the comparison with the lower-hash document as "Document 1", plus whether it was cached.
+    """
+    first, second = sorted((first, second), key=lambda doc: doc["contentHash"])
+    cache_system = get_cache_system()
+    cache_key = cache_system.generate_cache_key(
+        "comparison_pair", first["contentHash"], second["contentHash"],
+        prompt_version=_COMPARISON_PROMPT_VERSION, model=_COMPARISON_MODEL
+    )
+    cached_result = cache_system.get_cached_result(cache_key)
+    if cached_result:
+        return first, second, cached_result, True
+    result = _COMPARISON_FLIGHTS.do(cache_key, _generate_comparison_analysis, [first, second],
+                                   raise_errors=True, use_cache=False)
+    cache_system.store_cached_result(cache_key, result, ttl_hours=_COMPARISON_PAIR_TTL_HOURS)
+    return first, second, result, False
+
+def generate_pairwise_comparison(document_analyses):
+    """
+    N-way comparison: every pair of documents is compared (missing pairs concurrently,
+    the rest from cache) and merged into a score matrix and ranking. Adding one document
+    to a compared set only costs its N-1 new pairs.
+    """
+    docs = document_analyses
+    position = {doc["id"]: i for i, doc in enumerate(docs)}
+    pairs = [(docs[i], docs[j]) for i in range(len(docs)) for j in range(i + 1, len(docs))]
+
+    results, failures = [], []
+    with ThreadPoolExecutor(max_workers=max(1, min(_COMPARE_CONCURRENCY, len(pairs))), thread_name_prefix="compare-pair") as pool:
+        futures = [(a, b, pool.submit(_compare_pair, a, b)) for a, b in pairs]
+        for a, b, future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"❌ Pairwise comparison failed for {a['id']} / {b['id']}: {e}")
+                failures.append({"documents": [a["id"], b["id"]], "error": str(e)})
+
+    # scores[i][j]: document i's score when compared against document j
+    scores = [[None] * len(docs) for _ in docs]
+    records = {doc["id"]: {"wins": 0, "losses": 0, "ties": 0} for doc in docs}
+    pair_results = []
+    recommendations = []
+    for first, second, comparison, cached in results:
+        overall = comparison.get("overallComparison", {}) if isinstance(comparison, dict) else {}
+        i, j = position[first["id"]], position[second["id"]]
+        scores[i][j] = _comparison_score(overall.get("doc1Score"))
+        scores[j][i] = _comparison_score(overall.get("doc2Score"))
+        better = str(overall.get("betterDocument", ""))
+        if better.startswith("Document 1"):
+            winner, loser = first["id"], second["id"]
+        elif better.startswith("Document 2"):
+            winner, loser = second["id"], first["id"]
+        else:
+            winner = loser = None
+        if winner:
+            records[winner]["wins"] += 1
+            records[loser]["losses"] += 1
+        else:
+            records[first["id"]]["ties"] += 1
+            records[second["id"]]["ties"] += 1
+        for recommendation in comparison.get("recommendations", []) if isinstance(comparison, dict) else []:
+            if recommendation and recommendation not in recommendations:
+                recommendations.append(recommendation)
+        pair_results.append({
+            "documents": [first["id"], second["id"]],
+            "cached": cached,
+            "comparison": comparison,
+        })
+
+    ranking = []
+    for i, doc in enumerate(docs):
+        row = [score for score in scores[i] if score is not None]
+        ranking.append({
+            "id": doc["id"],
+            "name": doc.get("name"),
+            "averageScore": round(sum(row) / len(row), 1) if row else None,
+            **records[doc["id"]],
+        })
+    ranking.sort(key=lambda r: (r["averageScore"] is None, -(r["averageScore"] or 0), -r["wins"]))
+    for rank, entry in enumerate(ranking, start=1):
+        entry["rank"] = rank
+
+    computed = sum(1 for *_, cached in results if not cached)
+    print(f"📊 Pairwise comparison: {len(pairs)} pairs, {computed} computed, {len(results) - computed} cached")
+    return {
+        "mode": "pairwise",
+        "ranking": ranking,
+        "matrix": {"documents": [doc["id"] for doc in docs], "scores": scores},
+        "pairs": pair_results,
+        "recommendations": recommendations[:10],
+        "failures": failures,
+        "stats": {"pairs": len(pairs), "computed": computed, "cached": len(results) - computed},
+    }
+
 @app.post("/api/documents/comparison/export-pdf")
 def export_comparison_pdf(comparison_data: dict = Body(...), user=Depends(verify_firebase_token)):
     """Export document comparison as PDF."""
@@ -1874,40 +2064,40 @@ def add_message_to_session(session_id: str, data: dict = Body(...), user=Depends
         "timestamp": current_time
     }
     
-    # Generate AI response (same logic as before)
-    chunks = get_chunks_by_doc_id(db, document_id)  # Pass db
-    chunk_texts = [c["text"] for c in chunks]
-    chunk_embs = [c["embedding"] for c in chunks]
+    # Generate AI response (same logic as before), unless a semantically equal question was answered already
+    version = _document_index_version(document_id)
+    index = get_document_index(document_id)
     query_emb = embed_text(data["text"])
-    sim_scores = [cosine_similarity(query_emb, emb) for emb in chunk_embs]
-    pool_size = min(50, len(chunks))
-    top_pool_idxs = sorted(range(len(sim_scores)), key=lambda i: sim_scores[i], reverse=True)[:pool_size]
-    pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-    pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-    K = min(8, len(pool_embs))
-    selected_idxs = mmr(query_emb, pool_embs, K=K, lambda_=0.7)
-    selected_texts = [pool_texts[i] for i in selected_idxs]
-    
-    from google import genai
-    from google.genai import types
-    
-    _API_KEY = os.getenv("GEMINI_API_KEY")
-    client = genai.Client(api_key=_API_KEY)
-    
-    context = "\n".join(selected_texts)
-    prompt = f"Context: {context}\nQuestion: {data['text']}\nAnswer in markdown format in ≤ 120 words. Use appropriate markdown formatting like **bold**, *italic*, `code`, bullet points, etc. If uncertain, respond 'I don't know — please consult a lawyer' and show the top 2 source snippets used."
-    
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=prompt,
-        config=types.GenerateContentConfig(
-            temperature=0.1
+    cached = get_answer_cache().lookup(document_id, query_emb, variant="markdown", version=version)
+    if cached:
+        answer_text = cached["answer"]
+    else:
+        selected = index.search(query_emb, pool_size=50, K=8, lambda_=0.7)
+        selected_texts = [index.texts[i] for i in selected]
+        
+        from google.genai import types
+        
+        llm = get_llm_gateway()
+        
+        context = "\n".join(selected_texts)
+        prompt = f"Context: {context}\nQuestion: {data['text']}\nAnswer in markdown format in ≤ 120 words. Use appropriate markdown formatting like **bold**, *italic*, `code`, bullet points, etc. If uncertain, respond 'I don't know — please consult a lawyer' and show the top 2 source snippets used."
+        
+        response = llm.generate(
+            model="gemini-2.5-flash",
+            contents=prompt,
+            config=types.GenerateContentConfig(
+                temperature=0.1
+            )
         )
-    )
+        answer_text = response.text if hasattr(response, 'text') else "No answer."
+        if getattr(response, "text", None):
+            get_answer_cache().store(document_id, query_emb, data["text"], answer_text,
+                                     [index.chunk_ids[i] for i in selected], variant="markdown",
+                                     version=version)
     
     ai_message = {
         "role": "ai", 
-        "text": response.text if hasattr(response, 'text') else "No answer.", 
+        "text": answer_text, 
         "timestamp": current_time
     }
     
@@ -1953,45 +2143,46 @@ def stream_message_response(session_id: str, data: dict = Body(...), user=Depend
     def generate_stream():
         try:
             # Generate AI response
-            chunks = get_chunks_by_doc_id(db, document_id)
-            chunk_texts = [c["text"] for c in chunks]
-            chunk_embs = [c["embedding"] for c in chunks]
+            version = _document_index_version(document_id)
+            index = get_document_index(document_id)
             query_emb = embed_text(data["text"])
-            sim_scores = [cosine_similarity(query_emb, emb) for emb in chunk_embs]
-            pool_size = min(50, len(chunks))
-            top_pool_idxs = sorted(range(len(sim_scores)), key=lambda i: sim_scores[i], reverse=True)[:pool_size]
-            pool_embs = [chunk_embs[i] for i in top_pool_idxs]
-            pool_texts = [chunk_texts[i] for i in top_pool_idxs]
-            K = min(8, len(pool_embs))
-            selected_idxs = mmr(query_emb, pool_embs, K=K, lambda_=0.7)
-            selected_texts = [pool_texts[i] for i in selected_idxs]
-            
-            from google import genai
-            from google.genai import types
-            
-            _API_KEY = os.getenv("GEMINI_API_KEY")
-            client = genai.Client(api_key=_API_KEY)
-            
-            context = "\n".join(selected_texts)
-            prompt = f"Context: {context}\nQuestion: {data['text']}\nAnswer in markdown format in ≤ 120 words. Use appropriate markdown formatting like **bold**, *italic*, `code`, bullet points, etc. If uncertain, respond 'I don't know — please consult a lawyer' and show the top 2 source snippets used."
+            cached = get_answer_cache().lookup(document_id, query_emb, variant="markdown", version=version)
             
             # Send user message first
             yield f"data: {json.dumps({'type': 'user_message', 'message': user_message})}\n\n"
             
-            # Stream AI response
-            response_stream = client.models.generate_content_stream(
-                model="gemini-2.5-flash",
-                contents=prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.1
+            if cached:
+                # Semantically repeated question: the whole cached answer as one chunk
+                pieces = [cached["answer"]]
+            else:
+                selected = index.search(query_emb, pool_size=50, K=8, lambda_=0.7)
+                selected_texts = [index.texts[i] for i in selected]
+                
+                from google.genai import types
+                
+                llm = get_llm_gateway()
+                
+                context = "\n".join(selected_texts)
+                prompt = f"Context: {context}\nQuestion: {data['text']}\nAnswer in markdown format in ≤ 120 words. Use appropriate markdown formatting like **bold**, *italic*, `code`, bullet points, etc. If uncertain, respond 'I don't know — please consult a lawyer' and show the top 2 source snippets used."
+                
+                # Stream AI response (the generation slot is held until the stream ends)
+                response_stream = llm.stream(
+                    model="gemini-2.5-flash",
+                    contents=prompt,
+                    config=types.GenerateContentConfig(
+                        temperature=0.1
+                    )
                 )
-            )
+                pieces = (chunk.text for chunk in response_stream if chunk.text)
             
             accumulated_text = ""
-            for chunk in response_stream:
-                if chunk.text:
-                    accumulated_text += chunk.text
-                    yield f"data: {json.dumps({'type': 'ai_chunk', 'chunk': chunk.text, 'accumulated': accumulated_text})}\n\n"
+            for piece in pieces:
+                accumulated_text += piece
+                yield f"data: {json.dumps({'type': 'ai_chunk', 'chunk': piece, 'accumulated': accumulated_text})}\n\n"
+            if not cached and accumulated_text:
+                get_answer_cache().store(document_id, query_emb, data["text"], accumulated_text,
+                                         [index.chunk_ids[i] for i in selected], variant="markdown",
+                                         version=version)
             
             # Create final AI message
             ai_message = {
@@ -2042,23 +2233,44 @@ def get_document_status(doc_id: str, user=Depends(verify_firebase_token)):
         
         print(f"Document {doc_id} Firestore status: {firestore_status}")
         
+        # A queued or running job (including a pending retry) means processing isn't finished
+        job = None
+        job_id = doc_data.get("processingJobId")
+        if job_id:
+            job = get_job_queue().get(job_id)
+        job_info = {
+            "id": job["id"],
+            "status": job["status"],
+            "attempts": job["attempts"],
+            "max_attempts": job["max_attempts"],
+            "last_error": job["last_error"],
+        } if job else None
+        if job and job["status"] in (QUEUED, RUNNING):
+            if job["status"] == QUEUED and job["attempts"] > 0:
+                message = f"Retrying processing (attempt {job['attempts'] + 1}/{job['max_attempts']})"
+            elif job["status"] == QUEUED:
+                message = "Document is queued for processing"
+            else:
+                message = "Document is being processed"
+            return {"status": "processing", "message": message, "job": job_info}
+        
         # Only return ready if document is fully processed AND has chunks
         if firestore_status in ['processed', 'processed_with_summary_error']:
-            # Double-check that chunks exist
-            chunks = get_chunks_by_doc_id(db, doc_id)
-            if chunks and len(chunks) > 0:
-                print(f"Document {doc_id} is ready with {len(chunks)} chunks")
-                return {"status": "ready", "message": "Document ready for analysis"}
+            # Double-check that chunks exist (also warms the vector index cache)
+            index = get_document_index(doc_id)
+            if len(index) > 0:
+                print(f"Document {doc_id} is ready with {len(index)} chunks")
+                return {"status": "ready", "message": "Document ready for analysis", "job": job_info}
             else:
                 print(f"Document {doc_id} marked as processed but no chunks found")
-                return {"status": "processing", "message": "Finalizing document processing"}
+                return {"status": "processing", "message": "Finalizing document processing", "job": job_info}
         elif firestore_status == 'failed':
-            return {"status": "error", "message": "Document processing failed"}
+            return {"status": "error", "message": "Document processing failed", "job": job_info}
         elif firestore_status in ['processing', 'uploaded']:
-            return {"status": "processing", "message": "Document is being processed"}
+            return {"status": "processing", "message": "Document is being processed", "job": job_info}
         else:
             print(f"Document {doc_id} has unknown status: {firestore_status}")
-            return {"status": "processing", "message": f"Document status: {firestore_status}"}
+            return {"status": "processing", "message": f"Document status: {firestore_status}", "job": job_info}
     
     except Exception as e:
         print(f"Error checking document status for {doc_id}: {e}")
@@ -2089,6 +2301,9 @@ def get_cache_statistics(user=Depends(verify_firebase_token)):
         
         # Get cache statistics
         cache_stats = cache_system.get_cache_statistics()
+        index_cache_stats = get_index_cache().get_stats()
+        embedding_cache = get_embedding_cache()
+        embedding_cache_stats = embedding_cache.get_stats() if embedding_cache else {"enabled": False}
         
         # Get token counter statistics
         token_stats = token_counter.get_session_stats()
@@ -2102,8 +2317,13 @@ def get_cache_statistics(user=Depends(verify_firebase_token)):
                 "hit_rate": f"{cache_stats['hit_rate']:.2f}%",
                 "total_caches_created": cache_stats["gemini_caches_created"],
                 "active_caches": len(cache_stats["active_caches"]),
-                "memory_cache_entries": cache_stats["memory_cache_entries"]
+                "memory_cache_entries": cache_stats["memory_cache_entries"],
+                "memory_cache": cache_stats["memory_cache"],
+                "backend": cache_stats["backend"]
             },
+            "vector_index_cache": index_cache_stats,
+            "embedding_cache": embedding_cache_stats,
+            "answer_cache": get_answer_cache().get_stats(),
             "token_usage": {
                 "total_input_tokens": token_stats["total_input_tokens"],
                 "total_output_tokens": token_stats["total_output_tokens"],
@@ -2172,8 +2392,10 @@ def reset_cache_system(user=Depends(verify_firebase_token)):
         cache_system = get_cache_system()
         token_counter = get_token_counter()
         
-        # Clear all memory cache
-        cache_system.memory_cache.clear()
+        # Clear cached results (memory tier and the shared backend's namespace)
+        cache_system.clear_results()
+        get_index_cache().clear()
+        get_answer_cache().clear()
         
         # Reset token counter
         token_counter.reset_session_stats()
@@ -2249,4 +2471,25 @@ def get_token_usage_details(user=Depends(verify_firebase_token)):
             "token_breakdown": {},
             "cost_analysis": {},
             "efficiency_metrics": {}
-        }
\ No newline at end of file
+        }
+
+@app.get("/api/admin/jobs/stats")
+def get_job_statistics(user=Depends(verify_firebase_token)):
+    """Get background job queue depth and outcome counts."""
+    try:
+        return {
+            "jobs": get_job_queue().get_stats(),
+            "workers": _worker_pool.size if _worker_pool else 0,
+        }
+    except Exception as e:
+        print(f"❌ Error getting job statistics: {e}")
+        return {"error": "Failed to retrieve job statistics", "jobs": {}}
+
+@app.get("/api/admin/pipeline/stats")
+def get_pipeline_statistics(user=Depends(verify_firebase_token)):
+    """Get the embedding path's current operating point (rate limiter, adaptive batch size/concurrency)."""
+    try:
+        return get_pipeline_stats()
+    except Exception as e:
+        print(f"❌ Error getting pipeline statistics: {e}")
+        return {"error": "Failed to retrieve pipeline statistics"}
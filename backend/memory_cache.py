@@ -0,0 +1,205 @@
+# memory_cache.py
+import pickle
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+LRU = "lru"
+LFU = "lfu"
+POLICIES = (LRU, LFU)
+
+_ENTRY_OVERHEAD = 120  # bytes of bookkeeping per entry (tuple, dict slots, key object)
+
+
+def sizeof(value: Any) -> int:
+    """Bytes a value accounts for: its pickled size (close to what it costs in a shared tier too)."""
+    try:
+        return len(pickle.dumps(value, protocol=5))
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "freq")
+
+    def __init__(self, value: Any, size: int, expires_at: float):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.freq = 1
+
+
+class _Stripe:
+    """One independently locked shard: its own entries, byte budget and counters."""
+
+    def __init__(self, max_bytes: int, policy: str):
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.bytes = 0
+        self.entries: Dict[Hashable, _Entry] = {}
+        # LRU: one recency list. LFU: a recency list per access count, plus the lowest count present
+        self.order: "OrderedDict[Hashable, None]" = OrderedDict()
+        self.buckets: Dict[int, "OrderedDict[Hashable, None]"] = {}
+        self.min_freq = 0
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0, "rejected": 0}
+
+    def touch(self, key, entry: _Entry):
+        if self.policy == LRU:
+            self.order.move_to_end(key)
+            return
+        bucket = self.buckets[entry.freq]
+        del bucket[key]
+        if not bucket:
+            del self.buckets[entry.freq]
+            if self.min_freq == entry.freq:
+                self.min_freq += 1
+        entry.freq += 1
+        self.buckets.setdefault(entry.freq, OrderedDict())[key] = None
+
+    def link(self, key, entry: _Entry):
+        if self.policy == LRU:
+            self.order[key] = None
+        else:
+            self.buckets.setdefault(entry.freq, OrderedDict())[key] = None
+            self.min_freq = min(self.min_freq, entry.freq) if self.entries else entry.freq
+
+    def remove(self, key) -> _Entry:
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+        if self.policy == LRU:
+            del self.order[key]
+        else:
+            bucket = self.buckets[entry.freq]
+            del bucket[key]
+            if not bucket:
+                del self.buckets[entry.freq]
+                if self.min_freq == entry.freq:
+                    self.min_freq = min(self.buckets) if self.buckets else 0
+        return entry
+
+    def victim(self):
+        if self.policy == LRU:
+            return next(iter(self.order))
+        return next(iter(self.buckets[self.min_freq]))
+
+
+class StripedMemoryCache:
+    """Thread-safe in-process cache bounded by bytes, with LRU or LFU eviction.
+
+    Keys are spread over `stripes` shards, each with its own lock and an equal
+    share of `max_bytes`, so concurrent readers and writers rarely contend and
+    the total never exceeds the budget. Entry sizes come from `sizeof` (the
+    pickled value); a single value larger than a stripe's share is not cached.
+    Expired entries are dropped when read or by `purge_expired()`.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, stripes: int = 16, policy: str = LRU):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown cache policy: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        count = max(1, stripes)
+        self._stripes = [_Stripe(max(1, max_bytes // count), policy) for _ in range(count)]
+
+    def _stripe(self, key) -> _Stripe:
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key, default: Any = None) -> Any:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None:
+                stripe.stats["misses"] += 1
+                return default
+            if entry.expires_at <= time.time():
+                stripe.remove(key)
+                stripe.stats["expirations"] += 1
+                stripe.stats["misses"] += 1
+                return default
+            stripe.touch(key, entry)
+            stripe.stats["hits"] += 1
+            return entry.value
+
+    def set(self, key, value: Any, ttl_seconds: Optional[float] = None, size: Optional[int] = None) -> bool:
+        """Store `value`; returns False if it is too large to cache at all."""
+        size = (sizeof(value) if size is None else size) + _ENTRY_OVERHEAD + sys.getsizeof(key)
+        expires_at = time.time() + ttl_seconds if ttl_seconds is not None else float("inf")
+        stripe = self._stripe(key)
+        with stripe.lock:
+            previous = stripe.remove(key) if key in stripe.entries else None
+            if size > stripe.max_bytes:
+                stripe.stats["rejected"] += 1
+                return False
+            while stripe.bytes + size > stripe.max_bytes and stripe.entries:
+                stripe.remove(stripe.victim())
+                stripe.stats["evictions"] += 1
+            entry = _Entry(value, size, expires_at)
+            if previous is not None:
+                entry.freq = previous.freq  # an overwrite keeps its LFU standing
+            stripe.link(key, entry)
+            stripe.entries[key] = entry
+            stripe.bytes += size
+            stripe.stats["sets"] += 1
+            return True
+
+    def delete(self, key) -> bool:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key not in stripe.entries:
+                return False
+            stripe.remove(key)
+            return True
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry now; returns how many were removed."""
+        now = time.time()
+        removed = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                expired = [key for key, entry in stripe.entries.items() if entry.expires_at <= now]
+                for key in expired:
+                    stripe.remove(key)
+                stripe.stats["expirations"] += len(expired)
+                removed += len(expired)
+        return removed
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                stripe.order.clear()
+                stripe.buckets.clear()
+                stripe.bytes = 0
+                stripe.min_freq = 0
+
+    def __len__(self) -> int:
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def __contains__(self, key) -> bool:
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            return entry is not None and entry.expires_at > time.time()
+
+    def get_stats(self) -> Dict[str, Any]:
+        totals = {"hits": 0, "misses": 0, "sets": 0, "evictions": 0, "expirations": 0, "rejected": 0}
+        entries = used = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for name, value in stripe.stats.items():
+                    totals[name] += value
+                entries += len(stripe.entries)
+                used += stripe.bytes
+        lookups = totals["hits"] + totals["misses"]
+        return {
+            **totals,
+            "hit_rate_percent": round(totals["hits"] / lookups * 100, 2) if lookups else 0,
+            "entries": entries,
+            "bytes_used": used,
+            "max_bytes": self.max_bytes,
+            "policy": self.policy,
+            "stripes": len(self._stripes),
+        }
@@ -0,0 +1,109 @@
+# micro_batcher.py
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+
+class _Batch:
+    __slots__ = ("items", "futures", "tokens", "closed", "opened")
+
+    def __init__(self):
+        self.items: List[Any] = []
+        self.futures: List[Future] = []
+        self.tokens = 0
+        self.closed = threading.Event()
+        self.opened = time.monotonic()
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item calls into one batch call.
+
+    The first caller into an empty batch becomes its leader: it waits up to
+    `window_ms` for company (or until the batch reaches `max_batch_size` items
+    or `max_batch_tokens`), then runs `batch_fn` on everything collected and
+    hands each caller its own result. There is no background thread, and
+    several batches can be in flight at once.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], List[Any]],
+        window_ms: float = 5.0,
+        max_batch_size: int = 32,
+        max_batch_tokens: int = 8000,
+        token_counter: Callable[[Any], int] = lambda item: 1,
+    ):
+        self.batch_fn = batch_fn
+        self.window = max(0.0, window_ms) / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max(1, max_batch_tokens)
+        self.token_counter = token_counter
+        self._lock = threading.Lock()
+        self._current = _Batch()
+        self.stats = {"requests": 0, "batches": 0, "full_flushes": 0, "window_flushes": 0,
+                      "largest_batch": 0, "window_wait_seconds": 0.0, "errors": 0}
+
+    def _close_locked(self, batch: _Batch, full: bool):
+        if self._current is batch:
+            self._current = _Batch()
+        if not batch.closed.is_set():
+            self.stats["full_flushes" if full else "window_flushes"] += 1
+            batch.closed.set()
+
+    def submit(self, item: Any) -> Any:
+        """Add `item` to the open batch and block until its result is ready."""
+        future: Future = Future()
+        tokens = self.token_counter(item)
+        with self._lock:
+            batch = self._current
+            if batch.items and batch.tokens + tokens > self.max_batch_tokens:
+                # Wouldn't fit: send the open batch now and start a new one
+                self._close_locked(batch, full=True)
+                batch = self._current
+            batch.items.append(item)
+            batch.futures.append(future)
+            batch.tokens += tokens
+            self.stats["requests"] += 1
+            leader = len(batch.items) == 1
+            if len(batch.items) >= self.max_batch_size or batch.tokens >= self.max_batch_tokens:
+                self._close_locked(batch, full=True)
+
+        if leader:
+            batch.closed.wait(self.window)
+            with self._lock:
+                self._close_locked(batch, full=False)
+                self.stats["window_wait_seconds"] += time.monotonic() - batch.opened
+            self._run(batch)
+        return future.result()
+
+    def _run(self, batch: _Batch):
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch.items))
+        try:
+            results = self.batch_fn(batch.items)
+            if len(results) != len(batch.items):
+                raise RuntimeError(f"batch function returned {len(results)} results for {len(batch.items)} items")
+        except Exception as e:
+            with self._lock:
+                self.stats["errors"] += 1
+            for future in batch.futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(batch.futures, results):
+            future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            batches = self.stats["batches"]
+            mean = self.stats["requests"] / batches if batches else 0.0
+            return {
+                **self.stats,
+                "window_wait_seconds": round(self.stats["window_wait_seconds"], 3),
+                "mean_batch_size": round(mean, 2),
+                "occupancy_percent": round(100.0 * mean / self.max_batch_size, 1),
+                "window_ms": self.window * 1000.0,
+                "max_batch_size": self.max_batch_size,
+                "max_batch_tokens": self.max_batch_tokens,
+            }
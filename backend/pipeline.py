@@ -11,21 +11,16 @@ def extract_text_from_pdf(pdf_path: str) -> str:
         if page_text:
             text += page_text + "\n"
     return text
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import inspect
-import google.genai as genai
+import zlib
 from google.genai.types import GenerateContentConfig
 import os
 import time
 import random
 import threading
-from collections import deque
-from datetime import datetime, date, timedelta
-try:
-    from zoneinfo import ZoneInfo
-    _HAS_ZONEINFO = True
-except Exception:
-    _HAS_ZONEINFO = False
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 
 # Add this debug function to your pipeline.py
@@ -54,30 +49,65 @@ def process_document_with_debug(*args, **kwargs):
     # Continue with your normal processing...
 
 # --- Chunking ---
+CHUNKER_VERSION = "cdc1"  # bump when chunk boundaries change, so checkpoints from the old chunker are discarded
+
+def _is_cut_point(prev_word: str, word: str, divisor: int) -> bool:
+    """Content-defined boundary: decided by the two words at the cut alone, never by their position."""
+    return zlib.crc32(f"{prev_word} {word}".lower().encode("utf-8")) % divisor == 0
+
 def chunk_text(pages: List[Dict[str, Any]], chunk_size=500, overlap=50) -> List[Dict[str, Any]]:
-    chunks = []
+    """
+    Split page text into chunks of at most `chunk_size` words, each starting `overlap` words
+    before the previous one ended. Chunks end at content-defined cut points (at least 60% of
+    `chunk_size` in), so an insertion or deletion only changes the chunks around it: the cuts
+    after it fall on the same words as before, and later chunks keep their exact text.
+    """
+    return list(iter_chunks(pages, chunk_size, overlap))
+
+def iter_chunks(pages: List[Dict[str, Any]], chunk_size=500, overlap=50):
+    """chunk_text, yielding each chunk as soon as it is cut."""
+    min_words = max(1, chunk_size * 3 // 5)
+    divisor = max(1, chunk_size // 10)
     for page in pages:
         words = page["text"].split()
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk_words = words[i:i+chunk_size]
+        start = 0
+        while start < len(words):
+            end = min(start + chunk_size, len(words))
+            for i in range(start + min_words, end):
+                if _is_cut_point(words[i - 1], words[i], divisor):
+                    end = i
+                    break
+            chunk_words = words[start:end]
             chunk_text = ' '.join(chunk_words)
             if chunk_text.strip():
-                chunks.append({
+                yield {
                     "text": chunk_text,
                     "startPage": page["page"],
                     "endPage": page["page"],
                     "tokens": len(chunk_words)
-                })
-    return chunks
+                }
+            if end >= len(words):
+                break
+            start = max(start + 1, end - overlap)
 
 # --- Embedding (Gemini) ---
+from embedding_cache import EmbeddingCache, get_embedding_cache
+from llm_gateway import get_llm_gateway
+from rate_limiter import RateLimiter, QuotaExhaustedError, create_quota_backend
+from adaptive_control import AIMDController
+from priority_scheduler import PriorityScheduler, current_priority, priority
+from micro_batcher import MicroBatcher
+from single_flight import SingleFlight, get_single_flight_stats
+
 _GEMINI_MODEL = "gemini-embedding-001"
+_EMBED_DIMENSIONS = 768  # reduced output_dimensionality for efficiency
+_EMBED_TASK_TYPE = "SEMANTIC_SIMILARITY"
 _API_KEY = os.getenv("GEMINI_API_KEY")
 if not _API_KEY:
     raise RuntimeError("Google AI Studio API key not set in GEMINI_API_KEY")
 
-# Initialize modern client
-client = genai.Client(api_key=_API_KEY)
+# Shared long-lived client (pooled connections, timeouts, latency metrics)
+llm = get_llm_gateway()
 
 # --- Rate limiter with much more aggressive settings for better UX ---
 _RPM = int(os.getenv("GEMINI_EMBEDDING_RPM", 30))  # More aggressive: 30 RPM
@@ -85,208 +115,67 @@ _TPM = int(os.getenv("GEMINI_EMBEDDING_TPM", 5000))  # More aggressive: 5000 TPM
 _RPD = int(os.getenv("GEMINI_EMBEDDING_RPD", 1000))   # More aggressive: 1000 RPD
 
 
-def _pt_date_now():
-    """Get current date in a timezone-safe way."""
-    try:
-        if _HAS_ZONEINFO:
-            return datetime.now(ZoneInfo("America/Los_Angeles")).date()
-    except Exception:
-        # Fallback to UTC if timezone not available (Windows)
-        pass
-    return (datetime.utcnow() - timedelta(hours=8)).date()
-
-
 def _estimate_tokens_for_text(text: str) -> int:
     if not text:
         return 1
     return max(1, int(len(text) / 2))
 
 
-# Updated RateLimiter class with Railway-specific fixes
-
-class RateLimiter:
-    def __init__(self, rpm=_RPM, tpm=_TPM, rpd=_RPD):
-        self.rpm = rpm
-        self.tpm = tpm
-        self.rpd = rpd
-        self.req_timestamps = deque()
-        self.token_timestamps = deque()
-        self.daily_count = 0
-        self.last_reset_date = _pt_date_now()
-        self.lock = threading.Lock()
-        self.quota_exhausted = False
-        self.quota_reset_time = None
-        # Add consecutive failures tracking
-        self.consecutive_failures = 0
-        self.max_consecutive_failures = 3
-
-    def _reset_daily_if_needed(self):
-        today = _pt_date_now()
-        if today != self.last_reset_date:
-            self.daily_count = 0
-            self.last_reset_date = today
-            # Reset quota exhaustion flag daily
-            self.quota_exhausted = False
-            self.quota_reset_time = None
-            self.consecutive_failures = 0  # Reset failure count
-
-    def mark_quota_exhausted(self, reset_time_hours=24):
-        """Mark quota as exhausted with estimated reset time"""
-        with self.lock:
-            self.quota_exhausted = True
-            self.quota_reset_time = time.time() + (reset_time_hours * 3600)
-            print(f"Quota marked as exhausted. Estimated reset in {reset_time_hours} hours.")
-
-    def mark_failure(self):
-        """Track consecutive failures to detect quota issues early"""
-        with self.lock:
-            self.consecutive_failures += 1
-            if self.consecutive_failures >= self.max_consecutive_failures:
-                print(f"Too many consecutive failures ({self.consecutive_failures}), marking quota as exhausted")
-                self.mark_quota_exhausted(1)  # Shorter reset time for failure-based exhaustion
-
-    def mark_success(self):
-        """Reset failure counter on successful request"""
-        with self.lock:
-            self.consecutive_failures = 0
-
-    def is_quota_available(self):
-        """Check if quota might be available again"""
-        with self.lock:
-            if not self.quota_exhausted:
-                return True
-            if self.quota_reset_time and time.time() > self.quota_reset_time:
-                print("Quota reset time passed, attempting to clear exhaustion flag")
-                self.quota_exhausted = False
-                self.quota_reset_time = None
-                self.consecutive_failures = 0
-                return True
-            return False
-
-    def acquire(self, estimated_tokens: int):
-        if not self.is_quota_available():
-            reset_in = (self.quota_reset_time - time.time()) / 3600 if self.quota_reset_time else 24
-            raise RuntimeError(f"Quota exhausted. Try again in ~{reset_in:.1f} hours.")
-        
-        while True:
-            with self.lock:
-                now = time.time()
-                self._reset_daily_if_needed()
-                if self.daily_count >= self.rpd:
-                    raise RuntimeError("Daily requests quota reached for Gemini embeddings")
-                
-                # Clean old entries (older than 60s)
-                while self.req_timestamps and now - self.req_timestamps[0] > 60:
-                    self.req_timestamps.popleft()
-                while self.token_timestamps and now - self.token_timestamps[0][0] > 60:
-                    self.token_timestamps.popleft()
-                
-                current_rpm = len(self.req_timestamps)
-                current_tpm = sum(t for ts, t in self.token_timestamps)
-                
-                # More conservative wait calculation
-                wait_rpm = 0.0
-                if current_rpm >= self.rpm:
-                    oldest = self.req_timestamps[0]
-                    wait_rpm = 60 - (now - oldest) + 1  # Add 1 second buffer
-                
-                wait_tpm = 0.0
-                if current_tpm + estimated_tokens > self.tpm:
-                    needed = (current_tpm + estimated_tokens) - self.tpm
-                    acc = 0
-                    wait_tpm = 0.0
-                    for ts, t in self.token_timestamps:
-                        acc += t
-                        if acc >= needed:
-                            wait_tpm = 60 - (now - ts) + 1  # Add 1 second buffer
-                            break
-                    if wait_tpm < 0:
-                        wait_tpm = 0.0
-                
-                wait = max(wait_rpm, wait_tpm)
-                if wait <= 0:
-                    self.req_timestamps.append(now)
-                    self.token_timestamps.append((now, estimated_tokens))
-                    self.daily_count += 1
-                    return
-                
-                # Optimized sleep with reduced jitter for better performance
-                sleep_for = wait + random.uniform(0.1, 0.5)  # Reduced from 1-3 seconds to 0.1-0.5 seconds
-            
-            print(f"RateLimiter sleeping for {sleep_for:.2f}s to respect Gemini RPM/TPM limits")
-            time.sleep(sleep_for)
-
-
-class SimpleRateLimiter:
-    """Simplified, much more aggressive rate limiter for better user experience"""
-    def __init__(self, rpm=_RPM, tpm=_TPM, rpd=_RPD):
-        self.rpm = rpm
-        self.tpm = tpm
-        self.rpd = rpd
-        self.request_times = []
-        self.token_usage = []
-        self.daily_count = 0
-        self.last_reset_date = _pt_date_now()
-        self.lock = threading.Lock()
-        
-        # Much more aggressive timing - only wait when absolutely necessary
-        self.min_interval = max(0.5, 60.0 / rpm) if rpm > 0 else 0.5  # At least 0.5s, max based on RPM
-        print(f"🚀 Aggressive rate limiter: {rpm} RPM (min interval: {self.min_interval:.2f}s)")
-
-    def _reset_daily_if_needed(self):
-        today = _pt_date_now()
-        if today != self.last_reset_date:
-            self.daily_count = 0
-            self.last_reset_date = today
-            print(f"📅 Daily counter reset for {today}")
-
-    def acquire(self, estimated_tokens: int):
-        with self.lock:
-            now = time.time()
-            self._reset_daily_if_needed()
-            
-            # Check daily limit
-            if self.daily_count >= self.rpd:
-                raise RuntimeError("Daily requests quota reached for Gemini embeddings")
-            
-            # Clean old entries (only keep last 60 seconds)
-            cutoff = now - 60
-            self.request_times = [t for t in self.request_times if t > cutoff]
-            self.token_usage = [(t, tokens) for t, tokens in self.token_usage if t > cutoff]
-            
-            # Minimal RPM check - just ensure reasonable spacing
-            if self.request_times:
-                time_since_last = now - self.request_times[-1]
-                if time_since_last < self.min_interval:
-                    wait_time = self.min_interval - time_since_last
-                    if wait_time > 0.1:  # Only log if meaningful wait
-                        print(f"⏱️  Brief wait: {wait_time:.1f}s for spacing")
-                    time.sleep(wait_time)
-                    now = time.time()  # Update now after sleep
-            
-            # Very relaxed TPM check - only block if way over limit
-            current_tokens = sum(tokens for _, tokens in self.token_usage)
-            if current_tokens + estimated_tokens > self.tpm * 1.5:  # 50% buffer before blocking
-                wait_time = self.min_interval  # Just wait the minimum interval
-                print(f"🔄 Token limit brief wait: {wait_time:.1f}s")
-                time.sleep(wait_time)
-                now = time.time()
-            
-            # Record this request
-            self.request_times.append(now)
-            self.token_usage.append((now, estimated_tokens))
-            self.daily_count += 1
-            
-    def is_quota_available(self):
-        return True  # Always optimistic for better UX
+# Module-level token-bucket limiter; RATE_LIMIT_BACKEND decides whether the quota is
+# this process's share (memory) or shared with other workers on the host/cluster
+_RATE_LIMITER = RateLimiter(_RPM, _TPM, _RPD, backend=create_quota_backend(_RPM, _TPM, _RPD, name=_GEMINI_MODEL))
+
+# Batch size and per-process concurrency start here and are tuned by AIMD on 429/deadline
+# feedback; with ADAPTIVE_EMBEDDING=false they stay fixed at these starting values
+_MAX_CONCURRENCY = int(os.getenv("GEMINI_EMBEDDING_CONCURRENCY", 1))  # starting in-flight calls
+_EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", 3000))  # starting tokens per call
+_ADAPTIVE_EMBEDDING = os.getenv("ADAPTIVE_EMBEDDING", "true").lower() not in ("0", "false", "no")
+_MAX_TEXTS_PER_CALL = 100  # Gemini batch embedding limit
+if _ADAPTIVE_EMBEDDING:
+    _EMBED_CONTROLLER = AIMDController(
+        batch_tokens=_EMBED_BATCH_TOKENS,
+        min_batch_tokens=int(os.getenv("EMBED_MIN_BATCH_TOKENS", 500)),
+        max_batch_tokens=int(os.getenv("EMBED_MAX_BATCH_TOKENS", 20000)),
+        concurrency=_MAX_CONCURRENCY,
+        max_concurrency=int(os.getenv("EMBED_MAX_CONCURRENCY", 4)),
+    )
+else:
+    _EMBED_CONTROLLER = AIMDController(
+        batch_tokens=_EMBED_BATCH_TOKENS, min_batch_tokens=_EMBED_BATCH_TOKENS, max_batch_tokens=_EMBED_BATCH_TOKENS,
+        concurrency=_MAX_CONCURRENCY, min_concurrency=_MAX_CONCURRENCY, max_concurrency=_MAX_CONCURRENCY,
+    )
+
+
+# Interactive work (chat, analyses) is served before bulk work (ingest), but bulk keeps
+# at least this share of slots while both are waiting. Priority comes from priority_scheduler.priority();
+# generation slots are scheduled the same way inside llm_gateway.
+_MIN_BULK_SHARE = float(os.getenv("SCHEDULER_MIN_BULK_SHARE", 0.2))
+_EMBED_SCHEDULER = PriorityScheduler("embedding", _EMBED_CONTROLLER.slots, min_bulk_share=_MIN_BULK_SHARE)
+
+# Micro-batching of concurrent single-text embeddings (see embed_text)
+_QUERY_BATCH_WINDOW_MS = float(os.getenv("EMBED_QUERY_BATCH_WINDOW_MS", 5))
+_QUERY_BATCH_MAX_SIZE = int(os.getenv("EMBED_QUERY_BATCH_MAX_SIZE", 32))
+_QUERY_BATCH_MAX_TOKENS = int(os.getenv("EMBED_QUERY_BATCH_MAX_TOKENS", 8000))
+
 
+def get_embed_controller() -> AIMDController:
+    """The controller owning the current embedding batch size and concurrency."""
+    return _EMBED_CONTROLLER
 
-# Module-level rate limiter with simplified implementation
-_RATE_LIMITER = SimpleRateLimiter()
 
-# Per-process concurrency cap
-_MAX_CONCURRENCY = int(os.getenv("GEMINI_EMBEDDING_CONCURRENCY", 1))  # Reduced from 2
-_embed_semaphore = threading.Semaphore(_MAX_CONCURRENCY)
+def get_pipeline_stats() -> Dict[str, Any]:
+    """Operating point of the embedding path (limiter and adaptive controller)."""
+    return {
+        "rate_limiter": _RATE_LIMITER.get_stats(),
+        "embed_controller": _EMBED_CONTROLLER.get_stats(),
+        "query_batcher": _QUERY_BATCHER.get_stats(),
+        "single_flight": get_single_flight_stats(),
+        "summaries": get_summary_stats(),
+        "scheduler": {
+            "embedding": _EMBED_SCHEDULER.get_stats(),
+        },
+        "llm_gateway": llm.get_stats(),
+    }
 
 
 def _get_retry_after(exc: Exception) -> float | None:
@@ -321,36 +210,44 @@ def _get_retry_after(exc: Exception) -> float | None:
 
 
 def _safe_call_with_semaphore(fn, *args, **kwargs):
-    """Acquire the per-process semaphore, call the function with retries, release semaphore."""
-    acquired = _embed_semaphore.acquire(timeout=300)
+    """Take an adaptive concurrency slot (by priority), call the function with retries, release the slot."""
+    _EMBED_CONTROLLER.wait_if_paused()
+    acquired = _EMBED_SCHEDULER.acquire(timeout=300)
     if not acquired:
         raise RuntimeError("Could not acquire embed semaphore - too many concurrent embed requests")
     try:
-        return _call_with_retries(fn, *args, **kwargs)
+        return _call_with_retries(fn, *args, controller=_EMBED_CONTROLLER, **kwargs)
     finally:
-        try:
-            _embed_semaphore.release()
-        except Exception:
-            pass
+        _EMBED_SCHEDULER.release()
 
 
 # Updated retry function with better error handling
 
-def _call_with_retries(fn, *args, max_attempts=5, base_backoff=3.0, **kwargs):  # More attempts, longer backoff
-    """Call `fn(*args, **kwargs)` with retries on transient errors."""
+def _call_with_retries(fn, *args, max_attempts=5, base_backoff=3.0, controller=None, **kwargs):  # More attempts, longer backoff
+    """Call `fn(*args, **kwargs)` with retries on transient errors.
+    If `controller` is given it is told about successes, rate limiting and deadline errors.
+    """
     attempt = 0
     while True:
         attempt += 1
         try:
             result = fn(*args, **kwargs)
             _RATE_LIMITER.mark_success()  # Mark successful request
+            if controller is not None:
+                controller.on_success()
             return result
+        except QuotaExhaustedError:
+            # Raised by our own limiter, not the API: nothing to retry or learn from
+            raise
         except Exception as e:
             msg = str(e).lower()
+            retry_after = _get_retry_after(e)
             
             # Check for quota exhaustion specifically
             if any(tok in msg for tok in ("resource has been exhausted", "quota exceeded", "quota exhausted", "insufficient quota")):
                 print(f"Quota exhausted detected: {e}")
+                if controller is not None:
+                    controller.on_throttle(retry_after)
                 _RATE_LIMITER.mark_quota_exhausted(24)
                 raise RuntimeError("API quota exhausted. Please check your Google AI Studio quota limits and billing.") from e
             
@@ -363,9 +260,17 @@ def _call_with_retries(fn, *args, max_attempts=5, base_backoff=3.0, **kwargs):
             retryable = False
             if any(tok in msg for tok in ("429", "rate limit", "rate_limit", "too many requests", "temporarily unavailable", "unavailable", "deadlineexceeded", "deadline exceeded")):
                 retryable = True
-                _RATE_LIMITER.mark_failure()  # Track failure
+                if controller is None:
+                    _RATE_LIMITER.mark_failure()  # Track failure
+                # With a controller, 429s are congestion signals handled by AIMD below,
+                # not evidence that the daily quota is gone
             if any(tok in msg for tok in ("timeout", "timed out", "connection reset", "connection aborted", "service unavailable", "internal error")):
                 retryable = True
+            if controller is not None:
+                if any(tok in msg for tok in ("429", "rate limit", "rate_limit", "too many requests", "resource_exhausted")):
+                    controller.on_throttle(retry_after)
+                elif any(tok in msg for tok in ("deadlineexceeded", "deadline exceeded", "504", "timeout", "timed out")):
+                    controller.on_deadline(retry_after)
                 
             if not retryable or attempt >= max_attempts:
                 _RATE_LIMITER.mark_failure()  # Track failure
@@ -374,7 +279,6 @@ def _call_with_retries(fn, *args, max_attempts=5, base_backoff=3.0, **kwargs):
                 raise
             
             # Handle server-provided Retry-After
-            retry_after = _get_retry_after(e)
             if retry_after and retry_after > 0:
                 sleep_time = min(retry_after + 2.0, 300)  # Add 2s buffer instead of 1s
                 print(f"Rate limited (attempt {attempt}/{max_attempts}): {e}; waiting {sleep_time:.1f}s")
@@ -413,7 +317,7 @@ def _try_embed_via_models(contents: List[str]):
         estimated = sum(_estimate_tokens_for_text(t) for t in contents)
         _RATE_LIMITER.acquire(estimated)
         res = _safe_call_with_semaphore(
-            client.models.embed_content,
+            llm.embed,
             model=_GEMINI_MODEL, 
             contents=contents, 
             config={"task_type": "SEMANTIC_SIMILARITY"}
@@ -438,7 +342,7 @@ def _try_embed_via_embed_content(contents: List[str]):
         estimated = sum(_estimate_tokens_for_text(t) for t in contents)
         _RATE_LIMITER.acquire(estimated)
         res = _safe_call_with_semaphore(
-            client.models.embed_content,
+            llm.embed,
             model=_GEMINI_MODEL,
             contents=contents,
             config={"task_type": "SEMANTIC_SIMILARITY"}
@@ -464,7 +368,7 @@ def _try_embed_via_embed_content_direct(contents: List[str]):
             estimated = _estimate_tokens_for_text(content)
             _RATE_LIMITER.acquire(estimated)
             res = _safe_call_with_semaphore(
-                client.models.embed_content,
+                llm.embed,
                 model=_GEMINI_MODEL,
                 contents=[content],
                 config={"task_type": "SEMANTIC_SIMILARITY"}
@@ -487,9 +391,10 @@ def _try_embed_via_embed_content_direct(contents: List[str]):
 
 
 def embed_text(text: str) -> list:
-    """Embed a single text string"""
-    embs = embed_texts([text])
-    return embs[0]
+    """Embed a single text string.
+    Concurrent calls (e.g. chat questions from many users) are micro-batched into one request.
+    """
+    return _QUERY_BATCHER.submit(text)
 
 
 
@@ -497,26 +402,52 @@ def embed_text(text: str) -> list:
 
 # Modern embedding function for latest Google Generative AI API
 def _embed_single_batch_modern(texts: List[str]) -> List[list]:
-    """Embedding function using the latest Google Generative AI API."""
+    """Embedding function using the latest Google Generative AI API.
+    Texts already in the embedding cache are served locally; only misses go upstream.
+    """
     if not texts:
         return []
-    
+
+    cache = get_embedding_cache()
+    if cache is not None:
+        keys = [EmbeddingCache.make_key(_GEMINI_MODEL, _EMBED_DIMENSIONS, _EMBED_TASK_TYPE, t) for t in texts]
+        cached = cache.get_many(keys)
+        missing = [t for k, t in dict(zip(keys, texts)).items() if k not in cached]
+        if missing:
+            print(f"[Embedding] Cache: {len(texts) - len(missing)}/{len(texts)} hits, embedding {len(missing)} upstream")
+            fresh = _embed_uncached(missing)
+            new_items = {
+                EmbeddingCache.make_key(_GEMINI_MODEL, _EMBED_DIMENSIONS, _EMBED_TASK_TYPE, t): emb
+                for t, emb in zip(missing, fresh)
+            }
+            cache.put_many(new_items)
+            cached.update(new_items)
+        return [cached[k] for k in keys]
+
+    return _embed_uncached(texts)
+
+
+def _rate_limited_embed_call(texts: List[str]):
+    """One embedding request; the limiter is consulted again on every retry attempt."""
+    estimated = sum(_estimate_tokens_for_text(t) for t in texts)
+    _RATE_LIMITER.acquire(estimated)
+    return llm.embed(
+        model=_GEMINI_MODEL,
+        contents=texts,
+        config={
+            "task_type": _EMBED_TASK_TYPE,
+            "output_dimensionality": _EMBED_DIMENSIONS
+        }
+    )
+
+
+def _embed_uncached(texts: List[str]) -> List[list]:
+    """Send texts to the embedding API (rate limited)."""
     print(f"[Embedding] Processing {len(texts)} texts with modern API...")
     
     try:
-        # Use the modern google.genai.Client API
-        estimated = sum(_estimate_tokens_for_text(t) for t in texts)
-        _RATE_LIMITER.acquire(estimated)
-        
-        # Call the modern API
-        result = client.models.embed_content(
-            model=_GEMINI_MODEL,
-            contents=texts,
-            config={
-                "task_type": "SEMANTIC_SIMILARITY",
-                "output_dimensionality": 768  # Optional: reduce dimensionality for efficiency
-            }
-        )
+        # Shared gateway client, with retries inside an adaptive concurrency slot
+        result = _safe_call_with_semaphore(_rate_limited_embed_call, texts)
         
         print(f"[Embedding] Modern API response type: {type(result)}")
         
@@ -554,8 +485,8 @@ def debug_simple_embedding_test():
         print(f"🔍 API Key starts with: {os.getenv('GEMINI_API_KEY', '')[:10]}...")
         
         # Test with modern API
-        print("🔍 Testing with modern API (google.genai.Client)")
-        result = client.models.embed_content(
+        print("🔍 Testing with modern API (shared LLM gateway)")
+        result = llm.embed(
             model=_GEMINI_MODEL,
             contents=["Hello world"],
             config={"task_type": "SEMANTIC_SIMILARITY"}
@@ -570,14 +501,24 @@ def debug_simple_embedding_test():
         traceback.print_exc()
         return False
 
-# Call this at the start of your processing:
-# debug_simple_embedding_test()
-# 2. In your embed_texts function, add delays between batches:
 
-def embed_texts(texts: List[str], max_batch_tokens: int = 3000) -> List[list]:
-    """Embed multiple text strings, splitting into batches by token count."""
+_EMBED_FLIGHTS = SingleFlight("embed_texts")
+
+
+def embed_texts(texts: List[str], max_batch_tokens: Optional[int] = None) -> List[list]:
+    """Embed multiple text strings, splitting into batches by token count.
+    By default the batch budget is the adaptive controller's current operating point.
+    Identical concurrent requests share one upstream call.
+    """
     if not texts:
         return []
+    key = SingleFlight.make_key(_GEMINI_MODEL, _EMBED_DIMENSIONS, _EMBED_TASK_TYPE, texts)
+    return _EMBED_FLIGHTS.do(key, _embed_texts, texts, max_batch_tokens)
+
+
+def _embed_texts(texts: List[str], max_batch_tokens: Optional[int]) -> List[list]:
+    if max_batch_tokens is None:
+        max_batch_tokens = _EMBED_CONTROLLER.batch_tokens
     
     batches = []
     current_batch = []
@@ -585,7 +526,7 @@ def embed_texts(texts: List[str], max_batch_tokens: int = 3000) -> List[list]:
     
     for text in texts:
         text_tokens = _estimate_tokens_for_text(text)
-        if current_tokens + text_tokens > max_batch_tokens and current_batch:
+        if current_batch and (current_tokens + text_tokens > max_batch_tokens or len(current_batch) >= _MAX_TEXTS_PER_CALL):
             batches.append(current_batch)
             current_batch = [text]
             current_tokens = text_tokens
@@ -596,30 +537,55 @@ def embed_texts(texts: List[str], max_batch_tokens: int = 3000) -> List[list]:
     if current_batch:
         batches.append(current_batch)
     
-    print(f"Processing {len(batches)} batches of embeddings (increased batch size)")
+    print(f"Processing {len(batches)} batches of embeddings (batch budget {max_batch_tokens} tokens)")
     
+    # No inter-batch sleeps: pacing is left entirely to _RATE_LIMITER
     all_embeddings = []
     for i, batch in enumerate(batches):
         print(f"Processing batch {i+1}/{len(batches)} with {len(batch)} texts")
         
         batch_embeddings = _embed_single_batch(batch)
         all_embeddings.extend(batch_embeddings)
-        
-        # Minimal delay between batches (except after the last one) 
-        if i < len(batches) - 1:
-            sleep_time = 0.3  # Reduced from 1.5s to 0.3s for much better performance
-            print(f"Brief pause {sleep_time}s before next batch...")
-            time.sleep(sleep_time)
     
     return all_embeddings
 
 
+_QUERY_BATCHER = MicroBatcher(
+    embed_texts,
+    window_ms=_QUERY_BATCH_WINDOW_MS,
+    max_batch_size=min(_QUERY_BATCH_MAX_SIZE, _MAX_TEXTS_PER_CALL),
+    max_batch_tokens=_QUERY_BATCH_MAX_TOKENS,
+    token_counter=_estimate_tokens_for_text,
+)
+
+
 # --- Summarization (real) ---
-import re, json
+import re, json, hashlib
 
 _SUMMARY_MODEL = os.getenv("GEMINI_SUMMARY_MODEL", "gemini-2.5-flash")
 _MAX_SUMMARY_CHUNKS = int(os.getenv("SUMMARY_MAX_CHUNKS", 12))   # cap cost/time
 _PER_CHUNK_WORDS = int(os.getenv("SUMMARY_PER_CHUNK_WORDS", 28)) # brevity target
+_SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 4))  # per-document parallel chunk calls
+_SUMMARY_MODE = os.getenv("SUMMARY_MODE", "auto").lower()  # "auto" | "packed" | "per_chunk" | "hierarchical"
+_SUMMARY_PACK_TOKENS = int(os.getenv("SUMMARY_PACK_TOKENS", 12000))    # input tokens per packed call
+_SUMMARY_PACK_MAX_CHUNKS = int(os.getenv("SUMMARY_PACK_MAX_CHUNKS", 16))
+# Hierarchical (map-reduce) summaries for documents longer than SUMMARY_MAX_CHUNKS
+_SUMMARY_MAX_CALLS = int(os.getenv("SUMMARY_MAX_CALLS", 24))              # generation calls per document
+_SUMMARY_MAX_INPUT_TOKENS = int(os.getenv("SUMMARY_MAX_INPUT_TOKENS", 1000000))  # estimated (chars / 2)
+_SUMMARY_FAN_IN = max(2, int(os.getenv("SUMMARY_FAN_IN", 6)))            # child summaries per parent
+_SUMMARY_NODE_BULLETS = int(os.getenv("SUMMARY_NODE_BULLETS", 6))
+_SUMMARY_ROOT_BULLETS = int(os.getenv("SUMMARY_ROOT_BULLETS", 10))
+_SUMMARY_CACHE_TTL_HOURS = int(os.getenv("SUMMARY_CACHE_TTL_HOURS", 24))
+_SUMMARY_PROMPT_VERSION = "v1"  # bump when node prompts change so cached nodes are not reused
+_SUMMARY_STATS = {"documents": 0, "node_calls": 0, "node_cache_hits": 0, "node_failures": 0, "chunks_skipped": 0}
+_SUMMARY_STATS_LOCK = threading.Lock()
+
+class SummaryCancelled(Exception):
+    """Raised between generation calls once the caller's `cancel` event is set."""
+
+def _check_cancelled(cancel: Optional[threading.Event]):
+    if cancel is not None and cancel.is_set():
+        raise SummaryCancelled("summary generation cancelled")
 
 def _summarize_one_chunk(text: str) -> str:
     """Return one concise bullet (string) for a chunk."""
@@ -635,7 +601,7 @@ def _summarize_one_chunk(text: str) -> str:
     )
     try:
         config = GenerateContentConfig(temperature=0.3)  # Creative for summaries
-        resp = client.models.generate_content(
+        resp = llm.generate(
             model=_SUMMARY_MODEL,
             contents=prompt,
             config=config
@@ -660,7 +626,7 @@ def _infer_risks_from_bullets(bullets: list[str]) -> list[dict]:
     )
     try:
         config = GenerateContentConfig(temperature=0.2)  # Consistent for analysis
-        resp = client.models.generate_content(
+        resp = llm.generate(
             model=_SUMMARY_MODEL,
             contents=prompt,
             config=config
@@ -680,22 +646,335 @@ def _infer_risks_from_bullets(bullets: list[str]) -> list[dict]:
     except Exception:
         return []
 
-def generate_summary(chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+def _pack_chunks(texts: List[str], budget_tokens: int, max_chunks: int) -> List[List[int]]:
+    """Group chunk indices (in order) so each group fits the token budget; an oversized chunk goes alone."""
+    packs: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        if not text.strip():
+            continue
+        tokens = _estimate_tokens_for_text(text)
+        if current and (current_tokens + tokens > budget_tokens or len(current) >= max_chunks):
+            packs.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        packs.append(current)
+    return packs
+
+def _summarize_packed(items: List[tuple]) -> Dict[int, str]:
+    """
+    Summarize several (index, text) chunks in one call.
+    Returns {index: bullet} for the bullets that came back valid; missing ones are left out.
+    """
+    expected = {i for i, _ in items}
+    sections = "\n\n".join(f"[[chunk {i}]]\n{text}" for i, text in items)
+    prompt = (
+        f"Summarize each of the following {len(items)} legal text chunks as ONE short bullet "
+        f"(≤{_PER_CHUNK_WORDS} words each). Focus on obligations, fees, "
+        "dates/renewal/termination, liabilities, and privacy. "
+        "Return ONLY a JSON array with one object per chunk, each with keys "
+        "'index' (the chunk number) and 'bullet' (the bullet text, no numbering or quotes).\n\n"
+        f"---\n{sections}\n---"
+    )
+    try:
+        config = GenerateContentConfig(temperature=0.3, response_mime_type="application/json")
+        resp = llm.generate(
+            model=_SUMMARY_MODEL,
+            contents=prompt,
+            config=config
+        )
+        txt = (resp.text or "").strip()
+        m = re.search(r"\[\s*{.*}\s*\]", txt, flags=re.S)
+        parsed = json.loads(m.group(0)) if m else json.loads(txt)
+    except Exception as e:
+        print(f"⚠️ Packed summary failed for {len(items)} chunks: {e}")
+        return {}
+
+    out: Dict[int, str] = {}
+    for entry in parsed if isinstance(parsed, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            index = int(entry.get("index"))
+        except (TypeError, ValueError):
+            continue
+        bullet = re.sub(r"^[\-•\s]+", "", str(entry.get("bullet") or "")).strip()
+        if index in expected and bullet and index not in out:
+            out[index] = bullet
+    return out
+
+def _map_with_priority(fn, items: List[Any], workers: int, cancel: Optional[threading.Event] = None) -> List[Any]:
+    """fn over items on up to `workers` threads, in order, under the caller's priority class.
+
+    Once `cancel` is set, items not yet started are skipped and SummaryCancelled is raised.
+    """
+    cls = current_priority()  # pool threads don't inherit the caller's priority class
+
+    def run(item):
+        _check_cancelled(cancel)
+        with priority(cls):
+            return fn(item)
+
+    workers = max(1, min(workers, len(items)))
+    if workers == 1:
+        return [run(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="summary") as pool:
+        return list(pool.map(run, items))  # map preserves order
+
+def _count_summary_stat(name: str, n: int = 1):
+    with _SUMMARY_STATS_LOCK:
+        _SUMMARY_STATS[name] += n
+
+def get_summary_stats() -> Dict[str, Any]:
+    with _SUMMARY_STATS_LOCK:
+        return dict(_SUMMARY_STATS)
+
+def _summary_cache():
+    try:
+        from caching_system import get_cache_system
+        return get_cache_system()
+    except Exception as e:
+        print(f"⚠️ Summary node cache unavailable: {e}")
+        return None
+
+def _parse_bullets(txt: str, limit: int) -> List[str]:
+    bullets = []
+    for line in (txt or "").splitlines():
+        line = re.sub(r"^\s*(?:[\-•*]|\d+[.)])\s*", "", line).strip()
+        if line:
+            bullets.append(line)
+    return bullets[:limit]
+
+def _summarize_node(text: str, leaf: bool, max_bullets: int, cache) -> List[str]:
+    """
+    One map-reduce node: condense `text` (chunk excerpts for a leaf, child bullets otherwise)
+    into at most `max_bullets` bullets. Nodes are cached by a hash of their input, so
+    unchanged parts of a document are never re-summarized.
+    """
+    input_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    key = f"summary_node:{_SUMMARY_PROMPT_VERSION}:{_SUMMARY_MODEL}:{int(leaf)}:{max_bullets}:{input_hash}"
+    if cache is not None:
+        cached = cache.get_cached_result(key)
+        if cached is not None:
+            _count_summary_stat("node_cache_hits")
+            return cached
+
+    if leaf:
+        task = "Summarize these consecutive excerpts of a legal document"
+    else:
+        task = "Condense these bullet summaries of consecutive sections of a legal document"
+    prompt = (
+        f"{task} into at most {max_bullets} short bullets "
+        f"(≤{_PER_CHUNK_WORDS} words each). Focus on obligations, fees, "
+        "dates/renewal/termination, liabilities, and privacy. "
+        "No preamble, no numbering—return only the bullets, one per line.\n\n"
+        f"---\n{text}\n---"
+    )
+    _count_summary_stat("node_calls")
+    try:
+        config = GenerateContentConfig(temperature=0.3)
+        resp = llm.generate(
+            model=_SUMMARY_MODEL,
+            contents=prompt,
+            config=config
+        )
+        bullets = _parse_bullets(resp.text, max_bullets)
+        if not bullets:
+            raise ValueError("empty summary")
+    except Exception as e:
+        _count_summary_stat("node_failures")
+        print(f"⚠️ Summary node failed ({len(text)} chars): {e}")
+        # Uncached fallback: the first lines of the input, trimmed
+        return [line.strip()[:120] for line in text.splitlines() if line.strip()][:max_bullets]
+
+    if cache is not None:
+        cache.store_cached_result(key, bullets, ttl_hours=_SUMMARY_CACHE_TTL_HOURS)
+    return bullets
+
+def _content_groups(hashes: List[str], tokens: List[int], target: float, max_tokens: int) -> List[List[int]]:
+    """
+    Split items (in order) into groups averaging about `target` items. A group closes after an
+    item whose content hash falls below 1/target of the hash range, so boundaries depend on
+    content alone, and a larger `target` keeps a subset of a smaller one's boundaries.
+    """
+    threshold = int(0xFFFFFFFF / max(1.0, target))
+    groups: List[List[int]] = []
+    current: List[int] = []
+    current_tokens = 0
+    for i, (h, t) in enumerate(zip(hashes, tokens)):
+        if current and (current_tokens + t > max_tokens or len(current) >= 4 * target):
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += t
+        if int(h[:8], 16) < threshold:
+            groups.append(current)
+            current, current_tokens = [], 0
+    if current:
+        groups.append(current)
+    return groups
+
+def _group_by_content(hashes: List[str], tokens: List[int], target: int, max_tokens: int, max_groups: int) -> List[List[int]]:
+    """
+    Content-defined groups (see _content_groups) of about `target` items, at most `max_groups`
+    of them. Over the limit, the target grows in small steps, which only drops boundaries, so
+    an edit still moves just the groups around it and the others keep their inputs (and their
+    cache hits). Even runs are the last resort, if size caps alone exceed `max_groups`.
+    """
+    target = float(max(1, target))
+    groups = _content_groups(hashes, tokens, target, max_tokens)
+    while len(groups) > max_groups and target < len(hashes):
+        target *= 1.15
+        groups = _content_groups(hashes, tokens, target, max_tokens)
+    if len(groups) > max_groups:
+        size = -(-len(hashes) // max_groups)
+        groups = [list(range(i, min(i + size, len(hashes)))) for i in range(0, len(hashes), size)]
+    return groups
+
+def _max_nodes(budget: int, fan_in: int) -> int:
+    """Most nodes a level can have while it and every level above it fit `budget` calls."""
+    n = 1
+    while sum(_plan_levels(n + 1, fan_in)) <= budget:
+        n += 1
+    return n
+
+def _plan_levels(leaves: int, fan_in: int) -> List[int]:
+    """Node count per level (leaf groups first, root last) for a tree with `leaves` leaf groups."""
+    levels = [leaves]
+    while levels[-1] > 1:
+        levels.append(-(-levels[-1] // fan_in))
+    return levels
+
+def generate_hierarchical_summary(
+    chunks: List[Dict[str, Any]],
+    max_calls: Optional[int] = None,
+    max_input_tokens: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    cancel: Optional[threading.Event] = None,
+) -> List[str]:
+    """
+    Map-reduce summary of a whole document: chunks are grouped and summarized, then the
+    summaries are grouped and summarized again, until one root remains.
+
+    `max_calls` bounds the generation calls (the tree is sized to fit, so depth and latency
+    stay bounded too) and `max_input_tokens` bounds the chunk text sent; past that, chunks
+    are sampled evenly across the document rather than cut off at the end. Every node is
+    cached by content hash, so re-summarizing an edited document only recomputes the
+    branches whose input changed.
+    """
+    max_calls = max(1, max_calls or _SUMMARY_MAX_CALLS)
+    max_input_tokens = max_input_tokens or _SUMMARY_MAX_INPUT_TOKENS
+    workers = concurrency or _SUMMARY_CONCURRENCY
+
+    texts = [t for t in (c.get("text", "") for c in chunks) if t.strip()]
+    if not texts:
+        return []
+    tokens = [_estimate_tokens_for_text(t) for t in texts]
+    total_tokens = sum(tokens)
+    if total_tokens > max_input_tokens:
+        count = max(1, len(texts) * max_input_tokens // total_tokens)
+        keep = sorted({i * len(texts) // count for i in range(count)})
+        _count_summary_stat("chunks_skipped", len(texts) - len(keep))
+        print(f"ℹ️ Summary token budget: sampling {len(keep)}/{len(texts)} chunks")
+        texts = [texts[i] for i in keep]
+        tokens = [tokens[i] for i in keep]
+
+    # Aim for the largest leaf level whose whole tree fits the call budget, but no finer than the
+    # pack size. Content-defined groups vary in size, so the budget is enforced on the groups
+    # actually formed (each level may use whatever the levels below left over), not on the aim
+    avg_tokens = max(1, sum(tokens) // len(texts))
+    per_group = max(1, min(_SUMMARY_PACK_MAX_CHUNKS, _SUMMARY_PACK_TOKENS // avg_tokens))
+    leaves = -(-len(texts) // per_group)
+    while leaves > 1 and sum(_plan_levels(leaves, _SUMMARY_FAN_IN)) > max_calls:
+        leaves -= 1
+    group_tokens = max(_SUMMARY_PACK_TOKENS, -(-sum(tokens) // leaves))
+
+    cache = _summary_cache()
+    _count_summary_stat("documents")
+
+    # Level 0: chunk text -> leaf bullets
+    hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in texts]
+    groups = _group_by_content(hashes, tokens, -(-len(texts) // leaves), 2 * group_tokens,
+                               _max_nodes(max_calls, _SUMMARY_FAN_IN))
+    calls_left = max_calls - len(groups)
+    inputs = ["\n\n".join(texts[i] for i in g) for g in groups]
+    is_root = len(groups) == 1
+    nodes = _map_with_priority(
+        lambda text: _summarize_node(text, True, _SUMMARY_ROOT_BULLETS if is_root else _SUMMARY_NODE_BULLETS, cache),
+        inputs, workers, cancel,
+    )
+
+    # Upper levels: child bullets -> parent bullets, until a single root remains
+    while len(nodes) > 1:
+        # At least halve the node count each level, so the tree stays shallow
+        allowed = min(_max_nodes(calls_left, _SUMMARY_FAN_IN), -(-len(nodes) // 2))
+        node_texts = ["\n".join(f"- {b}" for b in bullets) for bullets in nodes]
+        hashes = [hashlib.sha256(t.encode("utf-8")).hexdigest() for t in node_texts]
+        groups = _group_by_content(hashes, [_estimate_tokens_for_text(t) for t in node_texts],
+                                   _SUMMARY_FAN_IN, group_tokens, allowed)
+        calls_left -= len(groups)
+        inputs = ["\n".join(node_texts[i] for i in g) for g in groups]
+        is_root = len(groups) == 1
+        nodes = _map_with_priority(
+            lambda text: _summarize_node(text, False, _SUMMARY_ROOT_BULLETS if is_root else _SUMMARY_NODE_BULLETS, cache),
+            inputs, workers, cancel,
+        )
+    return nodes[0]
+
+def generate_summary(
+    chunks: List[Dict[str, Any]],
+    concurrency: Optional[int] = None,
+    mode: Optional[str] = None,
+    max_calls: Optional[int] = None,
+    max_input_tokens: Optional[int] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
     """
     Summarize each chunk with Gemini (1 bullet per chunk) and optionally infer risks.
+    Documents longer than SUMMARY_MAX_CHUNKS (or any document in "hierarchical" mode) get a
+    map-reduce summary of the whole text instead, within `max_calls` / `max_input_tokens`.
+    In "auto" mode (SUMMARY_MODE's default) and "packed" mode, as many chunks as fit
+    SUMMARY_PACK_TOKENS share one request; chunks whose bullet is missing from the reply
+    (or invalid) are retried one call each. "per_chunk" makes one call per chunk.
+    Calls run in parallel (up to `concurrency`, default SUMMARY_CONCURRENCY) within the
+    generation slots of the gateway; bullet order follows chunk order.
+    Setting `cancel` stops it before the next generation call (raises SummaryCancelled).
     Returns: {"bullets": [str], "risks": [{"label": str, "explanation": str}, ...]}
     """
     if not chunks:
         return {"bullets": [], "risks": []}
 
+    mode = mode or _SUMMARY_MODE
+    if mode == "hierarchical" or (mode == "auto" and len(chunks) > _MAX_SUMMARY_CHUNKS):
+        bullets = generate_hierarchical_summary(chunks, max_calls, max_input_tokens, concurrency, cancel)
+        _check_cancelled(cancel)
+        return {"bullets": bullets, "risks": _infer_risks_from_bullets(bullets)}
+
     # Limit how many chunks we summarize to control cost/latency
     subset = chunks[:_MAX_SUMMARY_CHUNKS]
-
-    bullets: list[str] = []
-    for c in subset:
-        b = _summarize_one_chunk(c.get("text", ""))
-        if b:
-            bullets.append(b)
-
+    texts = [c.get("text", "") for c in subset]
+    workers = concurrency or _SUMMARY_CONCURRENCY
+
+    results: Dict[int, str] = {}
+    if mode in ("packed", "auto"):
+        packs = _pack_chunks(texts, _SUMMARY_PACK_TOKENS, _SUMMARY_PACK_MAX_CHUNKS)
+        packed = [pack for pack in packs if len(pack) > 1]
+        for found in _map_with_priority(
+            lambda pack: _summarize_packed([(i, texts[i]) for i in pack]), packed, workers, cancel
+        ):
+            results.update(found)
+
+    missing = [i for i, text in enumerate(texts) if text.strip() and i not in results]
+    if results and missing:
+        print(f"ℹ️ Packed summary missed {len(missing)} chunk(s); summarizing them individually")
+    for i, bullet in zip(missing, _map_with_priority(lambda i: _summarize_one_chunk(texts[i]), missing, workers, cancel)):
+        results[i] = bullet
+
+    bullets: list[str] = [results[i] for i in sorted(results) if results[i]]
+
+    _check_cancelled(cancel)
     risks = _infer_risks_from_bullets(bullets)
     return {"bullets": bullets, "risks": risks}
@@ -0,0 +1,137 @@
+# priority_scheduler.py
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_CLASSES = (INTERACTIVE, BULK)
+
+# The priority class of whatever the current thread is doing; unset means interactive
+_context = threading.local()
+
+
+def current_priority() -> str:
+    return getattr(_context, "priority", None) or INTERACTIVE
+
+
+@contextmanager
+def priority(cls: str):
+    """Run the enclosed calls (and any scheduler slots they take) under priority class `cls`."""
+    if cls not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class: {cls}")
+    previous = getattr(_context, "priority", None)
+    _context.priority = cls
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+class PriorityScheduler:
+    """Hands out `slots` (an AdjustableSemaphore or similar) to waiting work by priority class.
+
+    Interactive waiters go first, except that while both classes are waiting,
+    bulk is guaranteed `min_bulk_share` of the last `window` grants so ingest
+    keeps moving under sustained chat load. Within a class, order is FIFO.
+    """
+
+    def __init__(self, name: str, slots, min_bulk_share: float = 0.2, window: int = 100):
+        self.name = name
+        self.slots = slots
+        self.min_bulk_share = min(max(min_bulk_share, 0.0), 1.0)
+        self._cond = threading.Condition()
+        self._queues: Dict[str, deque] = {cls: deque() for cls in PRIORITY_CLASSES}
+        self._recent: deque = deque(maxlen=max(1, window))
+        self._recent_bulk = 0
+        self._waits: Dict[str, deque] = {cls: deque(maxlen=1000) for cls in PRIORITY_CLASSES}
+        self.stats = {cls: {"granted": 0, "timeouts": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+                      for cls in PRIORITY_CLASSES}
+
+    def _next_class_locked(self) -> Optional[str]:
+        interactive, bulk = self._queues[INTERACTIVE], self._queues[BULK]
+        if interactive and bulk:
+            share = self._recent_bulk / len(self._recent) if self._recent else 0.0
+            return BULK if share < self.min_bulk_share else INTERACTIVE
+        if interactive:
+            return INTERACTIVE
+        if bulk:
+            return BULK
+        return None
+
+    def _record_grant_locked(self, cls: str, waited: float):
+        if len(self._recent) == self._recent.maxlen and self._recent[0] == BULK:
+            self._recent_bulk -= 1
+        self._recent.append(cls)
+        if cls == BULK:
+            self._recent_bulk += 1
+        entry = self.stats[cls]
+        entry["granted"] += 1
+        entry["wait_seconds"] += waited
+        entry["max_wait_seconds"] = max(entry["max_wait_seconds"], waited)
+        self._waits[cls].append(waited)
+
+    def acquire(self, cls: Optional[str] = None, timeout: Optional[float] = None) -> bool:
+        """Wait for a slot as class `cls` (default: the thread's current priority)."""
+        cls = cls or current_priority()
+        ticket = object()
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            queue = self._queues[cls]
+            queue.append(ticket)
+            try:
+                while True:
+                    if (self._next_class_locked() == cls and queue[0] is ticket
+                            and self.slots.acquire(timeout=0)):
+                        queue.popleft()
+                        self._record_grant_locked(cls, time.monotonic() - started)
+                        self._cond.notify_all()
+                        return True
+                    wait = 0.1  # re-check periodically: the slot limit can grow without a release
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.stats[cls]["timeouts"] += 1
+                            return False
+                        wait = min(wait, remaining)
+                    self._cond.wait(wait)
+            finally:
+                if ticket in queue:
+                    queue.remove(ticket)
+                    self._cond.notify_all()
+
+    def release(self):
+        self.slots.release()
+        with self._cond:
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, cls: Optional[str] = None, timeout: Optional[float] = None):
+        if not self.acquire(cls, timeout):
+            raise TimeoutError(f"Timed out waiting for a {self.name} slot")
+        try:
+            yield
+        finally:
+            self.release()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            out: Dict[str, Any] = {
+                "min_bulk_share": self.min_bulk_share,
+                "recent_bulk_share": round(self._recent_bulk / len(self._recent), 3) if self._recent else 0.0,
+            }
+            for cls in PRIORITY_CLASSES:
+                entry = self.stats[cls]
+                waits = sorted(self._waits[cls])
+                out[cls] = {
+                    "queued": len(self._queues[cls]),
+                    "granted": entry["granted"],
+                    "timeouts": entry["timeouts"],
+                    "avg_wait_seconds": round(entry["wait_seconds"] / entry["granted"], 4) if entry["granted"] else 0.0,
+                    "p99_wait_seconds": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 4) if waits else 0.0,
+                    "max_wait_seconds": round(entry["max_wait_seconds"], 4),
+                }
+            return out
@@ -0,0 +1,550 @@
+# rate_limiter.py
+import os
+import abc
+import asyncio
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+try:
+    from zoneinfo import ZoneInfo
+    _HAS_ZONEINFO = True
+except Exception:
+    _HAS_ZONEINFO = False
+
+from resp_client import RespClient, RespError
+
+# Where quota is accounted: "memory" (this process only), "sqlite" (all processes
+# on this host) or "redis" (all replicas sharing a Redis-protocol server)
+_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+_SQLITE_PATH = os.getenv("RATE_LIMIT_SQLITE_PATH", os.path.join(".cache", "ratelimit.sqlite3"))
+_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+_REDIS_PREFIX = os.getenv("RATE_LIMIT_REDIS_PREFIX", "lexplain:ratelimit")
+# Processes splitting the quota when each one accounts for itself (memory backend)
+_WORKERS = int(os.getenv("RATE_LIMIT_WORKERS", os.getenv("WEB_CONCURRENCY", 1)))
+
+
+class QuotaExhaustedError(RuntimeError):
+    """Raised by the limiter itself (daily quota used up, or quota marked exhausted) rather than by the API."""
+
+
+def _pt_date_now():
+    """Get current date in a timezone-safe way (Gemini daily quotas reset at Pacific midnight)."""
+    try:
+        if _HAS_ZONEINFO:
+            return datetime.now(ZoneInfo("America/Los_Angeles")).date()
+    except Exception:
+        # Fallback to UTC if timezone not available (Windows)
+        pass
+    return (datetime.utcnow() - timedelta(hours=8)).date()
+
+
+class TokenBucket:
+    """Constant-time token bucket: `capacity` tokens, refilled continuously at `rate` per second."""
+
+    def __init__(self, capacity: float, rate: float, tokens: Optional[float] = None,
+                 updated: Optional[float] = None):
+        self.capacity = float(max(capacity, 1))
+        self.rate = float(max(rate, 1e-9))
+        self.tokens = self.capacity if tokens is None else min(float(tokens), self.capacity)
+        self.updated = time.monotonic() if updated is None else updated
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (requests larger than capacity wait for a full bucket)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class QuotaBackend(abc.ABC):
+    """Where request/token/daily quota is accounted.
+
+    `try_consume` either takes one request plus `tokens` and returns 0.0, or
+    takes nothing and returns how many seconds to wait before trying again.
+    It raises QuotaExhaustedError once the daily request quota is used up.
+    """
+
+    kind = "base"
+    blocking = False  # True when try_consume does file/network I/O (kept off the event loop)
+
+    @abc.abstractmethod
+    def try_consume(self, tokens: int) -> float:
+        ...
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.kind}
+
+
+class MemoryQuotaBackend(QuotaBackend):
+    """Per-process token buckets; each of `workers` processes gets an equal share of the quota."""
+
+    kind = "memory"
+
+    def __init__(self, rpm: int, tpm: int, rpd: int, workers: int = 1):
+        self.workers = max(1, workers)
+        self.rpm = max(1, rpm // self.workers)
+        self.tpm = max(1, tpm // self.workers)
+        self.rpd = max(1, rpd // self.workers)
+        self._requests = TokenBucket(self.rpm, self.rpm / 60.0)
+        self._tokens = TokenBucket(self.tpm, self.tpm / 60.0)
+        self.daily_count = 0
+        self.day = _pt_date_now()
+        self._lock = threading.Lock()
+
+    def try_consume(self, tokens: int) -> float:
+        with self._lock:
+            today = _pt_date_now()
+            if today != self.day:
+                self.day = today
+                self.daily_count = 0
+            if self.daily_count >= self.rpd:
+                raise QuotaExhaustedError("Daily requests quota reached for Gemini embeddings")
+            now = time.monotonic()
+            wait = max(self._requests.wait_time(1, now), self._tokens.wait_time(tokens, now))
+            if wait > 0:
+                return wait
+            self._requests.consume(1, now)
+            self._tokens.consume(tokens, now)
+            self.daily_count += 1
+            return 0.0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            now = time.monotonic()
+            self._requests._refill(now)
+            self._tokens._refill(now)
+            return {
+                "backend": self.kind,
+                "workers": self.workers,
+                "rpm_share": self.rpm,
+                "tpm_share": self.tpm,
+                "rpd_share": self.rpd,
+                "requests_available": round(self._requests.tokens, 2),
+                "tokens_available": round(self._tokens.tokens, 1),
+                "daily_count": self.daily_count,
+            }
+
+
+class SQLiteQuotaBackend(QuotaBackend):
+    """Token buckets and the daily counter stored in SQLite, shared by every process on the host.
+
+    Each attempt is one BEGIN IMMEDIATE transaction, so concurrent workers
+    never double-spend; the daily count survives restarts.
+    """
+
+    kind = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str, rpm: int, tpm: int, rpd: int, name: str = "default"):
+        self.path = path
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self.name = name
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS daily (name TEXT NOT NULL, day TEXT NOT NULL, count INTEGER NOT NULL,"
+            " PRIMARY KEY (name, day))"
+        )
+        self._lock = threading.Lock()
+
+    def _load_bucket(self, suffix: str, capacity: int, now: float) -> TokenBucket:
+        row = self._conn.execute(
+            "SELECT tokens, updated FROM buckets WHERE name = ?", (f"{self.name}:{suffix}",)
+        ).fetchone()
+        if row is None:
+            return TokenBucket(capacity, capacity / 60.0, updated=now)
+        return TokenBucket(capacity, capacity / 60.0, tokens=row[0], updated=row[1])
+
+    def _save_bucket(self, suffix: str, bucket: TokenBucket):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (f"{self.name}:{suffix}", bucket.tokens, bucket.updated),
+        )
+
+    def try_consume(self, tokens: int) -> float:
+        # Wall-clock time: bucket state is shared with other processes
+        now = time.time()
+        day = _pt_date_now().isoformat()
+        exhausted = False
+        wait = 0.0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT count FROM daily WHERE name = ? AND day = ?", (self.name, day)
+                ).fetchone()
+                count = row[0] if row else 0
+                if count >= self.rpd:
+                    exhausted = True
+                else:
+                    requests = self._load_bucket("requests", self.rpm, now)
+                    token_bucket = self._load_bucket("tokens", self.tpm, now)
+                    wait = max(requests.wait_time(1, now), token_bucket.wait_time(tokens, now))
+                    if wait == 0:
+                        requests.consume(1, now)
+                        token_bucket.consume(tokens, now)
+                        self._save_bucket("requests", requests)
+                        self._save_bucket("tokens", token_bucket)
+                        if row is None:
+                            self._conn.execute("DELETE FROM daily WHERE name = ? AND day <> ?", (self.name, day))
+                        self._conn.execute(
+                            "INSERT OR REPLACE INTO daily (name, day, count) VALUES (?, ?, ?)",
+                            (self.name, day, count + 1),
+                        )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if exhausted:
+            raise QuotaExhaustedError("Daily requests quota reached for Gemini embeddings")
+        return wait
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            requests = self._load_bucket("requests", self.rpm, now)
+            token_bucket = self._load_bucket("tokens", self.tpm, now)
+            row = self._conn.execute(
+                "SELECT count FROM daily WHERE name = ? AND day = ?", (self.name, _pt_date_now().isoformat())
+            ).fetchone()
+        requests._refill(now)
+        token_bucket._refill(now)
+        return {
+            "backend": self.kind,
+            "path": self.path,
+            "requests_available": round(requests.tokens, 2),
+            "tokens_available": round(token_bucket.tokens, 1),
+            "daily_count": row[0] if row else 0,
+        }
+
+
+class RedisQuotaBackend(QuotaBackend):
+    """Fixed one-minute windows and a daily counter on a Redis-protocol server, shared by all replicas.
+
+    Uses only INCRBY/DECRBY/EXPIRE, so any RESP server that implements those
+    works. Over-limit increments are rolled back. If the server is unreachable,
+    accounting falls back to this process's apportioned in-memory share.
+    """
+
+    kind = "redis"
+    blocking = True
+
+    def __init__(self, client: RespClient, rpm: int, tpm: int, rpd: int, name: str = "default",
+                 prefix: str = _REDIS_PREFIX, workers: int = _WORKERS):
+        self.client = client
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self.prefix = f"{prefix}:{name}"
+        self.fallback = MemoryQuotaBackend(rpm, tpm, rpd, workers=workers)
+        self.errors = 0
+
+    def _incr(self, key: str, amount: int, ttl: int) -> int:
+        value = self.client.execute("INCRBY", key, amount)
+        if value == amount:
+            # First write in this window
+            self.client.execute("EXPIRE", key, ttl)
+        return value
+
+    def _try_consume_shared(self, tokens: int) -> float:
+        now = time.time()
+        window = int(now // 60)
+        # Jitter so processes waiting on the same boundary don't all retry at once
+        wait_for_window = (window + 1) * 60 - now + random.uniform(0, 0.25)
+        req_key = f"{self.prefix}:rpm:{window}"
+        tok_key = f"{self.prefix}:tpm:{window}"
+        day_key = f"{self.prefix}:rpd:{_pt_date_now().isoformat()}"
+
+        if self._incr(req_key, 1, 120) > self.rpm:
+            self.client.execute("DECRBY", req_key, 1)
+            return wait_for_window
+        used = self._incr(tok_key, tokens, 120)
+        if used > self.tpm and used != tokens:
+            # An oversized request may still go alone in an otherwise empty window
+            self.client.execute("DECRBY", tok_key, tokens)
+            self.client.execute("DECRBY", req_key, 1)
+            return wait_for_window
+        if self._incr(day_key, 1, 2 * 86400) > self.rpd:
+            self.client.execute("DECRBY", day_key, 1)
+            self.client.execute("DECRBY", tok_key, tokens)
+            self.client.execute("DECRBY", req_key, 1)
+            raise QuotaExhaustedError("Daily requests quota reached for Gemini embeddings")
+        return 0.0
+
+    def try_consume(self, tokens: int) -> float:
+        try:
+            return self._try_consume_shared(tokens)
+        except (OSError, ConnectionError, RespError) as e:
+            # RespError: the server answered but refused (NOAUTH, unknown command, ...)
+            self.errors += 1
+            print(f"Shared rate limiter unavailable ({e}); using this process's share of the quota")
+            return self.fallback.try_consume(tokens)
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = {"backend": self.kind, "server": f"{self.client.host}:{self.client.port}", "errors": self.errors}
+        try:
+            window = int(time.time() // 60)
+            day = self.client.execute("GET", f"{self.prefix}:rpd:{_pt_date_now().isoformat()}")
+            minute = self.client.execute("GET", f"{self.prefix}:rpm:{window}")
+            stats["daily_count"] = int(day) if day else 0
+            stats["requests_this_minute"] = int(minute) if minute else 0
+        except Exception as e:
+            stats["unavailable"] = str(e)
+        return stats
+
+
+def create_quota_backend(rpm: int, tpm: int, rpd: int, name: str = "default",
+                         kind: str = _BACKEND) -> QuotaBackend:
+    """Build the configured backend, falling back to an apportioned in-memory one if it can't start."""
+    try:
+        if kind == "sqlite":
+            return SQLiteQuotaBackend(_SQLITE_PATH, rpm, tpm, rpd, name=name)
+        if kind == "redis":
+            client = RespClient(_REDIS_URL)
+            client.ping()
+            return RedisQuotaBackend(client, rpm, tpm, rpd, name=name)
+    except Exception as e:
+        print(f"Rate limit backend '{kind}' unavailable ({e}); falling back to in-memory")
+    return MemoryQuotaBackend(rpm, tpm, rpd, workers=_WORKERS)
+
+
+class _Waiter:
+    """A FIFO ticket; woken when it reaches the head of the queue or capacity may have changed."""
+    __slots__ = ("event", "loop")
+
+    def __init__(self, event, loop=None):
+        self.event = event
+        self.loop = loop
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+class RateLimiter:
+    """Token-bucket limiter for requests/minute, tokens/minute and requests/day.
+
+    Accounting is O(1) per call. Waiters queue in FIFO order and only the head
+    of the queue may take capacity; everyone else sleeps on their own event
+    without holding the lock. `acquire` blocks a thread, `acquire_async` awaits.
+    """
+
+    def __init__(self, rpm: int, tpm: int, rpd: int, backend: Optional[QuotaBackend] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self.backend = backend or MemoryQuotaBackend(rpm, tpm, rpd)
+        self.last_reset_date = _pt_date_now()
+        self.lock = threading.Lock()
+        self._waiters: deque = deque()
+        self.quota_exhausted = False
+        self.quota_reset_time = None
+        # Consecutive failures tracking to detect quota issues early
+        self.consecutive_failures = 0
+        self.max_consecutive_failures = 3
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0, "timeouts": 0}
+        print(f"🚦 Token-bucket rate limiter: {rpm} RPM, {tpm} TPM, {rpd} RPD ({self.backend.kind} backend)")
+
+    # --- quota exhaustion tracking (used by pipeline._call_with_retries) ---
+    def _reset_daily_if_needed(self):
+        today = _pt_date_now()
+        if today != self.last_reset_date:
+            self.last_reset_date = today
+            # Reset quota exhaustion flag daily
+            self.quota_exhausted = False
+            self.quota_reset_time = None
+            self.consecutive_failures = 0
+            print(f"📅 Daily quota flags reset for {today}")
+
+    def mark_quota_exhausted(self, reset_time_hours=24):
+        """Mark quota as exhausted with estimated reset time"""
+        with self.lock:
+            self.quota_exhausted = True
+            self.quota_reset_time = time.time() + (reset_time_hours * 3600)
+        print(f"Quota marked as exhausted. Estimated reset in {reset_time_hours} hours.")
+
+    def mark_failure(self):
+        """Track consecutive failures to detect quota issues early"""
+        with self.lock:
+            self.consecutive_failures += 1
+            failures = self.consecutive_failures
+        if failures >= self.max_consecutive_failures:
+            print(f"Too many consecutive failures ({failures}), marking quota as exhausted")
+            self.mark_quota_exhausted(1)  # Shorter reset time for failure-based exhaustion
+
+    def mark_success(self):
+        """Reset failure counter on successful request"""
+        with self.lock:
+            self.consecutive_failures = 0
+
+    def is_quota_available(self):
+        """Check if quota might be available again"""
+        with self.lock:
+            if not self.quota_exhausted:
+                return True
+            if self.quota_reset_time and time.time() > self.quota_reset_time:
+                print("Quota reset time passed, attempting to clear exhaustion flag")
+                self.quota_exhausted = False
+                self.quota_reset_time = None
+                self.consecutive_failures = 0
+                return True
+            return False
+
+    def _check_quota(self):
+        with self.lock:
+            self._reset_daily_if_needed()
+        if not self.is_quota_available():
+            reset_in = (self.quota_reset_time - time.time()) / 3600 if self.quota_reset_time else 24
+            raise QuotaExhaustedError(f"Quota exhausted. Try again in ~{reset_in:.1f} hours.")
+
+    # --- FIFO queue (call with self.lock held) ---
+    def _enqueue_locked(self, waiter: _Waiter):
+        self._waiters.append(waiter)
+        if self._waiters[0] is waiter:
+            waiter.wake()
+
+    def _leave_locked(self, waiter: _Waiter):
+        was_head = bool(self._waiters) and self._waiters[0] is waiter
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            return
+        if was_head and self._waiters:
+            self._waiters[0].wake()
+
+    def _poll(self, waiter: _Waiter, tokens: int) -> Optional[float]:
+        """One attempt by `waiter`: 0.0 if acquired, seconds to sleep if head, None if not head.
+
+        Only the head of the queue talks to the backend, and it does so without
+        holding the lock, so a slow shared backend never blocks enqueueing.
+        """
+        if not self._is_head(waiter):
+            return None
+        wait = self.backend.try_consume(tokens)
+        if wait == 0.0:
+            self._acquired(waiter)
+        return wait
+
+    async def _poll_async(self, waiter: _Waiter, tokens: int) -> Optional[float]:
+        """`_poll` for the event loop: a blocking backend (SQLite, RESP) runs in a worker thread."""
+        if not self._is_head(waiter):
+            return None
+        if self.backend.blocking:
+            wait = await asyncio.to_thread(self.backend.try_consume, tokens)
+        else:
+            wait = self.backend.try_consume(tokens)
+        if wait == 0.0:
+            self._acquired(waiter)
+        return wait
+
+    def _is_head(self, waiter: _Waiter) -> bool:
+        with self.lock:
+            waiter.event.clear()
+            return self._waiters[0] is waiter
+
+    def _acquired(self, waiter: _Waiter):
+        with self.lock:
+            self._leave_locked(waiter)
+            self.stats["acquired"] += 1
+
+    def acquire(self, estimated_tokens: int, timeout: Optional[float] = None):
+        """Block until capacity is available. Raises TimeoutError if `timeout` seconds pass first."""
+        self._check_quota()
+        waiter = _Waiter(threading.Event())
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self.lock:
+            self._enqueue_locked(waiter)
+        try:
+            while True:
+                wait = self._poll(waiter, estimated_tokens)
+                if wait == 0.0:
+                    self._record_wait(started)
+                    return
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self.lock:
+                            self.stats["timeouts"] += 1
+                        raise TimeoutError("Timed out waiting for rate limiter capacity")
+                    wait = remaining if wait is None else min(wait, remaining)
+                waiter.event.wait(wait)
+        finally:
+            with self.lock:
+                self._leave_locked(waiter)
+
+    async def acquire_async(self, estimated_tokens: int, timeout: Optional[float] = None):
+        """asyncio front-end for `acquire`; shares the same FIFO queue and buckets."""
+        self._check_quota()
+        waiter = _Waiter(asyncio.Event(), asyncio.get_running_loop())
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self.lock:
+            self._enqueue_locked(waiter)
+        try:
+            while True:
+                wait = await self._poll_async(waiter, estimated_tokens)
+                if wait == 0.0:
+                    self._record_wait(started)
+                    return
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        with self.lock:
+                            self.stats["timeouts"] += 1
+                        raise TimeoutError("Timed out waiting for rate limiter capacity")
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    await asyncio.wait_for(waiter.event.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self.lock:
+                self._leave_locked(waiter)
+
+    def _record_wait(self, started: float):
+        waited = time.monotonic() - started
+        if waited > 0.05:
+            with self.lock:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+            if waited > 1:
+                print(f"RateLimiter waited {waited:.2f}s to respect Gemini RPM/TPM limits")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            stats = {
+                **self.stats,
+                "wait_seconds": round(self.stats["wait_seconds"], 3),
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "rpd": self.rpd,
+                "waiting": len(self._waiters),
+                "quota_exhausted": self.quota_exhausted,
+            }
+        stats["quota"] = self.backend.get_stats()
+        return stats
@@ -0,0 +1,117 @@
+# resp_client.py
+import socket
+import threading
+from typing import Any, Optional
+from urllib.parse import urlparse, unquote
+
+
+class RespError(Exception):
+    """Error reply from the server (a `-ERR ...` line)."""
+
+
+class RespClient:
+    """Minimal RESP2 client for Redis-protocol servers (Redis, Valkey, KeyDB or a local stand-in).
+
+    Speaks just enough of the protocol for simple commands: one connection,
+    guarded by a lock, reconnected lazily after a network error.
+    URL format: redis://[:password@]host[:port][/db]
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", timeout: float = 2.0):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("redis", ""):
+            raise ValueError(f"Unsupported RESP URL scheme: {parsed.scheme}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        path = (parsed.path or "").lstrip("/")
+        self.db = int(path) if path else 0
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        if self.password:
+            self._roundtrip(("AUTH", self.password))
+        if self.db:
+            self._roundtrip(("SELECT", self.db))
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        for resource in (self._file, self._sock):
+            try:
+                if resource is not None:
+                    resource.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if isinstance(arg, bytes):
+                data = arg
+            else:
+                data = str(arg).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(out)
+
+    def _read_reply(self) -> Any:
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Connection closed by RESP server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode("utf-8")
+        if prefix == b"-":
+            raise RespError(rest.decode("utf-8"))
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            if len(data) < length + 2:
+                raise ConnectionError("Truncated bulk reply from RESP server")
+            return data[:-2]
+        if prefix == b"*":
+            count = int(rest)
+            if count < 0:
+                return None
+            return [self._read_reply() for _ in range(count)]
+        raise ConnectionError(f"Unexpected RESP reply: {line[:32]!r}")
+
+    def _roundtrip(self, args) -> Any:
+        self._sock.sendall(self._encode(args))
+        return self._read_reply()
+
+    def execute(self, *args) -> Any:
+        """Send one command and return its decoded reply."""
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                self._sock.sendall(self._encode(args))
+            except OSError:
+                # Stale connection: nothing reached the server, so it's safe to resend once
+                self._close()
+                self._connect()
+                self._sock.sendall(self._encode(args))
+            try:
+                return self._read_reply()
+            except (OSError, ConnectionError):
+                self._close()
+                raise
+
+    def ping(self) -> bool:
+        return self.execute("PING") == "PONG"
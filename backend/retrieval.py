@@ -0,0 +1,259 @@
+# retrieval.py
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from typing import List, Dict, Any, Optional
+
+
+class VectorIndex:
+    """Pre-normalized float32 embedding matrix for one document's chunks."""
+
+    def __init__(self, texts: List[str], embeddings, chunk_ids: Optional[List[str]] = None):
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(texts), -1)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.matrix = matrix / (norms + 1e-8)
+        self.texts = list(texts)
+        self.chunk_ids = list(chunk_ids) if chunk_ids is not None else [None] * len(self.texts)
+
+    @classmethod
+    def from_chunks(cls, chunks: List[Dict[str, Any]]) -> "VectorIndex":
+        """Build an index from `get_chunks_by_doc_id` rows, skipping chunks without embeddings."""
+        usable = [c for c in chunks if c.get("embedding") is not None]
+        if not usable:
+            return cls([], np.zeros((0, 0), dtype=np.float32))
+        return cls(
+            [c["text"] for c in usable],
+            [c["embedding"] for c in usable],
+            [c.get("chunkId") for c in usable],
+        )
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def scores(self, query_emb) -> np.ndarray:
+        """Cosine similarity of the query against every chunk (one matmul)."""
+        q = np.asarray(query_emb, dtype=np.float32)
+        q = q / (np.linalg.norm(q) + 1e-8)
+        return self.matrix @ q
+
+    def search(self, query_emb, pool_size: int = 50, K: int = 8, lambda_: float = 0.7) -> List[int]:
+        """Return chunk indices chosen by MMR from the top `pool_size` most similar chunks."""
+        n = len(self)
+        if n == 0 or K <= 0:
+            return []
+        sims = self.scores(query_emb)
+        pool_size = min(pool_size, n)
+        if pool_size < n:
+            pool = np.argpartition(-sims, pool_size - 1)[:pool_size]
+        else:
+            pool = np.arange(n)
+        # Order the pool by similarity so ties resolve the same way as a full sort
+        pool = pool[np.argsort(-sims[pool], kind="stable")]
+        selected = mmr(sims[pool], self.matrix[pool], K=K, lambda_=lambda_)
+        return [int(pool[i]) for i in selected]
+
+    def select_texts(self, query_emb, pool_size: int = 50, K: int = 8, lambda_: float = 0.7) -> List[str]:
+        return [self.texts[i] for i in self.search(query_emb, pool_size=pool_size, K=K, lambda_=lambda_)]
+
+
+def mmr(sim_to_query: np.ndarray, embs: np.ndarray, K: int = 8, lambda_: float = 0.7) -> List[int]:
+    """Maximal marginal relevance over normalized embeddings.
+
+    Keeps a running max-similarity-to-selected vector so each step costs one
+    matrix-vector product instead of re-scoring every selected pair.
+    """
+    n = len(sim_to_query)
+    K = min(K, n)
+    if K <= 0:
+        return []
+    selected: List[int] = []
+    available = np.ones(n, dtype=bool)
+    max_sim_to_selected = np.full(n, -np.inf, dtype=np.float32)
+    for step in range(K):
+        if step == 0:
+            scores = sim_to_query.astype(np.float32, copy=True)
+        else:
+            scores = lambda_ * sim_to_query - (1 - lambda_) * max_sim_to_selected
+        scores = np.where(available, scores, -np.inf)
+        idx = int(np.argmax(scores))
+        selected.append(idx)
+        available[idx] = False
+        np.maximum(max_sim_to_selected, embs @ embs[idx], out=max_sim_to_selected)
+    return selected
+
+
+# --- Per-document index cache ---
+_INDEX_CACHE_MB = float(os.getenv("VECTOR_INDEX_CACHE_MB", 256))
+_INDEX_TTL_SECONDS = float(os.getenv("VECTOR_INDEX_TTL_SECONDS", 3600))
+# How often a cached index is checked against the document's processing state (other
+# workers may have re-processed it); 0 checks on every lookup
+_INDEX_REVALIDATE_SECONDS = float(os.getenv("VECTOR_INDEX_REVALIDATE_SECONDS", 10))
+_MAX_TRACKED_GENERATIONS = 10000  # recently invalidated documents remembered for in-flight loads
+
+
+def _index_nbytes(index: VectorIndex) -> int:
+    """Approximate resident size of an index: matrix plus chunk text."""
+    return int(index.matrix.nbytes) + sum(len(t or "") for t in index.texts)
+
+
+class _CachedIndex:
+    __slots__ = ("index", "size", "version", "loaded_at", "checked_at")
+
+    def __init__(self, index: VectorIndex, size: int, version: Optional[str], now: float):
+        self.index = index
+        self.size = size
+        self.version = version
+        self.loaded_at = now
+        self.checked_at = now
+
+
+class VectorIndexCache:
+    """Process-local LRU cache of VectorIndex objects keyed by document ID, bounded by bytes.
+
+    Entries expire after `ttl_seconds`. When `get_or_load` is given a `version_fn`
+    (e.g. the document's processing checkpoint), an entry is re-checked against it
+    at most every `revalidate_seconds` and dropped if the version moved on, so
+    workers that didn't run the ingest still notice it. Each `invalidate` bumps a
+    per-document generation; a load that started before it is never cached.
+    """
+
+    def __init__(self, max_bytes: int = int(_INDEX_CACHE_MB * 1024 * 1024),
+                 ttl_seconds: float = _INDEX_TTL_SECONDS, revalidate_seconds: float = _INDEX_REVALIDATE_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.revalidate_seconds = revalidate_seconds
+        self._entries: "OrderedDict[str, _CachedIndex]" = OrderedDict()
+        # doc_id -> counter value at its last invalidate; values never repeat, so a forgotten
+        # document (0) can't be mistaken for one whose load started before the invalidate
+        self._generations: "OrderedDict[str, int]" = OrderedDict()
+        self._counter = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "expirations": 0,
+                      "stale": 0, "discarded_loads": 0}
+
+    def _drop_locked(self, doc_id: str) -> Optional[_CachedIndex]:
+        entry = self._entries.pop(doc_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        return entry
+
+    def _lookup(self, doc_id: str, version_fn) -> Optional[VectorIndex]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(doc_id)
+            if entry is not None and now - entry.loaded_at >= self.ttl_seconds:
+                self._drop_locked(doc_id)
+                self.stats["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            recheck = version_fn is not None and now - entry.checked_at >= self.revalidate_seconds
+            if not recheck:
+                self._entries.move_to_end(doc_id)
+                self.stats["hits"] += 1
+                return entry.index
+        # The version read may hit the database: do it without holding the lock
+        version = version_fn()
+        with self._lock:
+            if self._entries.get(doc_id) is not entry:
+                self.stats["misses"] += 1
+                return None
+            if version is not None and version != entry.version:
+                self._drop_locked(doc_id)
+                self.stats["stale"] += 1
+                self.stats["misses"] += 1
+                return None
+            entry.checked_at = now
+            self._entries.move_to_end(doc_id)
+            self.stats["hits"] += 1
+            return entry.index
+
+    def get(self, doc_id: str) -> Optional[VectorIndex]:
+        return self._lookup(doc_id, None)
+
+    def generation(self, doc_id: str) -> int:
+        with self._lock:
+            return self._generations.get(doc_id, 0)
+
+    def put(self, doc_id: str, index: VectorIndex, version: Optional[str] = None,
+            generation: Optional[int] = None) -> bool:
+        """Cache `index`; skipped (False) if too large or `generation` is older than the last invalidate."""
+        size = _index_nbytes(index)
+        if size > self.max_bytes:
+            return False  # never cache something that would evict everything else
+        with self._lock:
+            if generation is not None and generation != self._generations.get(doc_id, 0):
+                self.stats["discarded_loads"] += 1
+                return False
+            self._drop_locked(doc_id)
+            self._entries[doc_id] = _CachedIndex(index, size, version, time.time())
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.stats["evictions"] += 1
+            return True
+
+    def get_or_load(self, doc_id: str, loader, version_fn=None) -> VectorIndex:
+        """Return the cached index, or build one with `loader()` and cache it if non-empty.
+
+        `version_fn()` returns the document's current version (None if unknown); it is read
+        before loading, so an index is never cached under a newer version than its data.
+        """
+        index = self._lookup(doc_id, version_fn)
+        if index is not None:
+            return index
+        generation = self.generation(doc_id)
+        version = version_fn() if version_fn is not None else None
+        index = loader()
+        if len(index):
+            self.put(doc_id, index, version=version, generation=generation)
+        return index
+
+    def _bump_locked(self, doc_id: str):
+        self._counter += 1
+        self._generations.pop(doc_id, None)
+        self._generations[doc_id] = self._counter
+        while len(self._generations) > _MAX_TRACKED_GENERATIONS:
+            self._generations.popitem(last=False)
+
+    def invalidate(self, doc_id: str):
+        with self._lock:
+            self._bump_locked(doc_id)
+            if self._drop_locked(doc_id) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            for doc_id in list(self._entries):
+                self._bump_locked(doc_id)
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate_percent": round(self.stats["hits"] / total * 100, 2) if total else 0,
+                "entries": len(self._entries),
+                "bytes_used": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Global index cache instance (lazy initialization)
+index_cache = None
+
+def get_index_cache():
+    """Get or create the global vector index cache."""
+    global index_cache
+    if index_cache is None:
+        index_cache = VectorIndexCache()
+    return index_cache
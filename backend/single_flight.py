@@ -0,0 +1,77 @@
+# single_flight.py
+import hashlib
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+# Every group registers here so their counters can be reported together
+_GROUPS: Dict[str, "SingleFlight"] = {}
+_GROUPS_LOCK = threading.Lock()
+
+
+class SingleFlight:
+    """Deduplicates identical in-flight calls.
+
+    The first caller for a key runs the function; callers arriving with the same
+    key while it is still running wait on its future and receive the same result
+    (or exception) instead of issuing their own upstream call. Nothing is kept
+    once the call finishes - this is coalescing, not caching.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self.stats = {"calls": 0, "executed": 0, "coalesced": 0, "errors": 0}
+        with _GROUPS_LOCK:
+            _GROUPS[name] = self
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """Stable hash of the request parts (anything JSON-serializable, falling back to str)."""
+        payload = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            self.stats["calls"] += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["executed"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self.stats["errors"] += 1
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._inflight.pop(key, None)
+        future.set_result(result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.stats["calls"]
+            return {
+                **self.stats,
+                "in_flight": len(self._inflight),
+                "coalesced_percent": round(100.0 * self.stats["coalesced"] / calls, 1) if calls else 0.0,
+            }
+
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    """Counters for every SingleFlight group in this process."""
+    with _GROUPS_LOCK:
+        groups = list(_GROUPS.values())
+    return {group.name: group.get_stats() for group in groups}
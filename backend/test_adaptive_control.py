@@ -0,0 +1,40 @@
+import time
+from adaptive_control import AIMDController, AdjustableSemaphore
+
+def test_additive_increase_and_multiplicative_decrease():
+    c = AIMDController(batch_tokens=1000, batch_step=500, concurrency=1, max_concurrency=4,
+                       increase_every=2, decrease_cooldown=0)
+    for _ in range(4):
+        c.on_success()
+    assert (c.batch_tokens, c.concurrency) == (2000, 3)
+    c.on_throttle()
+    assert (c.batch_tokens, c.concurrency) == (1000, 1)
+
+def test_burst_of_failures_counts_as_one_decrease():
+    c = AIMDController(batch_tokens=8000, concurrency=4, max_concurrency=4, decrease_cooldown=60)
+    for _ in range(3):
+        c.on_throttle()
+    assert (c.batch_tokens, c.concurrency) == (4000, 2)
+    assert c.get_stats()["decreases"] == 1
+
+def test_retry_after_pauses_new_calls():
+    c = AIMDController()
+    c.on_deadline(retry_after=0.05)
+    started = time.monotonic()
+    c.wait_if_paused()
+    assert time.monotonic() - started >= 0.04
+
+def test_semaphore_limit_can_shrink_while_held():
+    sem = AdjustableSemaphore(2)
+    assert sem.acquire() and sem.acquire()
+    sem.set_limit(1)
+    sem.release()
+    assert not sem.acquire(timeout=0.01)
+    sem.release()
+    assert sem.acquire(timeout=0.01)
+
+if __name__ == "__main__":
+    test_additive_increase_and_multiplicative_decrease()
+    test_burst_of_failures_counts_as_one_decrease()
+    test_retry_after_pauses_new_calls()
+    test_semaphore_limit_can_shrink_while_held()
@@ -0,0 +1,57 @@
+import time
+import numpy as np
+from answer_cache import SemanticAnswerCache
+
+def _emb(*values):
+    v = np.zeros(16, dtype=np.float32)
+    v[:len(values)] = values
+    return v
+
+def test_similar_question_hits_and_dissimilar_misses():
+    cache = SemanticAnswerCache(threshold=0.95, enabled=True)
+    cache.store("doc", _emb(1, 0.1), "What is the notice period?", "30 days.", ["c1", "c2"], variant="plain")
+    hit = cache.lookup("doc", _emb(1, 0.12), variant="plain")
+    assert hit["answer"] == "30 days." and hit["chunk_ids"] == ["c1", "c2"]
+    assert cache.lookup("doc", _emb(0.2, 1), variant="plain") is None
+    # Same question, other prompt variant or other document: no hit
+    assert cache.lookup("doc", _emb(1, 0.1), variant="markdown") is None
+    assert cache.lookup("other", _emb(1, 0.1), variant="plain") is None
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 3 and stats["hit_rate_percent"] == 25.0
+
+def test_ttl_lru_and_invalidation():
+    cache = SemanticAnswerCache(threshold=0.95, ttl_seconds=0.05, max_per_document=2, enabled=True)
+    cache.store("doc", _emb(1), "q1", "a1", [])
+    time.sleep(0.06)
+    assert cache.lookup("doc", _emb(1)) is None
+    assert cache.get_stats()["expirations"] == 1
+
+    cache = SemanticAnswerCache(threshold=0.95, max_per_document=2, enabled=True)
+    cache.store("doc", _emb(1), "q1", "a1", [])
+    cache.store("doc", _emb(0, 1), "q2", "a2", [])
+    assert cache.lookup("doc", _emb(1))["answer"] == "a1"  # q1 is now most recently used
+    cache.store("doc", _emb(0, 0, 1), "q3", "a3", [])       # evicts q2
+    assert cache.lookup("doc", _emb(0, 1)) is None
+    assert cache.lookup("doc", _emb(1))["answer"] == "a1"
+
+    cache.invalidate("doc")
+    assert cache.lookup("doc", _emb(1)) is None
+    assert cache.get_stats()["invalidations"] == 1
+
+def test_answers_from_another_document_version_miss():
+    cache = SemanticAnswerCache(threshold=0.95, enabled=True)
+    cache.store("doc", _emb(1), "q1", "old answer", [], version="processed:hash-a")
+    assert cache.lookup("doc", _emb(1), version="processed:hash-a")["answer"] == "old answer"
+    # Re-processed by another worker: the stored answer is stale, not just shadowed
+    assert cache.lookup("doc", _emb(1), version="processed:hash-b") is None
+    assert cache.get_stats()["stale"] == 1
+    cache.store("doc", _emb(1), "q1", "new answer", [], version="processed:hash-b")
+    assert cache.lookup("doc", _emb(1), version="processed:hash-b")["answer"] == "new answer"
+    # Unknown version (state read failed): no hit, but nothing is dropped either
+    assert cache.lookup("doc", _emb(1)) is None
+    assert cache.lookup("doc", _emb(1), version="processed:hash-b")["answer"] == "new answer"
+
+if __name__ == "__main__":
+    test_similar_question_hits_and_dissimilar_misses()
+    test_ttl_lru_and_invalidation()
+    test_answers_from_another_document_version_miss()
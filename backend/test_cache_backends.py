@@ -0,0 +1,116 @@
+import fnmatch
+import os
+import socketserver
+import tempfile
+import threading
+import time
+from cache_backends import (
+    CacheBackend, MemoryCacheBackend, SQLiteCacheBackend, RedisCacheBackend, serialize, deserialize, create_cache_backend,
+)
+from memory_cache import StripedMemoryCache
+from resp_client import RespClient
+
+class _StandIn(socketserver.StreamRequestHandler):
+    """Just enough of a Redis-protocol server for the cache backend: GET, SET PX, DEL, SCAN."""
+    store = {}
+
+    def _bulk(self, value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            args = []
+            for _ in range(int(line[1:-2])):
+                length = int(self.rfile.readline()[1:-2])
+                args.append(self.rfile.read(length + 2)[:-2])
+            cmd, now = args[0].upper(), time.time()
+            live = {k: v for k, (v, exp) in self.store.items() if exp > now}
+            if cmd == b"PING":
+                out = b"+PONG\r\n"
+            elif cmd == b"GET":
+                out = self._bulk(live.get(args[1]))
+            elif cmd == b"SET":
+                self.store[args[1]] = (args[2], now + int(args[4]) / 1000)
+                out = b"+OK\r\n"
+            elif cmd == b"DEL":
+                out = b":%d\r\n" % sum(self.store.pop(k, None) is not None for k in args[1:])
+            elif cmd == b"SCAN":
+                keys = [k for k in live if fnmatch.fnmatchcase(k.decode(), args[3].decode())]
+                out = b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys) + b"".join(self._bulk(k) for k in keys)
+            else:
+                out = b"-ERR unknown command\r\n"
+            self.wfile.write(out)
+
+def _serve():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _StandIn)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_serialization_round_trip_and_compression():
+    small, large = {"a": 1}, {"text": "clause " * 2000}
+    assert serialize(small)[:1] == b"\x00" and deserialize(serialize(small)) == small
+    blob = serialize(large, compress_min_bytes=1024)
+    assert blob[:1] == b"\x01" and len(blob) < 1000 and deserialize(blob) == large
+    assert serialize(large, compress_min_bytes=0)[:1] == b"\x00"
+
+def test_memory_backend_is_not_shared():
+    backend = MemoryCacheBackend(StripedMemoryCache(max_bytes=1 << 20))
+    assert backend.set("k", [1, 2], 60) and backend.get("k") == [1, 2]
+    assert not backend.shared and backend.get_stats()["hits"] == 1
+    assert create_cache_backend(backend.cache, kind="memory").kind == "memory"
+
+def test_sqlite_backend_shares_between_instances_and_expires():
+    path = os.path.join(tempfile.mkdtemp(), "results.sqlite3")
+    writer, reader = SQLiteCacheBackend(path, namespace="ns1"), SQLiteCacheBackend(path, namespace="ns1")
+    other = SQLiteCacheBackend(path, namespace="ns2")
+    assert writer.set("k", {"risk": "high"}, 60)
+    assert reader.get("k") == {"risk": "high"}
+    assert other.get("k") is None  # another prompt/model namespace never sees it
+    writer.set("short", 1, 0.05)
+    time.sleep(0.06)
+    assert reader.get("short") is None and reader.purge_expired() == 1
+    other.set("k", "kept", 60)
+    writer.clear()
+    assert reader.get("k") is None and other.get("k") == "kept"
+
+def test_redis_backend_against_stand_in():
+    server = _serve()
+    client = RespClient(f"redis://127.0.0.1:{server.server_address[1]}/0")
+    backend = RedisCacheBackend(client, namespace="test", compress_min_bytes=64)
+    assert backend.set("k", {"text": "x" * 500}, 60)
+    assert backend.get("k") == {"text": "x" * 500}
+    assert backend.get("missing") is None
+    assert backend.get_stats()["compressed"] == 1
+    backend.set("short", 1, 0.05)
+    time.sleep(0.06)
+    assert backend.get("short") is None
+    backend.clear()
+    assert backend.get("k") is None
+    server.shutdown()
+    server.server_close()
+    client.close()
+    # Unreachable server: reads miss and writes are dropped instead of raising
+    assert backend.get("k") is None and not backend.set("k", 1, 60)
+    assert backend.get_stats()["errors"] >= 2
+
+def test_backend_missing_an_operation_cannot_be_created():
+    class GetOnly(CacheBackend):
+        kind = "get-only"
+        def get(self, key):
+            return None
+    try:
+        GetOnly()
+        assert False, "expected TypeError"
+    except TypeError as e:
+        assert all(name in str(e) for name in ("set", "delete", "clear"))
+
+if __name__ == "__main__":
+    test_serialization_round_trip_and_compression()
+    test_memory_backend_is_not_shared()
+    test_sqlite_backend_shares_between_instances_and_expires()
+    test_redis_backend_against_stand_in()
+    test_backend_missing_an_operation_cannot_be_created()
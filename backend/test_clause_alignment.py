@@ -0,0 +1,45 @@
+import numpy as np
+from clause_alignment import align, assign, _greedy_assignment
+from retrieval import VectorIndex
+
+def _unit(*values):
+    v = np.zeros(8, dtype=np.float32)
+    v[:len(values)] = values
+    return v
+
+def test_greedy_assignment_is_one_to_one():
+    sim = np.array([[0.9, 0.8], [0.85, 0.1], [0.2, 0.3]], dtype=np.float32)
+    pairs = _greedy_assignment(sim)
+    assert pairs == [(0, 0), (2, 1)]
+    assert len(assign(sim)) == 2
+    assert assign(np.zeros((0, 3))) == []
+
+def test_alignment_buckets():
+    first = VectorIndex(
+        ["Payment is due within 30 days.", "Either party may terminate on notice.", "Licensee pays a fee of $500.",
+         "Governing law is Delaware."],
+        [_unit(1), _unit(0, 1), _unit(0, 0, 1), _unit(0, 0, 0, 1)],
+    )
+    second = VectorIndex(
+        ["Payment is  due within 30 days.", "Either party may terminate on thirty days notice.",
+         "Licensee pays a fee of $5,000.", "Arbitration takes place in London."],
+        [_unit(1), _unit(0, 1, 0.3), _unit(0, 0, 1, 0.01), _unit(0, 0, 0, 0, 1)],
+    )
+    result = align(first, second, match_threshold=0.8, identical_threshold=0.97)
+    # Same text (modulo whitespace) is identical
+    assert [(i, j) for i, j, _ in result["identical"]] == [(0, 0)]
+    # Near-identical embeddings but different figures must still reach the model
+    assert sorted((i, j) for i, j, _ in result["divergent"]) == [(1, 1), (2, 2)]
+    assert result["divergent"][0][2] <= result["divergent"][1][2]
+    assert result["only_first"] == [3] and result["only_second"] == [3]
+
+def test_empty_document():
+    first = VectorIndex(["a"], [_unit(1)])
+    empty = VectorIndex([], np.zeros((0, 0), dtype=np.float32))
+    result = align(first, empty)
+    assert result["only_first"] == [0] and result["only_second"] == [] and not result["divergent"]
+
+if __name__ == "__main__":
+    test_greedy_assignment_is_one_to_one()
+    test_alignment_buckets()
+    test_empty_document()
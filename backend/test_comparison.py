@@ -0,0 +1,111 @@
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import main
+from retrieval import VectorIndex
+
+def _doc(doc_id, score):
+    return {"id": doc_id, "name": f"{doc_id}.pdf", "contentHash": f"hash-{doc_id}", "score": score}
+
+@contextmanager
+def _fake_comparisons(fail_pair=None, fresh=True):
+    """Replace the LLM comparison with one scoring each document by its "score"; records every call."""
+    calls = []
+    def compare(document_analyses, raise_errors=False, use_cache=True):
+        first, second = document_analyses
+        calls.append({first["id"], second["id"]})
+        if fail_pair and {first["id"], second["id"]} == set(fail_pair):
+            raise RuntimeError("comparison model returned unparseable output")
+        better = "Document 1" if first["score"] > second["score"] else "Document 2"
+        return {
+            "overallComparison": {"doc1Score": first["score"], "doc2Score": second["score"], "betterDocument": better},
+            "recommendations": [f"Prefer {better}"],
+        }
+    original = main._generate_comparison_analysis
+    main._generate_comparison_analysis = compare
+    if fresh:
+        main.get_cache_system().clear_results()
+    try:
+        yield calls
+    finally:
+        main._generate_comparison_analysis = original
+
+def test_adding_a_document_only_compares_its_new_pairs():
+    docs = [_doc("a", 80), _doc("b", 60), _doc("c", 70), _doc("d", 50)]
+    with _fake_comparisons() as calls:
+        first = main.generate_pairwise_comparison(docs)
+        assert len(calls) == 6 and first["stats"] == {"pairs": 6, "computed": 6, "cached": 0}
+        calls.clear()
+        # Same content under a new order plus one new document: only its 4 pairs are computed
+        second = main.generate_pairwise_comparison([docs[2], _doc("e", 90), *docs[:2], docs[3]])
+    assert len(calls) == 4 and all("e" in pair for pair in calls)
+    assert second["stats"] == {"pairs": 10, "computed": 4, "cached": 6}
+    assert [r["id"] for r in second["ranking"]] == ["e", "a", "c", "b", "d"]
+    assert second["ranking"][0]["wins"] == 4 and second["ranking"][-1]["losses"] == 4
+    matrix = second["matrix"]
+    e, d = matrix["documents"].index("e"), matrix["documents"].index("d")
+    assert matrix["scores"][e][d] == 90 and matrix["scores"][d][e] == 50
+
+def test_a_failed_pair_is_reported_and_the_rest_still_rank():
+    docs = [_doc("a", 80), _doc("b", 60), _doc("c", 70)]
+    with _fake_comparisons(fail_pair=("a", "b")):
+        result = main.generate_pairwise_comparison(docs)
+    assert result["failures"] == [{"documents": ["a", "b"], "error": "comparison model returned unparseable output"}]
+    assert result["stats"]["pairs"] == 3 and len(result["pairs"]) == 2
+    assert [r["id"] for r in result["ranking"]] == ["a", "c", "b"]
+    a, b = result["matrix"]["documents"].index("a"), result["matrix"]["documents"].index("b")
+    assert result["matrix"]["scores"][a][b] is None
+    # A failed pair is not cached: the next request retries it
+    with _fake_comparisons(fresh=False) as calls:
+        main.generate_pairwise_comparison(docs)
+    assert calls == [{"a", "b"}]
+
+@contextmanager
+def _patched(**fakes):
+    originals = {name: getattr(main, name) for name in fakes}
+    for name, fake in fakes.items():
+        setattr(main, name, fake)
+    try:
+        yield
+    finally:
+        for name, original in originals.items():
+            setattr(main, name, original)
+
+def test_document_analyses_fan_out_within_the_bound_and_report_failures():
+    ids = [f"doc{i}" for i in range(7)]
+    stored = {doc_id: {"status": "processed", "filename": f"{doc_id}.pdf", "contentHash": f"hash-{doc_id}"} for doc_id in ids[:6]}
+    lock, in_flight = threading.Lock(), {"now": 0, "max": 0}
+    def analyze(doc_id, index):
+        with lock:
+            in_flight["now"] += 1
+            in_flight["max"] = max(in_flight["max"], in_flight["now"])
+        time.sleep(0.05)
+        with lock:
+            in_flight["now"] -= 1
+        if doc_id == "doc3":
+            raise RuntimeError("analysis model timed out")
+        return {"summary": f"analysis of {doc_id}"}
+    def index(doc_id):
+        # doc5 was processed but has no chunks stored
+        return VectorIndex([], np.zeros((0, 4))) if doc_id == "doc5" else VectorIndex(["A clause."], np.ones((1, 4)))
+    with _patched(
+        _COMPARE_CONCURRENCY=2,
+        get_documents_by_ids=lambda db, doc_ids: {d: stored[d] for d in doc_ids if d in stored},
+        get_document_index=index,
+        generate_document_analysis=analyze,
+        generate_comparison_analysis=lambda analyses: {"overallComparison": {"documents": len(analyses)}},
+    ):
+        result = main.compare_documents({"document_ids": ids}, user={"uid": "owner"})
+    assert in_flight["max"] == 2
+    # The failed documents are reported; the rest are still compared, in request order
+    assert [d["id"] for d in result["documents"]] == ["doc0", "doc1", "doc2", "doc4"]
+    assert result["comparison"] == {"overallComparison": {"documents": 4}}
+    assert sorted((f["id"], f["error"]) for f in result["failures"]) == [
+        ("doc3", "analysis model timed out"), ("doc5", "No chunks found for document"), ("doc6", "Document not found"),
+    ]
+
+if __name__ == "__main__":
+    test_adding_a_document_only_compares_its_new_pairs()
+    test_a_failed_pair_is_reported_and_the_rest_still_rank()
+    test_document_analyses_fan_out_within_the_bound_and_report_failures()
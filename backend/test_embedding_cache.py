@@ -0,0 +1,71 @@
+import os
+import tempfile
+from embedding_cache import EmbeddingCache
+
+def _cache(max_entries=100, **kwargs):
+    return EmbeddingCache(os.path.join(tempfile.mkdtemp(), "embeddings.sqlite3"), max_entries=max_entries, **kwargs)
+
+def _traced(cache):
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    return statements
+
+def test_hits_are_keyed_by_model_and_text():
+    cache = _cache()
+    key = EmbeddingCache.make_key("gemini-embedding-001", 768, "SEMANTIC_SIMILARITY", "Termination clause")
+    cache.put_many({key: [0.25, -0.5, 1.0]})
+    assert cache.get_many([key]) == {key: [0.25, -0.5, 1.0]}
+    # Another model, dimension, task type or text is a different entry
+    others = [
+        EmbeddingCache.make_key("text-embedding-004", 768, "SEMANTIC_SIMILARITY", "Termination clause"),
+        EmbeddingCache.make_key("gemini-embedding-001", 256, "SEMANTIC_SIMILARITY", "Termination clause"),
+        EmbeddingCache.make_key("gemini-embedding-001", 768, "RETRIEVAL_QUERY", "Termination clause"),
+        EmbeddingCache.make_key("gemini-embedding-001", 768, "SEMANTIC_SIMILARITY", "Termination clause."),
+    ]
+    assert len(set(others) | {key}) == 5
+    assert cache.get_many(others) == {}
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["misses"] == 4 and stats["entries"] == 1
+
+def test_entries_survive_reopening_and_lru_eviction():
+    cache = _cache(max_entries=10)
+    keys = [EmbeddingCache.make_key("m", 2, "t", f"text {i}") for i in range(10)]
+    cache.put_many({k: [float(i), 0.0] for i, k in enumerate(keys)})
+    assert EmbeddingCache(cache.path).get_many(keys[:1]) == {keys[0]: [0.0, 0.0]}
+    cache.get_many(keys[:2])  # keys 0 and 1 are now the most recently used
+    cache.put_many({EmbeddingCache.make_key("m", 2, "t", "text 10"): [1.0, 1.0]})
+    # Over max_entries: down to 90%, least recently used first
+    assert cache.get_stats()["entries"] == 9 and cache.get_stats()["evictions"] == 2
+    assert set(cache.get_many(keys[:2])) == set(keys[:2])
+
+def test_puts_track_the_row_count_without_counting_the_table():
+    cache = _cache(max_entries=50)
+    statements = _traced(cache)
+    keys = [EmbeddingCache.make_key("m", 2, "t", f"text {i}") for i in range(30)]
+    cache.put_many({k: [1.0, 0.0] for k in keys[:20]})
+    cache.put_many({k: [1.0, 0.0] for k in keys[10:30]})  # half of these are already cached
+    assert not [s for s in statements if "COUNT(*)" in s]
+    assert cache.get_stats()["entries"] == 30
+    assert cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] == 30
+
+def test_hits_write_access_times_in_batches():
+    cache = _cache(max_entries=10, touch_flush_size=4)
+    keys = [EmbeddingCache.make_key("m", 2, "t", f"text {i}") for i in range(10)]
+    cache.put_many({k: [float(i), 0.0] for i, k in enumerate(keys)})
+    statements = _traced(cache)
+    for key in keys[:3]:
+        assert key in cache.get_many([key])
+    assert not [s for s in statements if s.startswith(("UPDATE", "COMMIT"))]
+    cache.get_many(keys[3:4])  # the fourth hit writes all four access times at once
+    assert len([s for s in statements if s.startswith("UPDATE")]) == 4
+    assert len([s for s in statements if s.startswith("COMMIT")]) == 1
+    # Pending hits are written before an eviction picks its victims
+    cache.get_many(keys[4:6])
+    cache.put_many({EmbeddingCache.make_key("m", 2, "t", "text 10"): [1.0, 1.0]})
+    assert set(cache.get_many(keys[:6])) == set(keys[:6]) and cache.get_stats()["entries"] == 9
+
+if __name__ == "__main__":
+    test_hits_are_keyed_by_model_and_text()
+    test_entries_survive_reopening_and_lru_eviction()
+    test_puts_track_the_row_count_without_counting_the_table()
+    test_hits_write_access_times_in_batches()
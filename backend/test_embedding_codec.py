@@ -0,0 +1,44 @@
+import numpy as np
+from embedding_codec import pack_embeddings, unpack_embeddings
+
+def _matrix(n=50, dim=768):
+    rng = np.random.default_rng(3)
+    return (rng.normal(size=(n, dim)) * rng.uniform(0.01, 2.0, size=(n, 1))).astype(np.float32)
+
+def _row_cosines(a, b):
+    return np.sum(a * b, axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+
+def test_int8_round_trip_error_is_bounded_per_vector():
+    m = _matrix()
+    record = pack_embeddings(m, "int8")
+    assert len(record["vectors"]) == m.size and len(record["scales"]) == 4 * len(m)
+    out = unpack_embeddings(record)
+    assert out.shape == m.shape and out.dtype == np.float32
+    # Rounding to the nearest step: at most half a step (max-abs / 254) per value
+    bound = np.abs(m).max(axis=1, keepdims=True) / 254.0
+    assert np.all(np.abs(out - m) <= bound * 1.0001)
+    assert _row_cosines(m, out).min() > 0.999
+
+def test_float16_round_trip_error_is_bounded():
+    m = _matrix()
+    record = pack_embeddings(m, "float16")
+    assert len(record["vectors"]) == 2 * m.size and record["scales"] == b""
+    out = unpack_embeddings(record)
+    assert np.all(np.abs(out - m) <= np.abs(m) * 2 ** -11 + 2 ** -24)
+    assert _row_cosines(m, out).min() > 0.99999
+
+def test_zero_vectors_and_single_vectors():
+    out = unpack_embeddings(pack_embeddings(np.zeros((2, 8)), "int8"))
+    assert np.all(out == 0)
+    single = unpack_embeddings(pack_embeddings([0.5, -1.0, 0.25], "int8"))
+    assert single.shape == (1, 3) and np.allclose(single, [[0.5, -1.0, 0.25]], atol=1 / 254)
+    try:
+        pack_embeddings(np.zeros((1, 8)), "bfloat16")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    test_int8_round_trip_error_is_bounded_per_vector()
+    test_float16_round_trip_error_is_bounded()
+    test_zero_vectors_and_single_vectors()
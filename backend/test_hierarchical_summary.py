@@ -0,0 +1,69 @@
+import hashlib
+import random
+import types
+import pipeline
+from pipeline import chunk_text, generate_hierarchical_summary, _group_by_content
+from caching_system import get_cache_system
+
+def _words(n=40000, seed=5):
+    rng = random.Random(seed)
+    vocab = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 9))) for _ in range(400)]
+    return [rng.choice(vocab) for _ in range(n)]
+
+def _chunks(words):
+    return chunk_text([{"page": 1, "text": " ".join(words)}])
+
+def _summarize(chunks):
+    """Run the map-reduce summary against a deterministic stand-in model; returns the node inputs sent."""
+    calls = []
+    def generate(model, contents, config=None):
+        node_input = contents.split("---\n", 1)[1]
+        calls.append(node_input)
+        digest = hashlib.sha256(node_input.encode("utf-8")).hexdigest()
+        return types.SimpleNamespace(text="\n".join(f"- point {digest[i:i + 6]}" for i in range(0, 18, 6)))
+    original = pipeline.llm
+    pipeline.llm = types.SimpleNamespace(generate=generate)
+    try:
+        generate_hierarchical_summary(chunks)
+    finally:
+        pipeline.llm = original
+    return calls
+
+def test_an_insertion_only_changes_the_chunks_around_it():
+    words = _words()
+    before = _chunks(words)
+    after = _chunks(words[:21000] + "the landlord may terminate on notice".split() + words[21000:])
+    old_texts = {c["text"] for c in before}
+    changed = [c for c in after if c["text"] not in old_texts]
+    assert 1 <= len(changed) <= 2 and abs(len(after) - len(before)) <= 1
+    assert all(c["tokens"] <= 500 for c in after)
+
+def test_editing_one_region_only_resummarizes_its_branch():
+    get_cache_system().clear_results()
+    words = _words()
+    first = _summarize(_chunks(words))
+    assert 1 < len(first) <= pipeline._SUMMARY_MAX_CALLS
+    edited = words[:21000] + "the landlord may terminate on notice".split() + words[21000:]
+    second = _summarize(_chunks(edited))
+    # The leaf holding the edit and each of its ancestors; every other node is a cache hit
+    leaves = [node for node in second if not node.startswith("- ")]
+    assert len(leaves) == 1 and "the landlord may terminate on notice" in leaves[0]
+    assert len(second) <= 4 and len(second) < len(first) // 4
+
+def test_call_budget_drops_boundaries_instead_of_regrouping_evenly():
+    hashes = [hashlib.sha256(str(i).encode("utf-8")).hexdigest() for i in range(400)]
+    tokens = [100] * len(hashes)
+    free = _group_by_content(hashes, tokens, 8, 10 ** 9, len(hashes))
+    capped = _group_by_content(hashes, tokens, 8, 10 ** 9, len(free) // 2)
+    assert len(capped) <= len(free) // 2
+    # Every boundary kept under the cap is one of the content-defined boundaries (or closes a
+    # group at its size limit, which only ever grows with the target)
+    free_ends = {g[-1] for g in free}
+    assert all(g[-1] in free_ends or len(g) >= 4 * 8 for g in capped)
+    assert sum(g[-1] in free_ends for g in capped) >= len(capped) - 2
+    assert [i for g in capped for i in g] == list(range(len(hashes)))
+
+if __name__ == "__main__":
+    test_an_insertion_only_changes_the_chunks_around_it()
+    test_editing_one_region_only_resummarizes_its_branch()
+    test_call_budget_drops_boundaries_instead_of_regrouping_evenly()
@@ -0,0 +1,190 @@
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+import ingestion
+from ingestion import IngestionError, IngestionPipeline
+
+CONTENT = "The Tenant shall pay rent monthly in advance. " * 400
+
+class _Snapshot:
+    def __init__(self, data):
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+class _DB:
+    """Just the document read ingestion's extract stage makes (content plus the last checkpoint)."""
+
+    def __init__(self, content, store):
+        self.content = content
+        self.store = store
+
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self
+
+    def get(self):
+        checkpoint = self.store.checkpoints[-1] if self.store.checkpoints else None
+        return _Snapshot({"documentContent": self.content, "processingCheckpoint": checkpoint})
+
+class _Store:
+    """Stands in for the Firestore chunk collection, checkpoint and summary the pipeline reads and writes."""
+
+    def __init__(self):
+        self.chunks = {}
+        self.checkpoints = []
+        self.deleted = 0
+        self.embedded = []
+        self.fail_embed_after = None
+        self.fail_store_after = None  # an event: the store fails once it is set
+        self.first_embed = threading.Event()
+
+    def writer(self, db):
+        store = self
+        class Writer:
+            def write(self, chunks):
+                if store.fail_store_after is not None:
+                    store.fail_store_after.wait(2)
+                    raise RuntimeError("Firestore write rejected")
+                for c in chunks:
+                    assert c["chunkIndex"] not in store.chunks, "chunk stored twice"
+                    store.chunks[c["chunkIndex"]] = dict(c)
+        return Writer()
+
+    def progress(self, db, doc_id):
+        return [(idx, c["contentHash"]) for idx, c in self.chunks.items()]
+
+    def delete(self, db, doc_id):
+        self.deleted += len(self.chunks)
+        self.chunks.clear()
+        return self.deleted
+
+    def update(self, db, doc_id, fields):
+        self.checkpoints.append(fields["processingCheckpoint"])
+
+    def embed(self, texts):
+        if self.fail_embed_after is not None and len(self.embedded) >= self.fail_embed_after:
+            # Let the batches already embedded reach the store before the failure stops it
+            deadline = time.time() + 2
+            while len(self.chunks) < sum(map(len, self.embedded)) and time.time() < deadline:
+                time.sleep(0.01)
+            raise RuntimeError("embedding quota exhausted")
+        self.embedded.append(list(texts))
+        self.first_embed.set()
+        return [[1.0, float(len(t))] for t in texts]
+
+@contextmanager
+def _patched(store, **extra):
+    fakes = {
+        "ChunkWriter": store.writer,
+        "get_chunk_progress": store.progress,
+        "delete_chunks_by_doc_id": store.delete,
+        "update_document_fields": store.update,
+        "get_summary_by_doc_id": lambda db, doc_id: None,
+        "embed_texts": store.embed,
+        "generate_summary": lambda chunks, cancel=None: {"bullets": [], "risks": []},
+        **extra,
+    }
+    originals = {name: getattr(ingestion, name) for name in fakes}
+    for name, fake in fakes.items():
+        setattr(ingestion, name, fake)
+    try:
+        yield
+    finally:
+        for name, original in originals.items():
+            setattr(ingestion, name, original)
+
+def test_rerun_stores_only_the_missing_chunks():
+    store = _Store()
+    with _patched(store):
+        store.fail_embed_after = 2  # two batches land, then embedding fails
+        try:
+            IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=3, embed_workers=1).run()
+            assert False, "expected IngestionError"
+        except IngestionError as e:
+            assert e.stage == "embed"
+        first = set(store.chunks)
+        assert first == set(range(6))
+
+        store.fail_embed_after, store.embedded = None, []
+        result = IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=3, embed_workers=1).run()
+    total = result["chunk_count"]
+    assert total > 6 and result["resumed_from"] == 6 and result["stored_count"] == total
+    assert set(store.chunks) == set(range(total)) and store.deleted == 0
+    # Only the chunks that were missing were embedded again
+    embedded = [t for batch in store.embedded for t in batch]
+    assert len(embedded) == total - 6
+    assert sorted(embedded) == sorted(store.chunks[i]["text"] for i in range(6, total))
+    checkpoint = store.checkpoints[-1]
+    assert checkpoint["storedChunks"] == checkpoint["totalChunks"] == total
+    assert checkpoint["contentHash"] == hashlib.sha256(CONTENT.encode("utf-8")).hexdigest()
+
+def test_changed_content_discards_the_checkpoint():
+    store = _Store()
+    with _patched(store):
+        IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=4, embed_workers=2).run()
+        old_count = len(store.chunks)
+        store.embedded = []
+        result = IngestionPipeline(_DB(CONTENT + " Amended.", store), "doc", batch_size=4, embed_workers=2).run()
+    assert store.deleted == old_count and result["resumed_from"] == 0
+    assert sum(len(batch) for batch in store.embedded) == result["chunk_count"] == len(store.chunks)
+    assert {c["contentHash"] for c in store.chunks.values()} == {result["content_hash"]}
+
+def test_checkpoint_from_another_chunker_is_discarded():
+    store = _Store()
+    with _patched(store):
+        IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=4).run()
+        count = len(store.chunks)
+        store.checkpoints[-1] = {**store.checkpoints[-1], "chunker": "fixed-windows"}
+        store.embedded = []
+        result = IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=4).run()
+    assert store.deleted == count and result["resumed_from"] == 0
+    assert sum(len(batch) for batch in store.embedded) == result["chunk_count"]
+
+def test_embedding_starts_before_chunking_finishes():
+    store = _Store()
+    cut = []
+    def slow_chunks(pages, chunk_size=500, overlap=50):
+        for i in range(8):
+            if i == 4:
+                # Half the document is still to be chunked: the first batch must already be embedding
+                assert store.first_embed.wait(2), "embedding waited for the whole document to be chunked"
+            cut.append(i)
+            yield {"page": 1, "text": f"Clause {i} of the lease.", "tokens": 5}
+    with _patched(store, iter_chunks=slow_chunks):
+        result = IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=2, embed_workers=1).run()
+    assert cut == list(range(8)) and result["chunk_count"] == result["stored_count"] == 8
+    assert sorted(store.chunks) == list(range(8))
+    timings = result["timings"]
+    assert {"extract", "checkpoint", "chunk", "embed", "store", "summarize", "total"} <= set(timings)
+    assert timings["chunk"]["items"] == 8 and timings["store"]["items"] == 8
+
+def test_store_failure_cancels_the_summary_and_is_reported():
+    store = _Store()
+    summary_started, seen = threading.Event(), {}
+    def summarize(chunks, cancel=None):
+        summary_started.set()
+        seen["cancelled"] = cancel.wait(2)
+        raise ingestion.SummaryCancelled()
+    store.fail_store_after = summary_started
+    with _patched(store, generate_summary=summarize):
+        pipeline = IngestionPipeline(_DB(CONTENT, store), "doc", batch_size=4, embed_workers=1)
+        try:
+            pipeline.run()
+            assert False, "expected IngestionError"
+        except IngestionError as e:
+            assert e.stage == "store" and "Firestore write rejected" in str(e)
+    assert seen == {"cancelled": True} and not store.chunks
+    assert str(pipeline._summary_error) == "summary cancelled"
+
+if __name__ == "__main__":
+    test_rerun_stores_only_the_missing_chunks()
+    test_changed_content_discards_the_checkpoint()
+    test_checkpoint_from_another_chunker_is_discarded()
+    test_embedding_starts_before_chunking_finishes()
+    test_store_failure_cancels_the_summary_and_is_reported()
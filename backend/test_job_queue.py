@@ -0,0 +1,95 @@
+import os
+import tempfile
+import threading
+import time
+from job_queue import JobQueue, WorkerPool, QUEUED, RUNNING, SUCCEEDED, FAILED
+
+def _make_queue(**kwargs):
+    path = os.path.join(tempfile.mkdtemp(), "jobs.sqlite3")
+    return JobQueue(path, **kwargs)
+
+def test_enqueue_dedupes_pending_jobs():
+    q = _make_queue()
+    first = q.enqueue("process_document", {"document_id": "a"}, dedupe_key="doc:a")
+    second = q.enqueue("process_document", {"document_id": "a"}, dedupe_key="doc:a")
+    assert first == second
+    assert q.get_stats()[QUEUED] == 1
+
+def test_failed_attempt_is_retried_then_marked_failed():
+    q = _make_queue(retry_backoff=0.01)
+    job_id = q.enqueue("process_document", {"document_id": "a"}, max_attempts=2)
+    job = q.claim()
+    assert job["id"] == job_id and job["attempts"] == 1
+    q.fail(job_id, "boom", job["attempts"], job["max_attempts"], job["lease_token"])
+    assert q.get(job_id)["status"] == QUEUED
+    time.sleep(0.02)
+    job = q.claim()
+    assert job["attempts"] == 2
+    q.fail(job_id, "boom", job["attempts"], job["max_attempts"], job["lease_token"])
+    assert q.get(job_id)["status"] == FAILED
+    assert q.claim() is None
+
+def test_expired_lease_makes_job_claimable_again():
+    q = _make_queue(visibility_timeout=0.01)
+    job_id = q.enqueue("process_document", {"document_id": "a"})
+    stale = q.claim()
+    assert stale["id"] == job_id
+    assert q.get(job_id)["status"] == RUNNING
+    time.sleep(0.02)
+    job = q.claim()
+    assert job["id"] == job_id and job["attempts"] == 2
+    # The first worker's lease is gone: it can no longer heartbeat, complete or fail the job
+    assert not q.heartbeat(job_id, stale["lease_token"])
+    assert not q.fail(job_id, "late", stale["attempts"], stale["max_attempts"], stale["lease_token"])
+    assert not q.complete(job_id, stale["lease_token"])
+    assert q.get(job_id)["status"] == RUNNING
+    assert q.complete(job_id, job["lease_token"])
+    assert q.get(job_id)["status"] == SUCCEEDED
+
+def test_lease_expiring_on_the_final_attempt_is_reported_as_abandoned():
+    q = _make_queue(visibility_timeout=0.01)
+    job_id = q.enqueue("process_document", {"document_id": "a"}, max_attempts=1)
+    assert q.claim()["id"] == job_id  # this worker dies without completing the job
+    time.sleep(0.02)
+    # A worker pool picks up the expired lease and hands the payload to the kind's abandon handler
+    abandoned = []
+    reported = threading.Event()
+    def abandon(payload):
+        abandoned.append(payload)
+        reported.set()
+    pool = WorkerPool(q, {}, size=1, poll_interval=0.01, abandon_handlers={"process_document": abandon})
+    pool.start()
+    try:
+        assert reported.wait(2)
+    finally:
+        pool.stop()
+    assert abandoned == [{"document_id": "a"}]
+    job = q.get(job_id)
+    assert job["status"] == FAILED and job["last_error"] == "lease expired on final attempt"
+    assert q.claim(on_abandoned=abandoned.append) is None and len(abandoned) == 1
+
+def test_purge_finished_keeps_recent_and_pending_jobs():
+    q = _make_queue()
+    done = q.enqueue("process_document", {"document_id": "a"})
+    job = q.claim()
+    q.complete(done, job["lease_token"])
+    pending = q.enqueue("process_document", {"document_id": "b"})
+    assert q.purge_finished(older_than_seconds=3600) == 0
+    assert q.purge_finished(older_than_seconds=0) == 1
+    assert q.get(done) is None and q.get(pending)["status"] == QUEUED
+
+def test_wait_returns_final_state_or_times_out():
+    q = _make_queue()
+    job_id = q.enqueue("process_document", {"document_id": "a"})
+    assert q.wait(job_id, timeout=0.05, poll_interval=0.01)["status"] == QUEUED
+    job = q.claim()
+    threading.Timer(0.05, q.complete, (job_id, job["lease_token"])).start()
+    assert q.wait(job_id, timeout=2, poll_interval=0.01)["status"] == SUCCEEDED
+
+if __name__ == "__main__":
+    test_enqueue_dedupes_pending_jobs()
+    test_failed_attempt_is_retried_then_marked_failed()
+    test_expired_lease_makes_job_claimable_again()
+    test_lease_expiring_on_the_final_attempt_is_reported_as_abandoned()
+    test_purge_finished_keeps_recent_and_pending_jobs()
+    test_wait_returns_final_state_or_times_out()
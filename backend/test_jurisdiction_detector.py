@@ -0,0 +1,60 @@
+from jurisdiction_detector import detect_jurisdiction
+
+def test_governing_law_clause_is_high_confidence():
+    text = (
+        "SERVICES AGREEMENT. The Service Provider shall perform the services described in each "
+        "Statement of Work. Fees are payable in USD within 30 days. This Agreement shall be governed "
+        "by and construed in accordance with the laws of the State of California, without regard to "
+        "its conflict of laws principles. The courts located in San Francisco, California shall have "
+        "exclusive jurisdiction."
+    )
+    result = detect_jurisdiction(text)
+    assert result["jurisdiction"] == "US-California"
+    assert result["confidence"] == "high"
+    assert result["document_type"] == "service_agreement"
+    assert result["governing_law"] == "Laws of California"
+
+def test_all_caps_governing_law_clause():
+    text = (
+        "THIS AGREEMENT SHALL BE GOVERNED BY THE LAWS OF THE STATE OF CALIFORNIA. "
+        "ANY DISPUTE SHALL BE RESOLVED IN THE COURTS OF SAN FRANCISCO, CALIFORNIA."
+    )
+    result = detect_jurisdiction(text)
+    assert result["jurisdiction"] == "US-California"
+    assert result["governing_law"] == "Laws of California"
+    assert result["confidence"] in ("medium", "high")
+
+def test_longest_place_name_wins():
+    text = "This Lease is governed by the laws of England and Wales. The Tenant shall pay rent in £."
+    result = detect_jurisdiction(text)
+    assert result["jurisdiction"] == "UK"
+    assert result["document_type"] == "lease_agreement"
+    assert result["confidence"] in ("medium", "high")
+
+    text = "This Agreement is governed by the laws of the State of West Virginia."
+    assert detect_jurisdiction(text)["jurisdiction"] == "US-West Virginia"
+
+def test_weak_signals_stay_low_confidence():
+    result = detect_jurisdiction("The employee will receive a salary of $50,000 per year.")
+    assert result["confidence"] == "low"
+    assert detect_jurisdiction("")["jurisdiction"] == "Unknown"
+
+    # A currency alone narrows it to a country, never confidently
+    result = detect_jurisdiction("The purchase price is ₹10,00,000 payable at closing.")
+    assert result["jurisdiction"] == "India"
+    assert result["confidence"] == "low"
+
+def test_conflicting_countries_lower_the_score():
+    clean = detect_jurisdiction("This Agreement is governed by the laws of Germany.")
+    mixed = detect_jurisdiction(
+        "This Agreement is governed by the laws of Germany. Disputes go to the courts of Singapore."
+    )
+    assert clean["jurisdiction"] == mixed["jurisdiction"] == "EU-Germany"
+    assert mixed["score"] < clean["score"]
+
+if __name__ == "__main__":
+    test_governing_law_clause_is_high_confidence()
+    test_all_caps_governing_law_clause()
+    test_longest_place_name_wins()
+    test_weak_signals_stay_low_confidence()
+    test_conflicting_countries_lower_the_score()
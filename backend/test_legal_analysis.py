@@ -0,0 +1,102 @@
+import json
+import types
+from contextlib import contextmanager
+import numpy as np
+import main
+from retrieval import VectorIndex
+
+ANALYSIS = {"summary": "Lease with an uncapped indemnity.", "clauseCategories": [], "riskAnalysis": {"overallRisk": "high"}}
+
+class _Fakes:
+    """Firestore document state, stored analyses and the LLM, as seen by the legal analysis endpoint."""
+
+    def __init__(self, status="processed", content_hash="hash-1"):
+        self.states = [{"status": status, "contentHash": content_hash}]
+        self.stored = {}
+        self.llm_calls = 0
+
+    def state(self, db, doc_id):
+        # Successive reads walk through `states`, staying on the last one
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+    def generate(self, **kwargs):
+        self.llm_calls += 1
+        return types.SimpleNamespace(text=json.dumps(ANALYSIS))
+
+    def store(self, stored):
+        self.stored[("doc", main._LEGAL_ANALYSIS_KIND)] = stored
+
+@contextmanager
+def _patched(fakes):
+    index = VectorIndex(["The tenant indemnifies the landlord without limit."], np.ones((1, 4)))
+    replacements = {
+        "get_processing_state": fakes.state,
+        "get_analysis": lambda db, doc_id, kind: fakes.stored.get((doc_id, kind)),
+        "put_analysis": lambda db, doc_id, kind, data: fakes.stored.__setitem__((doc_id, kind), data),
+        "get_document_index": lambda doc_id: index,
+        "embed_text": lambda text: [1.0, 0.0, 0.0, 0.0],
+        "detect_jurisdiction_and_context": lambda text: {"jurisdiction": "England and Wales", "document_type": "Lease"},
+        "get_llm_gateway": lambda: types.SimpleNamespace(generate=fakes.generate),
+    }
+    originals = {name: getattr(main, name) for name in replacements}
+    for name, fake in replacements.items():
+        setattr(main, name, fake)
+    try:
+        yield fakes
+    finally:
+        for name, original in originals.items():
+            setattr(main, name, original)
+
+def _stored(content_hash="hash-1", prompt_version=None, model=None):
+    return {
+        "contentHash": content_hash,
+        "promptVersion": prompt_version or main._LEGAL_ANALYSIS_PROMPT_VERSION,
+        "model": model or main._LEGAL_ANALYSIS_MODEL,
+        "createdAt": 0,
+        "resultJson": json.dumps({"summary": "stored"}),
+    }
+
+def _analyze(refresh=False):
+    return main.generate_legal_analysis("doc", refresh=refresh, user={"uid": "owner"})
+
+def test_matching_stored_analysis_is_reused_without_an_llm_call():
+    with _patched(_Fakes()) as fakes:
+        fakes.store(_stored())
+        assert _analyze() == {"summary": "stored"}
+    assert fakes.llm_calls == 0
+
+def test_refresh_bypasses_the_stored_analysis():
+    with _patched(_Fakes()) as fakes:
+        fakes.store(_stored())
+        assert _analyze(refresh=True) == ANALYSIS
+    assert fakes.llm_calls == 1
+    assert json.loads(fakes.stored[("doc", "legal")]["resultJson"]) == ANALYSIS
+
+def test_prompt_version_model_or_content_change_regenerates():
+    for stale in (_stored(prompt_version="0"), _stored(model="an-older-model"), _stored(content_hash="hash-0")):
+        with _patched(_Fakes()) as fakes:
+            fakes.store(stale)
+            assert _analyze() == ANALYSIS
+        assert fakes.llm_calls == 1
+        stored = fakes.stored[("doc", "legal")]
+        assert {k: stored[k] for k in ("contentHash", "promptVersion", "model")} == {
+            "contentHash": "hash-1", "promptVersion": main._LEGAL_ANALYSIS_PROMPT_VERSION, "model": main._LEGAL_ANALYSIS_MODEL,
+        }
+        assert json.loads(stored["resultJson"]) == ANALYSIS
+
+def test_analysis_of_a_document_still_processing_is_not_persisted():
+    with _patched(_Fakes(status="processing")) as fakes:
+        assert _analyze() == ANALYSIS
+    assert fakes.llm_calls == 1 and not fakes.stored
+    # Processed when the chunks were read, re-processed before the analysis finished
+    fakes = _Fakes()
+    fakes.states = [{"status": "processed", "contentHash": "hash-1"}] * 2 + [{"status": "processing", "contentHash": "hash-2"}]
+    with _patched(fakes):
+        assert _analyze() == ANALYSIS
+    assert not fakes.stored
+
+if __name__ == "__main__":
+    test_matching_stored_analysis_is_reused_without_an_llm_call()
+    test_refresh_bypasses_the_stored_analysis()
+    test_prompt_version_model_or_content_change_regenerates()
+    test_analysis_of_a_document_still_processing_is_not_persisted()
@@ -0,0 +1,81 @@
+import threading
+import time
+import types
+from llm_gateway import LLMGateway
+
+class _Models:
+    """Stand-in for client.models that records how many generation calls are in flight at once."""
+
+    def __init__(self, fail_on=None):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_on = fail_on
+
+    def generate_content(self, model, contents, config=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.05)
+            if contents == self.fail_on:
+                raise RuntimeError("503 model overloaded")
+            return types.SimpleNamespace(text=f"reply to {contents}")
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def generate_content_stream(self, model, contents, config=None):
+        for part in ("first", "second"):
+            yield types.SimpleNamespace(text=part)
+
+    def embed_content(self, model, contents, config=None):
+        return types.SimpleNamespace(embeddings=[[0.0] for _ in contents])
+
+def _gateway(slots, models):
+    gateway = LLMGateway(api_key="test-key", generation_concurrency=slots)
+    gateway.client = types.SimpleNamespace(models=models)
+    return gateway
+
+def _call_concurrently(gateway, prompts):
+    results, errors = {}, {}
+    def call(prompt):
+        try:
+            results[prompt] = gateway.generate("gemini-test", prompt).text
+        except Exception as e:
+            errors[prompt] = e
+    threads = [threading.Thread(target=call, args=(p,)) for p in prompts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results, errors
+
+def test_generation_calls_never_exceed_the_slot_count():
+    for slots in (1, 3):
+        models = _Models()
+        gateway = _gateway(slots, models)
+        results, errors = _call_concurrently(gateway, [f"prompt {i}" for i in range(slots + 1)])
+        assert not errors and len(results) == slots + 1
+        # N+1 callers, N slots: all of the slots were used and none was exceeded
+        assert models.max_in_flight == slots
+
+def test_metrics_count_calls_and_errors_per_operation():
+    models = _Models(fail_on="prompt 1")
+    gateway = _gateway(2, models)
+    results, errors = _call_concurrently(gateway, ["prompt 0", "prompt 1", "prompt 2"])
+    assert set(results) == {"prompt 0", "prompt 2"} and set(errors) == {"prompt 1"}
+    assert [c.text for c in gateway.stream("gemini-test", "stream me")] == ["first", "second"]
+    gateway.embed("embedding-test", ["a", "b"])
+    operations = gateway.get_stats()["operations"]
+    assert {op: (s["calls"], s["errors"]) for op, s in operations.items()} == {
+        "generate": (3, 1), "stream": (1, 0), "stream_first_chunk": (1, 0), "embed": (1, 0),
+    }
+    generate = operations["generate"]
+    assert generate["max_seconds"] >= generate["p50_seconds"] >= 0.05 and generate["p95_seconds"] >= generate["p50_seconds"]
+    # The failed call still released its slot
+    assert gateway.scheduler.acquire(timeout=1) and gateway.scheduler.acquire(timeout=1)
+
+if __name__ == "__main__":
+    test_generation_calls_never_exceed_the_slot_count()
+    test_metrics_count_calls_and_errors_per_operation()
@@ -0,0 +1,68 @@
+import threading
+import time
+from memory_cache import StripedMemoryCache, LFU, sizeof
+
+def test_byte_budget_evicts_least_recently_used():
+    value = "x" * 1000
+    per_entry = sizeof(value) + 400
+    cache = StripedMemoryCache(max_bytes=per_entry * 3, stripes=1)
+    for key in ("a", "b", "c"):
+        cache.set(key, value)
+    assert cache.get("a") == value          # a is now most recently used
+    cache.set("d", value)                   # evicts b
+    assert "b" not in cache and "a" in cache and "d" in cache
+    stats = cache.get_stats()
+    assert stats["evictions"] >= 1 and stats["bytes_used"] <= stats["max_bytes"]
+
+def test_lfu_keeps_frequently_read_entries():
+    value = "x" * 1000
+    per_entry = sizeof(value) + 400
+    cache = StripedMemoryCache(max_bytes=per_entry * 3, stripes=1, policy=LFU)
+    for key in ("a", "b", "c"):
+        cache.set(key, value)
+    for _ in range(3):
+        cache.get("a")
+        cache.get("c")
+    cache.set("d", value)                   # b was read least often
+    assert "b" not in cache and "a" in cache and "c" in cache and "d" in cache
+    cache.set("a", value + "y")             # overwriting keeps a's frequency
+    cache.set("e", value)
+    assert "a" in cache and "d" not in cache
+
+def test_ttl_oversize_and_purge():
+    cache = StripedMemoryCache(max_bytes=4096, stripes=2)
+    assert cache.set("big", "x" * 10000) is False
+    cache.set("short", 1, ttl_seconds=0.05)
+    cache.set("long", 2, ttl_seconds=60)
+    time.sleep(0.06)
+    assert cache.get("short") is None
+    cache.set("short2", 3, ttl_seconds=0.01)
+    time.sleep(0.02)
+    assert cache.purge_expired() == 1
+    assert len(cache) == 1 and cache.get("long") == 2
+    stats = cache.get_stats()
+    assert stats["rejected"] == 1 and stats["expirations"] == 2
+    cache.clear()
+    assert len(cache) == 0 and cache.get_stats()["bytes_used"] == 0
+
+def test_concurrent_access_keeps_counters_and_budget_consistent():
+    cache = StripedMemoryCache(max_bytes=64 * 1024, stripes=8)
+    def worker(n):
+        for i in range(500):
+            key = f"k{(n * 31 + i) % 200}"
+            if cache.get(key) is None:
+                cache.set(key, [i] * 20)
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.get_stats()
+    assert stats["hits"] + stats["misses"] == 8 * 500
+    assert stats["bytes_used"] <= stats["max_bytes"]
+
+if __name__ == "__main__":
+    test_byte_budget_evicts_least_recently_used()
+    test_lfu_keeps_frequently_read_entries()
+    test_ttl_oversize_and_purge()
+    test_concurrent_access_keeps_counters_and_budget_consistent()
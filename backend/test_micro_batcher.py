@@ -0,0 +1,49 @@
+import threading
+from micro_batcher import MicroBatcher
+
+def _run_concurrently(batcher, items):
+    results = {}
+    def call(item):
+        results[item] = batcher.submit(item)
+    threads = [threading.Thread(target=call, args=(item,)) for item in items]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+def test_concurrent_calls_share_one_batch_and_get_their_own_results():
+    calls = []
+    def batch_fn(items):
+        calls.append(list(items))
+        return [item * 10 for item in items]
+    batcher = MicroBatcher(batch_fn, window_ms=100, max_batch_size=8)
+    results = _run_concurrently(batcher, list(range(8)))
+    assert results == {i: i * 10 for i in range(8)}
+    assert len(calls) == 1
+    assert batcher.get_stats()["full_flushes"] == 1
+
+def test_token_cap_splits_batches():
+    calls = []
+    def batch_fn(items):
+        calls.append(len(items))
+        return items
+    batcher = MicroBatcher(batch_fn, window_ms=50, max_batch_size=100, max_batch_tokens=3)
+    _run_concurrently(batcher, list(range(6)))
+    assert sum(calls) == 6 and max(calls) <= 3
+
+def test_batch_errors_reach_every_caller():
+    def batch_fn(items):
+        raise RuntimeError("upstream down")
+    batcher = MicroBatcher(batch_fn, window_ms=1)
+    try:
+        batcher.submit("q")
+        assert False, "expected RuntimeError"
+    except RuntimeError as e:
+        assert "upstream down" in str(e)
+    assert batcher.get_stats()["errors"] == 1
+
+if __name__ == "__main__":
+    test_concurrent_calls_share_one_batch_and_get_their_own_results()
+    test_token_cap_splits_batches()
+    test_batch_errors_reach_every_caller()
@@ -0,0 +1,52 @@
+import threading
+import time
+from adaptive_control import AdjustableSemaphore
+from priority_scheduler import PriorityScheduler, INTERACTIVE, BULK, priority, current_priority
+
+def _queue_then_release(scheduler, classes):
+    """Hold the only slot, queue one waiter per class in order, then release and record grant order."""
+    order = []
+    assert scheduler.acquire(INTERACTIVE)
+    def waiter(cls, i):
+        with scheduler.slot(cls):
+            order.append((cls, i))
+            time.sleep(0.005)
+    threads = []
+    for i, cls in enumerate(classes):
+        t = threading.Thread(target=waiter, args=(cls, i))
+        t.start()
+        threads.append(t)
+        time.sleep(0.01)
+    scheduler.release()
+    for t in threads:
+        t.join()
+    return order
+
+def test_interactive_goes_before_queued_bulk():
+    scheduler = PriorityScheduler("test", AdjustableSemaphore(1), min_bulk_share=0.0)
+    order = _queue_then_release(scheduler, [BULK, BULK, INTERACTIVE])
+    assert order[0] == (INTERACTIVE, 2)
+
+def test_bulk_keeps_its_minimum_share():
+    scheduler = PriorityScheduler("test", AdjustableSemaphore(1), min_bulk_share=0.5, window=10)
+    order = _queue_then_release(scheduler, [BULK] + [INTERACTIVE] * 5)
+    # With half the grants reserved for bulk, it is not left until last
+    assert [cls for cls, _ in order].index(BULK) < len(order) - 1
+    stats = scheduler.get_stats()
+    assert stats[BULK]["granted"] == 1 and stats[INTERACTIVE]["granted"] == 6
+
+def test_priority_context_is_thread_local():
+    assert current_priority() == INTERACTIVE
+    with priority(BULK):
+        assert current_priority() == BULK
+        seen = []
+        t = threading.Thread(target=lambda: seen.append(current_priority()))
+        t.start()
+        t.join()
+        assert seen == [INTERACTIVE]
+    assert current_priority() == INTERACTIVE
+
+if __name__ == "__main__":
+    test_interactive_goes_before_queued_bulk()
+    test_bulk_keeps_its_minimum_share()
+    test_priority_context_is_thread_local()
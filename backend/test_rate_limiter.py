@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import time
+import os
+import tempfile
+from rate_limiter import RateLimiter, QuotaBackend, MemoryQuotaBackend, SQLiteQuotaBackend, RedisQuotaBackend
+from resp_client import RespError
+
+def _drained(rpm=600):
+    rl = RateLimiter(rpm, 100000, 10000)
+    rl.backend._requests.tokens = 0
+    return rl
+
+def test_waiters_are_served_in_fifo_order():
+    rl = _drained()
+    order = []
+    def worker(i):
+        rl.acquire(1)
+        order.append(i)
+    threads = []
+    for i in range(5):
+        t = threading.Thread(target=worker, args=(i,))
+        t.start()
+        threads.append(t)
+        time.sleep(0.01)
+    for t in threads:
+        t.join()
+    assert order == [0, 1, 2, 3, 4]
+    assert rl.get_stats()["waiting"] == 0
+
+def test_acquire_times_out_and_leaves_queue():
+    rl = _drained(rpm=6)
+    try:
+        rl.acquire(1, timeout=0.05)
+        assert False, "expected TimeoutError"
+    except TimeoutError:
+        pass
+    stats = rl.get_stats()
+    assert stats["timeouts"] == 1 and stats["waiting"] == 0
+
+def test_daily_quota_is_enforced():
+    rl = RateLimiter(600, 100000, 2)
+    rl.acquire(1)
+    rl.acquire(1)
+    try:
+        rl.acquire(1)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+def test_async_front_end_shares_buckets():
+    rl = _drained()
+    async def run():
+        await asyncio.gather(*(rl.acquire_async(1) for _ in range(3)))
+    asyncio.run(run())
+    assert rl.get_stats()["acquired"] == 3
+
+def test_memory_backend_apportions_quota_across_workers():
+    backend = MemoryQuotaBackend(60, 1000, 100, workers=4)
+    assert (backend.rpm, backend.tpm, backend.rpd) == (15, 250, 25)
+
+def test_sqlite_backend_is_shared_and_survives_restart():
+    path = os.path.join(tempfile.mkdtemp(), "ratelimit.sqlite3")
+    first = SQLiteQuotaBackend(path, 2, 100000, 3)
+    second = SQLiteQuotaBackend(path, 2, 100000, 3)
+    assert first.try_consume(1) == 0.0
+    assert second.try_consume(1) == 0.0
+    # Both processes drew from the same 2-request bucket
+    assert first.try_consume(1) > 0
+    restarted = SQLiteQuotaBackend(path, 2, 100000, 2)
+    assert restarted.get_stats()["daily_count"] == 2
+    try:
+        restarted.try_consume(1)
+        assert False, "expected RuntimeError"
+    except RuntimeError:
+        pass
+
+def test_async_acquire_keeps_blocking_backends_off_the_loop():
+    class SlowBackend(MemoryQuotaBackend):
+        blocking = True
+        def try_consume(self, tokens):
+            time.sleep(0.2)
+            return super().try_consume(tokens)
+    rl = RateLimiter(600, 100000, 10000, backend=SlowBackend(600, 100000, 10000))
+    ticks = []
+    async def ticker():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.02)
+    async def run():
+        await asyncio.gather(ticker(), rl.acquire_async(1))
+    asyncio.run(run())
+    # The loop kept running while the backend call was in flight
+    assert ticks[-1] - ticks[0] < 0.15
+    assert rl.get_stats()["acquired"] == 1
+
+def test_redis_backend_falls_back_on_server_errors():
+    class RefusingClient:
+        host, port = "localhost", 6379
+        def execute(self, *args):
+            raise RespError("NOAUTH Authentication required.")
+    backend = RedisQuotaBackend(RefusingClient(), 60, 1000, 100)
+    assert backend.try_consume(1) == 0.0
+    assert backend.errors == 1
+
+def test_backend_without_try_consume_cannot_be_created():
+    class Incomplete(QuotaBackend):
+        kind = "incomplete"
+    try:
+        Incomplete()
+        assert False, "expected TypeError"
+    except TypeError as e:
+        assert "try_consume" in str(e)
+
+if __name__ == "__main__":
+    test_waiters_are_served_in_fifo_order()
+    test_acquire_times_out_and_leaves_queue()
+    test_daily_quota_is_enforced()
+    test_async_front_end_shares_buckets()
+    test_memory_backend_apportions_quota_across_workers()
+    test_sqlite_backend_is_shared_and_survives_restart()
+    test_async_acquire_keeps_blocking_backends_off_the_loop()
+    test_redis_backend_falls_back_on_server_errors()
+    test_backend_without_try_consume_cannot_be_created()
@@ -0,0 +1,112 @@
+import threading
+import time
+import numpy as np
+from retrieval import VectorIndex, VectorIndexCache, _index_nbytes
+
+def _index(n=3, dim=4):
+    rng = np.random.default_rng(n)
+    return VectorIndex([f"chunk {i}" for i in range(n)], rng.normal(size=(n, dim)))
+
+def _cos(a, b):
+    a, b = np.array(a), np.array(b)
+    return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-8)
+
+def _reference_search(query_emb, chunk_embs, pool_size, K, lambda_):
+    """The per-chunk pool + MMR loop the endpoints used before VectorIndex."""
+    sim_scores = [_cos(query_emb, emb) for emb in chunk_embs]
+    pool = sorted(range(len(sim_scores)), key=lambda i: sim_scores[i], reverse=True)[:pool_size]
+    pool_embs = [chunk_embs[i] for i in pool]
+    sim_to_query = [_cos(query_emb, emb) for emb in pool_embs]
+    selected, candidates = [], list(range(len(pool_embs)))
+    while len(selected) < min(K, len(pool_embs)) and candidates:
+        if not selected:
+            idx = max(candidates, key=lambda i: sim_to_query[i])
+        else:
+            idx = max(
+                (lambda_ * sim_to_query[i] - (1 - lambda_) * max(_cos(pool_embs[i], pool_embs[j]) for j in selected), i)
+                for i in candidates
+            )[1]
+        selected.append(idx)
+        candidates.remove(idx)
+    return [pool[i] for i in selected]
+
+def test_search_matches_per_chunk_mmr_loop():
+    rng = np.random.default_rng(7)
+    for n, pool_size, K, lambda_ in [(120, 50, 8, 0.7), (60, 60, 15, 0.6), (5, 50, 8, 0.7), (40, 10, 3, 0.3)]:
+        embs = rng.normal(size=(n, 32))
+        index = VectorIndex([f"chunk {i}" for i in range(n)], embs)
+        for _ in range(3):
+            query = rng.normal(size=32)
+            expected = _reference_search(query, list(embs), pool_size, K, lambda_)
+            assert index.search(query, pool_size=pool_size, K=K, lambda_=lambda_) == expected
+    assert VectorIndex.from_chunks([]).search(rng.normal(size=32)) == []
+
+def test_lru_eviction_by_bytes_and_invalidation():
+    size = _index_nbytes(_index(4))
+    cache = VectorIndexCache(max_bytes=size * 2)
+    cache.put("a", _index(4))
+    cache.put("b", _index(4))
+    assert cache.get("a") is not None  # "a" is now most recently used
+    cache.put("c", _index(4))           # over budget: evicts "b"
+    assert cache.get("b") is None and cache.get("a") is not None and cache.get("c") is not None
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1 and stats["bytes_used"] == size * 2
+    assert not cache.put("huge", _index(40)) and cache.get_stats()["entries"] == 2
+
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    stats = cache.get_stats()
+    assert stats["invalidations"] == 1 and stats["bytes_used"] == size
+    loads = []
+    cache.get_or_load("a", lambda: loads.append(1) or _index(4))
+    cache.get_or_load("a", lambda: loads.append(1) or _index(4))
+    assert len(loads) == 1
+    # Empty indexes (document not processed yet) are never cached
+    cache.get_or_load("empty", lambda: VectorIndex.from_chunks([]))
+    assert cache.get("empty") is None
+
+def test_load_started_before_invalidate_is_not_cached():
+    cache = VectorIndexCache()
+    started, release = threading.Event(), threading.Event()
+    def slow_loader():
+        started.set()
+        release.wait(1)
+        return _index(2)  # a partial, mid-ingest view
+    t = threading.Thread(target=cache.get_or_load, args=("doc", slow_loader))
+    t.start()
+    started.wait(1)
+    cache.invalidate("doc")  # ingestion finished while the load was in flight
+    release.set()
+    t.join()
+    assert cache.get("doc") is None
+    assert cache.get_stats()["discarded_loads"] == 1
+    assert len(cache.get_or_load("doc", lambda: _index(5))) == 5
+    assert len(cache.get("doc")) == 5
+
+def test_version_change_and_ttl_force_a_reload():
+    cache = VectorIndexCache(revalidate_seconds=0)
+    version = {"v": "processing:1"}
+    loads = []
+    def loader():
+        loads.append(1)
+        return _index(2 + len(loads))
+    cache.get_or_load("doc", loader, version_fn=lambda: version["v"])
+    cache.get_or_load("doc", loader, version_fn=lambda: version["v"])
+    assert len(loads) == 1
+    version["v"] = "processed:2"  # another worker re-processed the document
+    assert len(cache.get_or_load("doc", loader, version_fn=lambda: version["v"])) == 4
+    assert len(loads) == 2 and cache.get_stats()["stale"] == 1
+    # An unknown version (state read failed) keeps serving the cached index
+    cache.get_or_load("doc", loader, version_fn=lambda: None)
+    assert len(loads) == 2
+
+    cache = VectorIndexCache(ttl_seconds=0.05)
+    cache.put("doc", _index())
+    time.sleep(0.06)
+    assert cache.get("doc") is None and cache.get_stats()["expirations"] == 1
+
+if __name__ == "__main__":
+    test_search_matches_per_chunk_mmr_loop()
+    test_lru_eviction_by_bytes_and_invalidation()
+    test_load_started_before_invalidate_is_not_cached()
+    test_version_change_and_ttl_force_a_reload()
@@ -0,0 +1,45 @@
+import threading
+import time
+from single_flight import SingleFlight
+
+def test_concurrent_identical_calls_run_once():
+    group = SingleFlight("test_identical")
+    calls = []
+    def slow(x):
+        calls.append(x)
+        time.sleep(0.1)
+        return x * 2
+    results = []
+    key = SingleFlight.make_key("op", [1, 2, 3])
+    threads = [threading.Thread(target=lambda: results.append(group.do(key, slow, 21))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [42] * 5
+    assert calls == [21]
+    stats = group.get_stats()
+    assert stats["executed"] == 1 and stats["coalesced"] == 4 and stats["in_flight"] == 0
+
+def test_nothing_is_cached_after_completion():
+    group = SingleFlight("test_sequential")
+    calls = []
+    group.do("k", calls.append, 1)
+    group.do("k", calls.append, 2)
+    assert calls == [1, 2]
+
+def test_errors_propagate_and_clear_the_key():
+    group = SingleFlight("test_errors")
+    def boom():
+        raise ValueError("nope")
+    try:
+        group.do("k", boom)
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    assert group.do("k", lambda: "ok") == "ok"
+
+if __name__ == "__main__":
+    test_concurrent_identical_calls_run_once()
+    test_nothing_is_cached_after_completion()
+    test_errors_propagate_and_clear_the_key()
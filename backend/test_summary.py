@@ -0,0 +1,81 @@
+import json
+import re
+import time
+import types
+from contextlib import contextmanager
+import pipeline
+from pipeline import generate_summary, _summarize_packed
+
+def _chunks(n):
+    return [{"text": f"Clause {i}: the tenant pays a fee of {i} pounds on renewal."} for i in range(n)]
+
+@contextmanager
+def _model(packed_reply, single_delay=lambda clause: 0, fail_single=()):
+    """Stand-in model: packed prompts get `packed_reply(indices)`, single-chunk prompts one bullet each."""
+    calls = {"packed": [], "single": [], "finished": []}
+    def generate(model, contents, config=None):
+        if "one object per chunk" in contents:
+            indices = [int(i) for i in re.findall(r"\[\[chunk (\d+)\]\]", contents)]
+            calls["packed"].append(indices)
+            return types.SimpleNamespace(text=packed_reply(indices))
+        if "as ONE short bullet" in contents:
+            clause = int(re.search(r"Clause (\d+):", contents).group(1))
+            calls["single"].append(clause)
+            time.sleep(single_delay(clause))
+            calls["finished"].append(clause)
+            if clause in fail_single:
+                raise RuntimeError("503 model overloaded")
+            return types.SimpleNamespace(text=f"- single bullet {clause}")
+        return types.SimpleNamespace(text="[]")  # risk inference
+    original = pipeline.llm
+    pipeline.llm = types.SimpleNamespace(generate=generate)
+    try:
+        yield calls
+    finally:
+        pipeline.llm = original
+
+def test_packed_reply_validation_drops_missing_duplicate_and_out_of_range_indices():
+    reply = [
+        {"index": 0, "bullet": "- packed bullet 0"},
+        {"index": 0, "bullet": "a second bullet for 0"},
+        {"index": 2, "bullet": "packed bullet 2"},
+        {"index": 99, "bullet": "not a chunk in this pack"},
+        {"index": "three", "bullet": "unparseable index"},
+        {"index": 1, "bullet": "   "},
+        "not an object",
+    ]
+    with _model(lambda indices: json.dumps(reply)):
+        found = _summarize_packed([(i, c["text"]) for i, c in enumerate(_chunks(4))])
+    assert found == {0: "packed bullet 0", 2: "packed bullet 2"}
+
+def test_chunks_missing_from_the_packed_reply_fall_back_to_single_calls():
+    def reply(indices):
+        return "```json\n" + json.dumps([{"index": i, "bullet": f"packed bullet {i}"} for i in indices if i not in (3, 7)]) + "\n```"
+    with _model(reply) as calls:
+        summary = generate_summary(_chunks(10), mode="packed")
+    assert calls["packed"] == [list(range(10))] and sorted(calls["single"]) == [3, 7]
+    expected = [f"single bullet {i}" if i in (3, 7) else f"packed bullet {i}" for i in range(10)]
+    assert summary["bullets"] == expected
+
+def test_unparseable_packed_reply_falls_back_for_every_chunk():
+    with _model(lambda indices: "Here are your bullets: 1) fees 2) renewal") as calls:
+        summary = generate_summary(_chunks(5), mode="auto")
+    assert len(calls["packed"]) == 1 and sorted(calls["single"]) == list(range(5))
+    assert summary["bullets"] == [f"single bullet {i}" for i in range(5)]
+
+def test_per_chunk_bullets_keep_chunk_order_when_calls_finish_out_of_order():
+    chunks = _chunks(6)
+    # Later chunks answer sooner; chunk 2's call fails
+    with _model(lambda indices: "[]", single_delay=lambda clause: 0.03 * (6 - clause), fail_single=(2,)) as calls:
+        summary = generate_summary(chunks, mode="per_chunk", concurrency=6)
+    assert not calls["packed"] and sorted(calls["single"]) == list(range(6))
+    assert calls["finished"] != sorted(calls["finished"])
+    expected = [f"single bullet {i}" for i in range(6)]
+    expected[2] = chunks[2]["text"].strip()[:120]  # only the failed chunk falls back to its snippet
+    assert summary["bullets"] == expected
+
+if __name__ == "__main__":
+    test_packed_reply_validation_drops_missing_duplicate_and_out_of_range_indices()
+    test_chunks_missing_from_the_packed_reply_fall_back_to_single_calls()
+    test_unparseable_packed_reply_falls_back_for_every_chunk()
+    test_per_chunk_bullets_keep_chunk_order_when_calls_finish_out_of_order()
@@ -3,8 +3,8 @@ import os
 import logging
 from typing import Dict, Any, Optional
 from datetime import datetime
-from google import genai
 from google.genai import types
+from llm_gateway import get_llm_gateway
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -15,7 +15,7 @@ class TokenCounter:
         self._api_key = os.getenv("GEMINI_API_KEY")
         if not self._api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
-        self.client = genai.Client(api_key=self._api_key)
+        self.llm = get_llm_gateway()
         
         # Token usage tracking
         self.session_usage = {
@@ -30,7 +30,7 @@ class TokenCounter:
         """Count tokens before making a request to estimate costs."""
         try:
             # Count tokens in the prompt
-            token_response = self.client.models.count_tokens(
+            token_response = self.llm.count_tokens(
                 model=model,
                 contents=prompt
             )